@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decisions per second and quality of the 2-cycle bandits.
+
+For every period with at least two 2-cycles, each algorithm picks its best arm
+from the same environment, with the same budget (iters_per_arm). The quality of
+a pick is the fraction of held-out futures, shared by all algorithms, in which
+taking its cycle now keeps the optimal number of matches (same_rewards).
+
+    python -m matching.analyses.bandit_benchmark --algorithms UCB1 Thompson Halving
+"""
+
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from matching.bandits.exp3 import EXP3
+from matching.bandits.halving import SequentialHalving
+from matching.bandits.thompson import Thompson
+from matching.bandits.ucb1 import UCB1
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.utils.env_utils import two_cycles
+from matching.utils.futures import FuturePool, death_times
+
+
+ALGORITHMS = {"UCB1": lambda env, t, ipa: UCB1(env, t, c=.1, iters_per_arm=ipa),
+              "Thompson": lambda env, t, ipa: Thompson(env, t, iters_per_arm=ipa),
+              "EXP3": lambda env, t, ipa: EXP3(env, t, iters_per_arm=ipa),
+              "Halving": lambda env, t, ipa: SequentialHalving(env, t, iters_per_arm=ipa)}
+
+
+def quality(holdout, cycle):
+    # Same window as the bandits' rewards: up to the death of the last pair
+    return np.mean([holdout.same_rewards(k, cycle,
+                                         max(death_times(holdout.future(k), cycle)))
+                    for k in range(len(holdout))])
+
+
+def benchmark(env, periods, algorithms=ALGORITHMS, ipa=20, n_holdout=20, seed=0):
+    records = []
+    for t in periods:
+        if len(two_cycles(env, t)) < 2:
+            continue
+        holdout = FuturePool(env, t, None, n_holdout, seed=seed + t)
+        for name in algorithms:
+            np.random.seed(seed)
+            t0 = time()
+            algo = ALGORITHMS[name](env, t, ipa)
+            algo.simulate()
+            arm = algo.arms[algo.best_arms()[0]]
+            seconds = time() - t0
+            records.append({"algorithm": name,
+                            "t": t,
+                            "n_arms": algo.n_arms,
+                            "seconds": seconds,
+                            "quality": quality(holdout, arm)})
+    return pd.DataFrame(records)
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Bandit decisions per second and quality")
+    parser.add_argument("--algorithms", nargs="+", default=["UCB1", "Thompson", "Halving"])
+    parser.add_argument("--periods", nargs="+", type=int, default=list(range(5, 50, 5)))
+    parser.add_argument("--entry_rate", type=float, default=5)
+    parser.add_argument("--death_rate", type=float, default=.1)
+    parser.add_argument("--ipa", type=int, default=20)
+    parser.add_argument("--n_holdout", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    env = ABOKidneyExchange(entry_rate=args.entry_rate,
+                            death_rate=args.death_rate,
+                            time_length=max(args.periods) + 50,
+                            seed=args.seed)
+
+    df = benchmark(env, args.periods, args.algorithms,
+                   ipa=args.ipa, n_holdout=args.n_holdout, seed=args.seed)
+
+    print(df.to_string())
+    summary = df.groupby("algorithm").agg(seconds=("seconds", "mean"),
+                                          quality=("quality", "mean"))
+    summary["decisions_per_second"] = 1 / summary["seconds"]
+    print(summary)
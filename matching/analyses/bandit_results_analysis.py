@@ -11,39 +11,26 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from itertools import product
 from scipy.stats import ttest_rel
-sns.set_style("white")
 
-#scp -P 22022 baisihad@sirius.bc.edu:/data/baisihad/matching/results/bandit_results3.txt results/      
-#
+from matching.bandits.results import BanditResultStore
 
+sns.set_style("white")
 
-df = pd.read_csv("/Users/vitorhadad/Documents/kidney/matching/results/bandit_results_Feb15.txt",
-                 names=["algorithm", "param", "thres",
-                        "environment", "seed", "time",
-                        "entry", "death", "rewards",
-                        "greedy", "optimal"])
+# Per-run averages from the results store of run_bandits.py. Older text
+# results can be loaded once with store.import_text(path)
+store = BanditResultStore("/Users/vitorhadad/Documents/kidney/matching/results/results.db")
 
 envs = ["ABO", "RSU", "OPTN"]
 algos = ["UCB1", "Thompson", "EXP3"]
 
-# Keep only runs between 500 and 1000
-df["max_time"] = df.groupby("seed")["time"] \
-                    .transform(max)
-df = df.query("max_time >= 250")
-df = df.query("time < 1000")
-df = df.query("entry < 10")
-
-
-# Fill older runs
-df["environment"] = df["environment"].fillna("ABO(5,.1,12345)")
-df["env"] = df["environment"].apply(lambda s: s.split("(")[0])
-
-# Fill thompson sampling parameters
-
-param = 0.1
-thres = 0.5
-df["param"] = df["param"].fillna(param) # So we don't have to deal with thompson separately when plotting
-df = df.query("param == 0.1 & thres == 0.5")
+# Keep only runs that reached 250, up to period 1000
+# Thompson has no param, so we don't have to deal with it separately when plotting
+df = store.run_means(t_max=999,
+                     min_max_t=250,
+                     where="entry_rate < 10 AND (param = 0.1 OR param IS NULL) "
+                           "AND thres = 0.5")
+df = df.rename(columns={"entry_rate": "entry", "death_rate": "death",
+                        "reward": "rewards"})
 
 missing = []
 # HEATMAPS
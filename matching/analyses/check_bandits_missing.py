@@ -1,52 +1,17 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from itertools import product
+from matching.bandits.results import BanditResultStore
 
-sns.set_style("white")
-
-# scp -P 22022 baisihad@sirius.bc.edu:/data/baisihad/matching/results/bandit_results3.txt results/
-#
-
-
-df = pd.read_csv("/Users/vitorhadad/Documents/kidney/matching/results/bandit_results_Feb14.txt",
-                 names=["algorithm", "param", "thres", "environment",
-                        "seed", "time", "entry", "death", "rewards", "greedy", "optimal"])
+# Results of run_bandits.py. Older text results can be loaded once with
+# store.import_text("results/bandit_results_Feb14.txt")
+store = BanditResultStore("results/results.db")
 
 envs = ["ABO", "RSU", "OPTN"]
 algos = ["UCB1", "Thompson", "EXP3"]
 
-# Keep only runs between 500 and 1000
-df["max_time"] = df.groupby("seed")["time"].transform(max)
-df = df.query("max_time >= 700")
-df = df.query("time > 500")
-
-# Fill older runs
-df["environment"] = df["environment"].fillna("ABO(5,.1,12345)")
-df["env"] = df["environment"].apply(lambda s: s.split("(")[0])
-
-# Fill thompson sampling parameters
-
-param = 0.1
-thres = 0.5
-df["param"] = df["param"].fillna(param)  # So we don't have to deal with thompson separately when plotting
-
-df = df.query("param == 0.1 & thres == 0.5")
-
-
-idx = pd.MultiIndex\
-    .from_product([envs, algos, [3, 5, 7], [5, 8, 10]],
-                  names=["environment", "algorithm", "entry", "death"])
-
-max_times = df.groupby(["env", "algorithm", "entry", "death", "seed"])\
-                ["time"].max()
-
-completed = df.groupby(["env", "algorithm", "entry", "death"])\
-            ["seed"].nunique()\
-            .loc[idx].fillna(0)
-
-missing = completed\
-            .pipe(lambda x: x < 3)\
-            .index.tolist()
+# Runs that reached period 700, with the usual parameters
+# (Thompson has no param, so we don't have to deal with it separately)
+missing = store.missing(envs, algos, [3, 5, 7], [5, 8, 10],
+                        n_seeds=3,
+                        min_max_t=700,
+                        where="(param = 0.1 OR param IS NULL) AND thres = 0.5")
 
 print(missing)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-iteration linear algebra cost of CombinatorialBandit.
+
+Builds the arm matrix V of random 2-cycles (plus the empty cycle) for
+increasing numbers of pairs, and times one iteration's E[vv'] and pseudo-loss:
+the former Python loop over arms with an explicit inverse, against
+V' diag(p) V with a Cholesky solve, on the dense and on the CSR arm matrix.
+Also reports the memory taken by each arm matrix.
+
+    python -m matching.analyses.combinatorial_benchmark --n_cycles 10 20 30
+"""
+
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from matching.bandits.combinatorial import get_arm_matrix, pseudo_loss
+
+
+def loop_pseudo_loss(V, p, v, c):
+    """Previous implementation, for reference."""
+    N, d = V.shape
+    EVV = np.zeros(shape=(d, d))
+    for i in range(N):
+        EVV += p[i] * V[i, :, np.newaxis] * V[i, :, np.newaxis].T
+    return c * (np.linalg.inv(EVV) @ v[:, np.newaxis]).flatten()
+
+
+def random_cycles(n_cycles, n_pairs, rng):
+    cycles = set()
+    while len(cycles) < n_cycles:
+        cycles.add(tuple(sorted(rng.choice(n_pairs, size=2, replace=False))))
+    return sorted(cycles) + [()]
+
+
+def time_per_iteration(fn, V, p, v, repeats):
+    t0 = time()
+    for _ in range(repeats):
+        fn(V, p, v, -1.)
+    return (time() - t0) / repeats
+
+
+def benchmark(n_cycles, max_match=3, repeats=5, seed=0):
+    rng = np.random.RandomState(seed)
+    records = []
+    for n in n_cycles:
+        V = get_arm_matrix(random_cycles(n, 2 * n, rng), max_match)
+        dense = V.toarray()
+        p = rng.dirichlet(np.ones(V.shape[0]))
+        v = dense[rng.randint(V.shape[0])]
+        assert np.allclose(loop_pseudo_loss(dense, p, v, -1.), pseudo_loss(V, p, v, -1.))
+        records.append({"n_cycles": n,
+                        "n_arms": V.shape[0],
+                        "dense_mb": dense.nbytes / 2**20,
+                        "sparse_mb": (V.data.nbytes + V.indices.nbytes + V.indptr.nbytes) / 2**20,
+                        "loop_seconds": time_per_iteration(loop_pseudo_loss, dense, p, v, repeats),
+                        "blas_seconds": time_per_iteration(pseudo_loss, dense, p, v, repeats),
+                        "sparse_seconds": time_per_iteration(pseudo_loss, V, p, v, repeats)})
+    df = pd.DataFrame(records)
+    df["speedup"] = df["loop_seconds"] / df["blas_seconds"]
+    return df
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="CombinatorialBandit linear algebra cost")
+    parser.add_argument("--n_cycles", nargs="+", type=int, default=[10, 20, 30, 40])
+    parser.add_argument("--max_match", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(benchmark(args.n_cycles, args.max_match, args.repeats, args.seed).to_string())
@@ -6,63 +6,70 @@ Created on Sat Feb  3 16:49:48 2018
 @author: halflearned
 """
 
-from random import choice
 from time import time
-from os import system
-from sys import platform
 
 from matching.environment.abo_environment import ABOKidneyExchange
 from matching.environment.optn_environment import OPTNKidneyExchange
 from matching.environment.saidman_environment import SaidmanKidneyExchange
 from matching.trimble_solver.interface import optimal, greedy
 
-entry_rate = choice([3, 5, 7])
-death_rate = choice([0.05, 0.075, .1, .25, .5])
-max_chain = choice([0, 1, 2])
-max_cycle = choice([2, 3])
-if max_chain > 0:
-    frac_ndd = choice([0.05, 0.1])
-else:
-    frac_ndd = 0
-time_length = 1000
 
-t = time()
+def run(environment, entry_rate, death_rate, max_cycle, max_chain, frac_ndd, seed,
+        time_length=1000):
+    """Objective of the optimal and greedy matchings on one environment."""
 
-print("Entry:", entry_rate,
-      "Death", death_rate,
-      "Cycle", max_cycle,
-      "Chain", max_chain)
+    t = time()
 
-env_params = dict(entry_rate=entry_rate,
-                  death_rate=death_rate,
-                  time_length=time_length,
-                  fraction_ndd=frac_ndd)
+    print("Entry:", entry_rate,
+          "Death", death_rate,
+          "Cycle", max_cycle,
+          "Chain", max_chain)
 
-envname, env = choice([
-    ("OPTN", OPTNKidneyExchange(entry_rate,  death_rate, time_length)),
-    ("RSU",  SaidmanKidneyExchange(entry_rate, death_rate, time_length)),
-    ("ABO",  ABOKidneyExchange(**env_params))])
+    if environment == "OPTN":
+        env = OPTNKidneyExchange(entry_rate, death_rate, time_length, seed=seed)
+    elif environment == "RSU":
+        env = SaidmanKidneyExchange(entry_rate, death_rate, time_length, seed=seed)
+    else:
+        env = ABOKidneyExchange(entry_rate=entry_rate,
+                                death_rate=death_rate,
+                                time_length=time_length,
+                                fraction_ndd=frac_ndd,
+                                seed=seed)
 
-print("\tSolving optimal")
-opt = optimal(env, max_cycle=max_cycle, max_chain=max_chain)
+    print("\tSolving optimal")
+    opt = optimal(env, max_cycle=max_cycle, max_chain=max_chain)
 
-print("\tSolving greedy")
-gre = greedy(env, max_cycle=max_cycle, max_chain=max_chain)
+    print("\tSolving greedy")
+    gre = greedy(env, max_cycle=max_cycle, max_chain=max_chain)
 
-t_diff = time() - t
-res = [envname,
-       env.entry_rate, env.death_rate, env.time_length, frac_ndd,
-       max_cycle, max_chain,
-       opt["obj"], gre["obj"],
-       gre["obj"] / opt["obj"],
-       t_diff]
+    return {"opt": opt["obj"],
+            "greedy": gre["obj"],
+            "ratio": gre["obj"] / opt["obj"],
+            "time": time() - t}
 
-print(res)
 
-if platform == "linux":
+if __name__ == "__main__":
 
-    with open("results/greedy_opt_comparison_results_trimble.txt", "a") as f:
-        f.write(",".join([str(s) for s in res]) + "\n")
+    from argparse import ArgumentParser
 
-    system("qsub job_comparison.pbs")
+    from matching.utils.runner import param_grid, ResultStore, run_experiment
 
+    parser = ArgumentParser(description="Greedy vs optimal sweep")
+    parser.add_argument("--n_seeds", type=int, default=1)
+    parser.add_argument("--n_jobs", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--store", default="results/results.db")
+    args = parser.parse_args()
+
+    # Ndds are only drawn when chains are allowed
+    grid = [p for p in param_grid(environment=["OPTN", "RSU", "ABO"],
+                                  entry_rate=[3, 5, 7],
+                                  death_rate=[0.05, 0.075, .1, .25, .5],
+                                  max_chain=[0, 1, 2],
+                                  max_cycle=[2, 3],
+                                  frac_ndd=[0, 0.05, 0.1],
+                                  seed=range(args.n_seeds))
+            if (p["max_chain"] > 0) == (p["frac_ndd"] > 0)]
+
+    run_experiment("greedy_opt_comparison", run, grid, ResultStore(args.store),
+                   n_jobs=args.n_jobs, timeout=args.timeout)
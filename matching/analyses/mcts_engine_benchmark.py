@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Times the configurations of the MCTS engine for each variant.
+
+Every variant (the Strategy of mcts, mcts_greedy, mcts_supergreedy and
+mcts_increasing) makes a decision from the same environment and period with
+each configuration: plain, with transpositions, with shared futures, and with
+root or leaf parallelization. Reports the time per decision and the actions
+chosen. The searches are random, so the chosen actions need not agree.
+
+    python -m matching.analyses.mcts_engine_benchmark --periods 5 10 --tpa 3
+"""
+
+from time import time
+
+import pandas as pd
+
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.tree_search import engine
+
+
+VARIANTS = {"mcts": engine.Strategy,
+            "mcts_greedy": engine.GreedyStrategy,
+            "mcts_supergreedy": engine.SuperGreedyStrategy,
+            "mcts_increasing": engine.IncreasingStrategy}
+
+CONFIGS = {"plain": {},
+           "transpositions": dict(transpositions=True),
+           "futures": dict(n_futures=4),
+           "root": dict(n_workers=2, parallel="root"),
+           "leaf": dict(n_workers=2, parallel="leaf")}
+
+
+def benchmark(env, periods, variants=VARIANTS, configs=CONFIGS, net=None, **kwargs):
+    records = []
+    for name in variants:
+        strategy = VARIANTS[name](net)
+        for config in configs:
+            for t in periods:
+                rec = {"variant": name, "config": config, "t": t}
+                t0 = time()
+                try:
+                    rec["action"] = engine.mcts(env, t, strategy, **CONFIGS[config], **kwargs)
+                except Exception as e:
+                    # e.g. mcts_increasing needs a policy network, and only
+                    # mcts evaluates shared futures
+                    rec["action"] = "error: {!r}".format(e)
+                rec["seconds"] = time() - t0
+                records.append(rec)
+    return pd.DataFrame(records)
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Configurations of the MCTS engine")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS))
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS))
+    parser.add_argument("--periods", nargs="+", type=int, default=[5, 10, 15])
+    parser.add_argument("--entry_rate", type=float, default=5)
+    parser.add_argument("--death_rate", type=float, default=.1)
+    parser.add_argument("--tpa", type=float, default=5)
+    parser.add_argument("--tree_horizon", type=int, default=None)
+    parser.add_argument("--rollout_horizon", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    env = ABOKidneyExchange(entry_rate=args.entry_rate,
+                            death_rate=args.death_rate,
+                            time_length=max(args.periods) + 50,
+                            seed=args.seed)
+
+    df = benchmark(env, args.periods, args.variants, args.configs,
+                   tpa=args.tpa,
+                   tree_horizon=args.tree_horizon,
+                   rollout_horizon=args.rollout_horizon)
+
+    print(df.to_string())
+    print(df.pivot_table(index="variant", columns="config", values="seconds"))
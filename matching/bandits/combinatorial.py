@@ -7,14 +7,16 @@ Created on Wed Feb  7 16:58:07 2018
 """
 
 import numpy as np
+from array import array
 from random import choice
 from matching.utils.env_utils import two_cycles, snapshot
 from matching.utils.data_utils import clock_seed
 from matching.solver.kidney_solver2 import optimal
 
-from typing import List
-from itertools import combinations, product
-from itertools import chain
+from typing import Iterator, List, Optional, Tuple
+from itertools import chain, islice
+from scipy import sparse
+from scipy.linalg import cho_factor, cho_solve
 from scipy.stats import geom
 
 
@@ -22,13 +24,19 @@ class CombinatorialBandit:
 
     def __init__(self, env, t: int, gamma: float = .1,
                  iters_per_arm: int = 100,
-                 max_match: int = 5):
+                 max_match: int = 5,
+                 max_combos: Optional[int] = None,
+                 sample: bool = False):
         self.env = env
         self.t = t
         self.max_match = max_match
         self.cycles = two_cycles(env, t) + [()]
-        self.arms = get_arm_matrix(self.cycles, max_match)
-        self.n_arms = len(self.arms)
+        self.arms = get_arm_matrix(self.cycles, max_match,
+                                   max_combos=max_combos,
+                                   sample=sample,
+                                   seed=np.random.randint(2**31))
+        self.n_arms = self.arms.shape[0]
+        self.vertices, self.offsets = get_arm_vertices(self.cycles, self.arms)
 
         self.h = max(2, int(geom(env.death_rate).ppf(.9)))
         self.w = np.ones(self.n_arms)
@@ -54,115 +62,215 @@ class CombinatorialBandit:
 
             # 2. Draw action
             a = np.random.choice(self.n_arms, p=self.p)
-            v = self.arms[a]
+            v = np.zeros(self.arms.shape[1])
+            v[self.arm_cycles(a)] = 1
 
             # 3. Take action, observe rewards
-            c = self.get_cost(v)
+            c = self.get_cost(a)
 
-            # 4. Outer product matrix
-            p_matrix = exact_outer_product(self.arms, self.p)
-            p_inv = np.linalg.inv(p_matrix)
-
-            # 5. Update pseudo-loss
-            ltilde = c * (p_inv @ v[:, np.newaxis])
+            # 4-5. Outer product matrix and pseudo-loss
+            ltilde = pseudo_loss(self.arms, self.p, v, c)
 
             # 6. Update weights
-            self.q = self.q * np.exp(-self.gamma * self.arms @ ltilde).flatten()
+            self.q = self.q * np.exp(-self.gamma * self.arms @ ltilde)
             self.q /= self.q.sum()
 
 
     def choose(self):
         best_idx = np.argwhere(self.p == np.max(self.p)).flatten()
-        best_arm = self.arms[choice(best_idx)]
-        best = list(chain(*[self.cycles[i] for i, x in enumerate(best_arm) if x == 1]))
-        return best
+        return self.arm_vertices(choice(best_idx)).tolist()
+
+    def arm_cycles(self, a: int) -> np.ndarray:
+        """Indices of the cycles of arm a."""
+        return self.arms.indices[self.arms.indptr[a]:self.arms.indptr[a + 1]]
+
+    def arm_vertices(self, a: int) -> np.ndarray:
+        """Pairs matched by arm a."""
+        return self.vertices[self.offsets[a]:self.offsets[a + 1]]
 
-    def get_cost(self, v: np.ndarray):
-        cycle = list(chain(*[self.cycles[i] for i,x in enumerate(v) if x == 1]))
+    def get_cost(self, a: int):
+        cycle = self.arm_vertices(a)
         snap = snapshot(self.env, self.t)
-        snap.removed_container[self.t].update(cycle)
+        snap.removed_container[self.t].update(cycle.tolist())
         snap.populate(self.t + 1, self.t + self.h + 1, seed=clock_seed())
         reward = optimal(snap, self.t, self.h + 1)["obj"] + len(cycle)
         return -(reward / self.h)
 
 
 
-def get_cycle_combos(cycles: List[tuple],
-                     max_match: int) -> List[list]:
+def iter_cycle_combos(cycles: List[tuple],
+                      max_match: int) -> Iterator[list]:
+    """
+    Vertex-disjoint sets of at most max_match cycles, as lists of indices
+    into cycles, smallest sets first and in lexicographic order within a size.
+
+    Each cycle is a bitmask over the pool's vertices, and each cycle i keeps the
+    bitmask of later cycles disjoint from it. Sets are grown by a DFS over
+    cycles ordered by index, intersecting those bitmasks, so nothing is
+    materialized and disjointness is a single AND. Empty cycles (doing
+    nothing) only appear on their own.
+    """
+    vertex_bit = {}
+    masks = []
+    for c in cycles:
+        mask = 0
+        for v in c:
+            mask |= 1 << vertex_bit.setdefault(v, len(vertex_bit))
+        masks.append(mask)
+
+    n = len(cycles)
+    compatible = []
+    for i in range(n):
+        later = 0
+        if masks[i]:
+            for j in range(i + 1, n):
+                if masks[j] and not masks[i] & masks[j]:
+                    later |= 1 << j
+        compatible.append(later)
+
+    for i in range(n):
+        yield [i]
+
+    def extend(chosen, candidates, size):
+        if len(chosen) == size:
+            yield list(chosen)
+            return
+        # Not enough disjoint cycles left to reach size
+        if bin(candidates).count("1") < size - len(chosen):
+            return
+        while candidates:
+            low = candidates & -candidates
+            j = low.bit_length() - 1
+            candidates ^= low
+            chosen.append(j)
+            yield from extend(chosen, candidates & compatible[j], size)
+            chosen.pop()
+
+    for size in range(2, max_match + 1):
+        found = False
+        for i in range(n):
+            for combo in extend([i], compatible[i], size):
+                found = True
+                yield combo
+        if not found:
+            break
+
+
+def cycle_combo_arrays(cycles: List[tuple],
+                       max_match: int,
+                       max_combos: Optional[int] = None,
+                       sample: bool = False,
+                       seed: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
     """
+    Combinations of cycles in CSR layout: combination k is
+    indices[indptr[k]:indptr[k + 1]]. Combinations are written into growing
+    buffers as they are enumerated, so memory is a few bytes per entry rather
+    than a Python list per combination.
 
     Parameters
     ----------
-    max_match
     cycles : List[tuple]
+    max_match : maximum number of cycles in a combination
+    max_combos : if given, keep at most this many combinations of two or
+        more cycles (single cycles are always kept): the first ones, that is
+        the smallest, or a uniform sample of all of them if sample is True
+    sample : sample instead of truncating
+    seed : seed of the sample
 
     Returns
     -------
+    indptr, indices
 
     """
+    combos = iter_cycle_combos(cycles, max_match)
+    indptr = array("q", [0])
+    indices = array("i")
+
+    def append(combo):
+        indices.extend(combo)
+        indptr.append(len(indices))
+
+    for combo in islice(combos, len(cycles)):
+        append(combo)
+
+    if max_combos is None:
+        for combo in combos:
+            append(combo)
+    elif not sample:
+        for combo in islice(combos, max_combos):
+            append(combo)
+    else:
+        # Reservoir sampling, so memory stays bounded by max_combos
+        rng = np.random.RandomState(seed)
+        reservoir = []
+        for k, combo in enumerate(combos):
+            if k < max_combos:
+                reservoir.append(combo)
+            else:
+                r = rng.randint(k + 1)
+                if r < max_combos:
+                    reservoir[r] = combo
+        for combo in sorted(reservoir, key=lambda c: (len(c), c)):
+            append(combo)
+
+    print("Found {} cycle combinations".format(len(indptr) - 1))
+    return (np.frombuffer(indptr, dtype=np.int64),
+            np.frombuffer(indices, dtype=np.int32))
 
-    mapping = {tuple(v): k for k, v in enumerate(cycles)}
-    combos = {1: [[c] for c in cycles]}
-
-    if max_match >= 2:
-        combos[2] = []
-        for c1, c2 in combinations(combos[1], 2):
-            combo = c1 + c2
-            if len(set(chain(*combo))) == 4:
-                combos[2].append(list(combo))
-
-    if max_match >= 3:
-        combos[3] = []
-        for c1, c2 in product(combos[1], combos[2]):
-            combo = c1 + c2
-            if len(set(chain(*combo))) == 6:
-                combos[3].append(combo)
-
-    if max_match >= 4:
-        combos[4] = []
-        for c1, c2 in combinations(combos[2], 2):
-            combo = c1 + c2
-            if len(set(chain(*combo))) == 8:
-                combos[4].append(combo)
-
-    if max_match >= 5:
-        combos[5] = []
-        for c1, c2, c3 in product(combos[1], combos[2], combos[2]):
-            combo = c1 + c2 + c3
-            if len(set(chain(*combo))) == 10:
-                combos[5].append(combo)
-
-        for c1, c2 in product(combos[1], combos[4]):
-            combo = c1 + c2
-            if len(set(chain(*combo))) == 10:
-                combos[5].append(combo)
-
-    if max_match > 5:
-        raise NotImplementedError
-
-    cycle_combos = []
-    for k,cmbs in combos.items():
-        for cmb in cmbs:
-            cycle_combos.append([mapping[c] for c in cmb])
-
-    print("Found {} cycle combinations".format(len(cycle_combos)))
-    return cycle_combos
 
+def get_cycle_combos(cycles: List[tuple],
+                     max_match: int,
+                     **kwargs) -> List[list]:
+    """Combinations of cycles (see cycle_combo_arrays for the arguments), each
+    a list of indices into cycles."""
+    indptr, indices = cycle_combo_arrays(cycles, max_match, **kwargs)
+    return [indices[a:b].tolist() for a, b in zip(indptr[:-1], indptr[1:])]
 
-def get_arm_matrix(cycles: List[tuple],
-                   max_match: int) -> np.ndarray:
-    cycle_combos = get_cycle_combos(cycles, max_match)
-
-    V = np.zeros((len(cycle_combos), len(cycles)))
-    for i, c in enumerate(cycle_combos):
-        V[i, c] = 1
 
-    return V
+def get_arm_matrix(cycles: List[tuple],
+                   max_match: int,
+                   **kwargs) -> sparse.csr_matrix:
+    """Arms (cycle combinations) by cycles, in CSR format: each row has at
+    most max_match ones."""
+    indptr, indices = cycle_combo_arrays(cycles, max_match, **kwargs)
+    return sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+                             shape=(len(indptr) - 1, len(cycles)))
 
 
-def exact_outer_product(V: np.ndarray, w: np.ndarray) -> np.ndarray:
-    N, d = V.shape
-    EVV = np.zeros(shape=(d, d))
-    for i in range(N):
-        EVV += w[i] * V[i, :, np.newaxis] * V[i, :, np.newaxis].T
-    return EVV
+def get_arm_vertices(cycles: List[tuple],
+                     V: sparse.csr_matrix) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs matched by each arm, as one flat array of vertices and offsets into
+    it: the pairs of arm a are vertices[offsets[a]:offsets[a + 1]], in the
+    order of the arm's cycles.
+    """
+    lengths = np.array([len(c) for c in cycles], dtype=np.int64)
+    cycle_offsets = np.zeros(len(cycles) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=cycle_offsets[1:])
+    cycle_vertices = np.fromiter(chain.from_iterable(cycles), dtype=np.int64,
+                                 count=cycle_offsets[-1])
+
+    # Position in cycle_vertices of every vertex of every (arm, cycle) entry
+    entry_lengths = lengths[V.indices]
+    n_vertices = entry_lengths.sum()
+    entry_starts = np.cumsum(entry_lengths) - entry_lengths
+    idx = np.repeat(cycle_offsets[V.indices] - entry_starts, entry_lengths) \
+        + np.arange(n_vertices)
+
+    offsets = np.zeros(V.shape[0] + 1, dtype=np.int64)
+    np.cumsum(V @ lengths, out=offsets[1:])
+    return cycle_vertices[idx], offsets
+
+
+def exact_outer_product(V, w: np.ndarray) -> np.ndarray:
+    """E[vv'] = sum_i w[i] V[i]' V[i] = V' diag(w) V, as one matrix product.
+    V may be dense or sparse; the d x d result is dense."""
+    if sparse.issparse(V):
+        return (V.T @ sparse.diags(w) @ V).toarray()
+    return (V.T * w) @ V
+
+
+def pseudo_loss(V, p: np.ndarray, v: np.ndarray, c: float) -> np.ndarray:
+    """c * E[vv']^-1 v, by a Cholesky solve. E[vv'] is positive definite
+    because every cycle is an arm on its own (a row of V) with p > 0."""
+    return c * cho_solve(cho_factor(exact_outer_product(V, p)), v)
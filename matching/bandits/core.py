@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched bandit core shared by UCB1, Thompson and EXP3.
+
+Each round a policy selects a batch of arms (2-cycles available at t), the
+rewards of the whole batch are computed at once, in a process pool if there is
+one, and the statistics are updated with a single vectorized step. A policy
+only defines how a batch is drawn, how its own parameters are updated and which
+arm it finally chooses:
+
+    class Policy(Bandit):
+        def draw_arms(self, size): ...
+        def update(self, arms, x): ...
+        def best_arms(self): ...
+
+With batch_size=1 the policies pull exactly as the original one-arm-per-loop
+versions did. Rewards are seeded from the global random state, so a run is
+reproducible given np.random.seed whatever the number of workers.
+
+By default every pull samples and populates a fresh future. With n_futures,
+pulls are instead drawn from a FuturePool of that many futures, sampled once
+for the decision and shared by all arms: each arm cycles through the futures,
+truncated at the death of the arm's last pair, so the per-pull cost is the
+solves alone. Its caches live in this process, so it is not used with workers.
+"""
+
+from multiprocessing import Pool
+from random import choice
+
+import numpy as np
+
+from matching.solver.kidney_solver2 import same_rewards
+from matching.utils.env_utils import snapshot, two_cycles
+from matching.utils.futures import FuturePool, death_times
+from matching.utils.profiling import profiled, timer
+
+
+class Bandit:
+
+    def __init__(self, env, t, iters_per_arm=100, thres=0.5,
+                 batch_size=1, n_workers=1, pool=None, n_futures=None):
+        self.env = snapshot(env, t)
+        self.t = t
+        self.arms = two_cycles(self.env, t)
+        self.n_arms = len(self.arms)
+        self.iters_per_arm = iters_per_arm
+        self.thres = thres
+        self.batch_size = batch_size
+        self.n_workers = n_workers
+        self.pool = pool
+
+        self.r = np.zeros(self.n_arms)  # Average rewards
+        self.n = np.zeros(self.n_arms)  # Visits
+
+        if n_futures is not None and (n_workers > 1 or pool is not None):
+            raise ValueError("Shared futures are evaluated in this process, "
+                             "use either n_futures or n_workers")
+        self.futures = None
+        if n_futures is not None:
+            self.futures = FuturePool(self.env, t,
+                                      horizon=None,
+                                      n_futures=n_futures,
+                                      seed=np.random.randint(2**31))
+
+    @profiled("bandit.simulate")
+    def simulate(self):
+        total_iters = self.iters_per_arm * self.n_arms
+
+        own_pool = self.pool is None and self.n_workers > 1
+        if own_pool:
+            self.pool = Pool(self.n_workers)
+
+        try:
+            done = 0
+            while done < total_iters:
+                size = min(self.batch_size, total_iters - done)
+
+                # 1. Draw a batch of arms
+                with timer("bandit.draw_arms"):
+                    arms = self.draw_arms(size)
+
+                # 2. Take actions, observe rewards
+                x = self.get_rewards(arms)
+
+                # 3. Update statistics
+                with timer("bandit.update"):
+                    self.update(arms, x)
+                done += size
+        finally:
+            if own_pool:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+    def choose(self):
+        print("Avg rewards:", self.r)
+        if np.all(self.r <= self.thres):
+            print("Skipping")
+            return None
+        return self.arms[choice(self.best_arms())]
+
+    def draw_arms(self, size):
+        """Indices of the next size arms to pull."""
+        raise NotImplementedError
+
+    def best_arms(self):
+        """Indices of the arms tied for the final choice."""
+        raise NotImplementedError
+
+    def update(self, arms, x):
+        counts = np.bincount(arms, minlength=self.n_arms)
+        sums = np.bincount(arms, weights=x, minlength=self.n_arms)
+        pulled = counts > 0
+        self.r[pulled] = (self.n[pulled] * self.r[pulled] + sums[pulled]) \
+            / (self.n[pulled] + counts[pulled])
+        self.n += counts
+        return counts, sums
+
+    @profiled("bandit.get_rewards")
+    def get_rewards(self, arms):
+        if self.futures is not None:
+            return self.get_shared_rewards(arms)
+        seeds = np.random.randint(2**31, size=len(arms))
+        jobs = [(self.env, self.t, self.arms[a], s) for a, s in zip(arms, seeds)]
+        if self.pool is None:
+            x = list(map(_reward_job, jobs))
+        else:
+            # Jobs of a chunk are pickled together, so env is sent once per chunk
+            chunksize = int(np.ceil(len(jobs) / self.n_workers))
+            x = self.pool.map(_reward_job, jobs, chunksize=chunksize)
+        return np.array(x, dtype=float)
+
+    def get_shared_rewards(self, arms):
+        # The i-th pull of an arm uses future i mod M
+        pulls = self.n.astype(int).copy()
+        x = np.empty(len(arms))
+        for i, a in enumerate(arms):
+            k = pulls[a] % len(self.futures)
+            pulls[a] += 1
+            cycle = self.arms[a]
+            # Up to h, as arm_reward, whose future has no arrivals after h
+            h = max(death_times(self.futures.future(k), cycle))
+            x[i] = self.futures.same_rewards(k, cycle, t_end=h)
+        return x
+
+
+@profiled("arm_reward")
+def arm_reward(env, t, cycle, seed):
+    """Whether taking cycle at t keeps the optimal number of matches, in a
+    future sampled up to the death of its last pair."""
+    # Snapshot, populate and the solver draw from the global state, which is
+    # restored so that serial pulls leave the caller's draws as pooled ones do
+    state = np.random.get_state()
+    try:
+        np.random.seed(seed)
+        snap = snapshot(env, t)
+        h = max(death_times(snap, cycle))
+        snap.populate(t + 1, h + 1, seed=seed)
+        return same_rewards(snap,
+                            t_begin=t,
+                            t_end=h + 1,
+                            perturb=cycle)
+    finally:
+        np.random.set_state(state)
+
+
+def _reward_job(args):
+    return arm_reward(*args)
+
+
+def argmax_ties(x):
+    return np.argwhere(x == np.max(x)).flatten()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sequential halving for best-arm identification among the 2-cycles at t.
+
+The budget is the same iters_per_arm * n_arms pulls as the other bandits, split
+evenly across ceil(log2(n_arms)) rounds. In each round every surviving arm is
+pulled the same number of times, and the worse half of the arms (by average
+reward) is eliminated, so clearly bad arms stop being sampled after the first
+round. Pulls are drawn from futures shared by all arms: in each round the
+survivors are evaluated on the same new futures, and keep their results on the
+futures of previous rounds, so arms are always compared on the same samples.
+With n_futures, fewer futures are sampled and reused in turn.
+"""
+
+import numpy as np
+
+from matching.bandits.core import Bandit
+from matching.utils.futures import FuturePool
+from matching.utils.profiling import profiled
+
+
+class SequentialHalving(Bandit):
+
+    def __init__(self, env, t, iters_per_arm=100, thres=0.5, n_futures=None):
+        super().__init__(env, t, iters_per_arm=iters_per_arm, thres=thres)
+        self.survivors = np.arange(self.n_arms)
+        self.schedule = halving_schedule(self.n_arms, iters_per_arm * self.n_arms)
+        self.futures = FuturePool(self.env, t,
+                                  horizon=None,
+                                  n_futures=n_futures or max(1, sum(self.schedule)),
+                                  seed=np.random.randint(2**31))
+
+
+    def __str__(self):
+        return "SequentialHalving"
+
+
+    @profiled("bandit.simulate")
+    def simulate(self):
+        for pulls in self.schedule:
+            # Every survivor has the same number of pulls, so the k-th pull
+            # of each one uses the same future
+            arms = np.repeat(self.survivors, pulls)
+            self.update(arms, self.get_rewards(arms))
+
+            # Keep the better half, breaking ties at random
+            keep = max(1, int(np.ceil(len(self.survivors) / 2)))
+            order = np.lexsort((np.random.rand(len(self.survivors)),
+                                -self.r[self.survivors]))
+            self.survivors = np.sort(self.survivors[order[:keep]])
+
+
+    def best_arms(self):
+        return self.survivors
+
+
+def halving_schedule(n_arms, budget):
+    """Pulls per surviving arm in each round."""
+    if n_arms == 0:
+        return []
+    if n_arms == 1:
+        # Nothing to eliminate, but its reward is still compared to thres
+        return [budget]
+    n_rounds = int(np.ceil(np.log2(n_arms)))
+    schedule = []
+    n = n_arms
+    for _ in range(n_rounds):
+        schedule.append(max(1, budget // (n * n_rounds)))
+        n = int(np.ceil(n / 2))
+    return schedule
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bandit results store.
+
+A ResultStore (see utils/runner.py) that, besides the JSON log of each run,
+keeps every period of the "bandits" experiment in an indexed SQLite table,
+and one aggregate row per run (periods, last period, total rewards), updated
+by a trigger as periods are inserted. Runs given the store's path write each
+period as it ends (start_run, add_periods), so a run that times out or
+crashes keeps the periods it reached, and max_t tells how far it got; the
+JSON log of a finished run replaces them. Analyses and missing-run checks
+are then queries on small tables rather than rescans of every period:
+
+    store = BanditResultStore("results/results.db")
+    runs = store.run_means(t_max=999, min_max_t=250, where="thres = 0.5")
+    missing = store.missing(["ABO"], ["UCB1", "Thompson"], [3, 5], [5, 10], n_seeds=3)
+
+Death rates are stored as in the per-period logs, in hundredths.
+"""
+
+import csv
+import json
+
+import numpy as np
+import pandas as pd
+
+from matching.utils.runner import ResultStore, job_key
+
+
+RUN_COLUMNS = ["algorithm", "param", "thres", "ipa", "env",
+               "entry_rate", "death_rate", "seed"]
+
+# Columns of the old comma-separated results files, by number of fields
+TEXT_COLUMNS = {
+    11: ["algorithm", "param", "thres", "environment", "seed", "t",
+         "entry_rate", "death_rate", "reward", "greedy", "optimal"],
+    12: ["algorithm", "param", "ipa", "thres", "environment", "seed", "t",
+         "entry_rate", "death_rate", "reward", "greedy", "optimal"]}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bandit_periods (
+    key TEXT NOT NULL,
+    algorithm TEXT, param REAL, thres REAL, ipa INTEGER, env TEXT,
+    entry_rate REAL, death_rate REAL, seed INTEGER,
+    t INTEGER NOT NULL, reward REAL, greedy REAL, optimal REAL,
+    PRIMARY KEY (key, t));
+
+CREATE INDEX IF NOT EXISTS bandit_periods_idx
+    ON bandit_periods (algorithm, env, seed, t);
+
+CREATE TABLE IF NOT EXISTS bandit_runs (
+    key TEXT PRIMARY KEY,
+    algorithm TEXT, param REAL, thres REAL, ipa INTEGER, env TEXT,
+    entry_rate REAL, death_rate REAL, seed INTEGER,
+    n_periods INTEGER NOT NULL DEFAULT 0, max_t INTEGER,
+    reward REAL NOT NULL DEFAULT 0, greedy REAL NOT NULL DEFAULT 0,
+    optimal REAL NOT NULL DEFAULT 0);
+
+CREATE INDEX IF NOT EXISTS bandit_runs_idx
+    ON bandit_runs (env, algorithm, entry_rate, death_rate, seed);
+
+CREATE TRIGGER IF NOT EXISTS bandit_runs_update AFTER INSERT ON bandit_periods
+BEGIN
+    INSERT OR IGNORE INTO bandit_runs
+        (key, algorithm, param, thres, ipa, env, entry_rate, death_rate, seed)
+    VALUES (NEW.key, NEW.algorithm, NEW.param, NEW.thres, NEW.ipa, NEW.env,
+            NEW.entry_rate, NEW.death_rate, NEW.seed);
+    UPDATE bandit_runs
+    SET n_periods = n_periods + 1,
+        max_t = MAX(COALESCE(max_t, NEW.t), NEW.t),
+        reward = reward + NEW.reward,
+        greedy = greedy + NEW.greedy,
+        optimal = optimal + NEW.optimal
+    WHERE key = NEW.key;
+END;
+"""
+
+
+class BanditResultStore(ResultStore):
+
+    def __init__(self, path, experiment="bandits"):
+        super().__init__(path)
+        self.experiment = experiment
+        with self.connect() as con:
+            con.executescript(SCHEMA)
+
+    def on_record(self, con, experiment, params, status, result):
+        if experiment != self.experiment:
+            return
+        # A finished run replaces the periods written as it went, or those
+        # of a previous run; a failed one keeps the periods it reached
+        if status != "ok":
+            return
+        key = job_key(params)
+        self.clear(con, key)
+        if result:
+            self.append(con, key, [dict(r, env=params["environment"], seed=params["seed"])
+                                   for r in result])
+
+    def start_run(self, key):
+        """Drops the periods of a previous run with the same key."""
+        with self.connect() as con:
+            self.clear(con, key)
+
+    def add_periods(self, key, periods):
+        """Writes periods (dicts with env and seed) of a run in progress."""
+        with self.connect() as con:
+            self.append(con, key, periods)
+
+    @staticmethod
+    def clear(con, key):
+        con.execute("DELETE FROM bandit_periods WHERE key = ?", (key,))
+        con.execute("DELETE FROM bandit_runs WHERE key = ?", (key,))
+
+    @staticmethod
+    def append(con, key, periods):
+        con.executemany("INSERT INTO bandit_periods VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(key,
+                          p["algorithm"], _float(p.get("param")), p.get("thres"),
+                          p.get("ipa"), p["env"], p["entry_rate"], p["death_rate"],
+                          p["seed"], p["t"], p["reward"], p["greedy"], p["optimal"])
+                         for p in periods])
+
+    def rebuild(self):
+        """Fills the bandit tables from the runs already in the store."""
+        with self.connect() as con:
+            rows = con.execute("SELECT params, status, result FROM runs "
+                               "WHERE experiment = ?", (self.experiment,)).fetchall()
+            for params, status, result in rows:
+                self.on_record(con, self.experiment, json.loads(params), status,
+                               json.loads(result))
+
+    def import_text(self, path):
+        """Loads a results file in the old comma-separated format of
+        run_bandits.py (results/bandit_results*.txt), with or without the
+        ipa column after param."""
+        with open(path) as f:
+            n_fields = len(next(csv.reader(f), []))
+        if n_fields not in TEXT_COLUMNS:
+            raise ValueError("{} has {} columns, expected 11 or 12".format(path, n_fields))
+        columns = TEXT_COLUMNS[n_fields]
+        df = pd.read_csv(path, names=columns, index_col=False)
+        df["environment"] = df["environment"].fillna("ABO(5,.1,12345)")
+        df["env"] = df["environment"].str.split("(").str[0]
+        by = [c for c in columns if c not in ("t", "reward", "greedy", "optimal")]
+        with self.connect() as con:
+            for run, periods in df.groupby(by, dropna=False):
+                key = "{}:{}".format(path, json.dumps([str(v) for v in run]))
+                self.clear(con, key)
+                self.append(con, key, periods.to_dict("records"))
+
+    def query(self, sql, params=()):
+        with self.connect() as con:
+            return pd.read_sql_query(sql, con, params=params)
+
+    def run_means(self, t_min=None, t_max=None, min_max_t=None, where=None):
+        """Average reward, greedy and optimal matches per period of each run,
+        over the periods between t_min and t_max, of the runs that reached
+        min_max_t. where is an extra SQL condition on the run columns."""
+        conditions, params = [], []
+        if min_max_t is not None:
+            conditions.append("r.max_t >= ?")
+            params.append(min_max_t)
+        if where is not None:
+            conditions.append("({})".format(where))
+        columns = ", ".join("r." + c for c in RUN_COLUMNS)
+
+        window = t_min is not None or t_max is not None
+        if not window:
+            # Straight from the aggregates
+            sql = ("SELECT {}, r.n_periods, r.reward / r.n_periods AS reward, "
+                   "r.greedy / r.n_periods AS greedy, r.optimal / r.n_periods AS optimal "
+                   "FROM bandit_runs r".format(columns))
+        else:
+            sql = ("SELECT {}, COUNT(*) AS n_periods, AVG(p.reward) AS reward, "
+                   "AVG(p.greedy) AS greedy, AVG(p.optimal) AS optimal "
+                   "FROM bandit_runs r JOIN bandit_periods p ON p.key = r.key"
+                   .format(columns))
+            if t_min is not None:
+                conditions.append("p.t >= ?")
+                params.append(t_min)
+            if t_max is not None:
+                conditions.append("p.t <= ?")
+                params.append(t_max)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if window:
+            sql += " GROUP BY r.key"
+        return self.query(sql, params)
+
+    def completed(self, min_max_t=0, where=None):
+        """Number of seeds run up to min_max_t, by environment, algorithm,
+        entry and death rate."""
+        sql = ("SELECT env, algorithm, entry_rate, death_rate, COUNT(DISTINCT seed) AS n_seeds "
+               "FROM bandit_runs WHERE max_t >= ?")
+        if where is not None:
+            sql += " AND ({})".format(where)
+        sql += " GROUP BY env, algorithm, entry_rate, death_rate"
+        return self.query(sql, (min_max_t,))
+
+    def missing(self, envs, algorithms, entry_rates, death_rates, n_seeds=1,
+                min_max_t=0, where=None):
+        """Configurations with fewer than n_seeds runs reaching min_max_t."""
+        done = self.completed(min_max_t, where) \
+            .set_index(["env", "algorithm", "entry_rate", "death_rate"])["n_seeds"]
+        idx = pd.MultiIndex.from_product([envs, algorithms, entry_rates, death_rates],
+                                         names=done.index.names)
+        counts = done.reindex(idx).fillna(0)
+        return counts[counts < n_seeds].index.tolist()
+
+
+def _float(x):
+    # NaN parameters (e.g. Thompson's) are stored as NULL
+    return None if x is None or (isinstance(x, float) and np.isnan(x)) else x
@@ -11,56 +11,54 @@ Created on Sun Jan 21 20:37:48 2018
 
 #%%
 
-from sys import platform, argv
-from os import system
+from multiprocessing import Pool
+from sys import platform
 
-from random import choice
 import numpy as np
-from time import time
 
 from matching.utils.env_utils import two_cycles
 from matching.solver.kidney_solver2 import optimal, greedy
-from matching.utils.data_utils import clock_seed, get_n_matched
+from matching.utils.data_utils import get_n_matched
 
 from matching.environment.abo_environment import ABOKidneyExchange
 from matching.environment.optn_environment import OPTNKidneyExchange
 from matching.environment.saidman_environment import SaidmanKidneyExchange
 
 from matching.bandits.exp3 import EXP3
+from matching.bandits.results import BanditResultStore
 from matching.bandits.ucb1 import UCB1
 from matching.bandits.thompson import Thompson
+from matching.bandits.halving import SequentialHalving
+from matching.utils.runner import current_job, job_key
 
 
-t1 = time()
-
-if len(argv) == 1:
-    argv = [None, "ABO", "Thompson", 5, 0.1]
-
-environment = argv[1]
-algorithm = argv[2]
-entry_rate = float(argv[3])
-death_rate = float(argv[4])
-
-print("Using {} {} {} {}".format(*argv[1:]))
-
-seed = clock_seed()
-
-max_time = 1001 if platform == "linux" else 5
-
 envs = {"ABO": ABOKidneyExchange,
         "RSU": SaidmanKidneyExchange,
         "OPTN": OPTNKidneyExchange}
-env = envs[environment]
-thres = choice([.5])
-gamma = choice([.1])
-c = choice([.1])
-n_iters = 1
-ipa = 20
-
 
-for i in range(n_iters):
 
-    env = env(entry_rate, death_rate, max_time)
+def run(environment, algorithm, entry_rate, death_rate, seed,
+        max_time=1001, thres=.5, gamma=.1, c=.1, ipa=20, log_every=1,
+        batch_size=1, n_workers=1, n_futures=None, store=None):
+    """Runs one bandit configuration and returns its per-period log.
+    Arms are pulled batch_size at a time, across n_workers processes, or
+    against n_futures futures shared by the arms of each decision.
+    With store, the path of a BanditResultStore, each logged period is also
+    written there as soon as it ends."""
+
+    if store is not None:
+        store = BanditResultStore(store)
+        # Under run_experiment, the key of the job it will record
+        params = current_job()
+        if params is None:
+            params = dict(environment=environment, algorithm=algorithm,
+                          entry_rate=entry_rate, death_rate=death_rate, seed=seed,
+                          max_time=max_time, thres=thres, gamma=gamma, c=c, ipa=ipa,
+                          batch_size=batch_size, n_futures=n_futures)
+        key = job_key(params)
+        store.start_run(key)
+
+    env = envs[environment](entry_rate, death_rate, max_time, seed=seed)
 
     opt = optimal(env)
     gre = greedy(env)
@@ -68,9 +66,11 @@ for i in range(n_iters):
     g = get_n_matched(gre["matched"], 0, env.time_length)
 
     rewards = np.zeros(env.time_length)
-    log_every = 1
+    log = []
 
     np.random.seed(seed)
+    pool = Pool(n_workers) if n_workers > 1 else None
+    batch = dict(batch_size=batch_size, n_workers=n_workers, pool=pool, n_futures=n_futures)
 
     for t in range(env.time_length):
         while True:
@@ -79,11 +79,14 @@ for i in range(n_iters):
                 break
             else:
                 if algorithm == "EXP3":
-                    algo = EXP3(env, t, gamma=gamma, thres=thres, iters_per_arm=ipa)
+                    algo = EXP3(env, t, gamma=gamma, thres=thres, iters_per_arm=ipa, **batch)
                 elif algorithm == "Thompson":
-                    algo = Thompson(env, t, thres=thres, iters_per_arm=ipa)
+                    algo = Thompson(env, t, thres=thres, iters_per_arm=ipa, **batch)
                 elif algorithm == "UCB1":
-                    algo = UCB1(env, t, c=c, thres=thres, iters_per_arm=ipa)
+                    algo = UCB1(env, t, c=c, thres=thres, iters_per_arm=ipa, **batch)
+                elif algorithm == "Halving":
+                    algo = SequentialHalving(env, t, thres=thres, iters_per_arm=ipa,
+                                             n_futures=n_futures)
 
                 algo.simulate()
                 res = algo.choose()
@@ -98,39 +101,68 @@ for i in range(n_iters):
 
         if algorithm == "EXP3":
             param = gamma
-        elif algorithm == "Thompson":
+        elif algorithm in ("Thompson", "Halving"):
             param = np.nan
         elif algorithm == "UCB1":
             param = c
 
-
         if t % log_every == 0 and t > 0:
-            stats=[algorithm,
-                   param,
-                   ipa,
-                   thres,
-                   "\"" + str(env) + "\"",
-                   seed,
-                   t,
-                   int(env.entry_rate),
-                   int(env.death_rate*100),
-                   rewards[t],
-                   g[t],
-                   o[t]]
-            msg = ",".join(["{}"]*len(stats)).format(*stats)
-
-            if platform == "linux":
-                with open("results/bandit_results5.txt", "a") as f:
-                    print(msg, file=f)
-            else:
-                print(t, np.sum(rewards[:t+1]),
-                          np.sum(g[:t+1]),
-                          np.sum(o[:t+1]))
-
-
-cmd = 'qsub -F "{} {} {} {}" job_bandits.pbs'.format(*argv[1:])
-system(cmd)
-
-t2 = time()
-
-print("Finished {} {} {} {} in {:4.2f} seconds".format(*argv[1:], t2 - t1))
\ No newline at end of file
+            log.append({"algorithm": algorithm,
+                        "param": param,
+                        "ipa": ipa,
+                        "thres": thres,
+                        "environment": str(env),
+                        "t": t,
+                        "entry_rate": int(env.entry_rate),
+                        "death_rate": int(env.death_rate * 100),
+                        "reward": rewards[t],
+                        "greedy": g[t],
+                        "optimal": o[t]})
+            if store is not None:
+                store.add_periods(key, [dict(log[-1], env=environment, seed=seed)])
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return log
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    from functools import partial
+
+    from matching.utils.runner import param_grid, run_experiment
+
+    parser = ArgumentParser(description="Bandit sweep")
+    parser.add_argument("--environment", nargs="+", default=["ABO"])
+    parser.add_argument("--algorithm", nargs="+", default=["Thompson"])
+    parser.add_argument("--entry_rate", nargs="+", type=float, default=[5])
+    parser.add_argument("--death_rate", nargs="+", type=float, default=[.1])
+    parser.add_argument("--n_seeds", type=int, default=1)
+    parser.add_argument("--max_time", type=int, default=1001 if platform == "linux" else 5)
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--n_workers", type=int, default=1,
+                        help="Processes pulling arms within each job")
+    parser.add_argument("--n_futures", type=int, default=None,
+                        help="Futures shared by the arms of a decision")
+    parser.add_argument("--n_jobs", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--store", default="results/results.db")
+    args = parser.parse_args()
+
+    grid = param_grid(environment=args.environment,
+                      algorithm=args.algorithm,
+                      entry_rate=args.entry_rate,
+                      death_rate=args.death_rate,
+                      seed=range(args.n_seeds),
+                      max_time=[args.max_time],
+                      batch_size=[args.batch_size],
+                      n_futures=[args.n_futures])
+
+    # Results do not depend on the number of workers, so it is not part of the grid
+    # Jobs write their periods as they go, so timed out runs keep them
+    run_experiment("bandits", partial(run, n_workers=args.n_workers, store=args.store), grid,
+                   BanditResultStore(args.store),
+                   n_jobs=args.n_jobs, timeout=args.timeout)
@@ -38,6 +38,7 @@ from matching.solver.kidney_solver2 import optimal, greedy
 from matching.environment.saidman_environment import SaidmanKidneyExchange
 from matching.environment.optn_environment import OPTNKidneyExchange
 
+from matching.utils.cycle_ranking import rank_cycles
 from matching.utils.data_utils import get_additional_regressors
 from matching.tree_search.mcts import mcts
 from matching.utils.data_utils import get_n_matched, clock_seed
@@ -117,22 +118,6 @@ if __name__ == "__main__":
     net = torch.load("results/policy_function_lstm")
     
     
-    def best_cycle(env, t, thres = 0):
-        liv_idx = dict({j:i for i,j in enumerate(env.get_living(t))})
-        if len(liv_idx) == 0:
-            return None
-        a_probs = evaluate_policy(net, env, t) 
-        cycles = list(map(tuple, optimal(env, t, t)["matched_cycles"][t])) 
-        if len(cycles) == 0:
-            return None
-        np_probs = np.zeros(len(cycles))
-        for q,(i,j) in enumerate(cycles):
-            np_probs[q] = np.mean((a_probs[liv_idx[i]], a_probs[liv_idx[j]]))
-        selected = np.argmax(np_probs)
-        if np_probs[selected] >= thres:
-            return cycles[selected]
-        else:
-            return None
 #%%   
     print("Creating environment")
     env = OPTNKidneyExchange(entry_rate, 
@@ -165,9 +150,10 @@ if __name__ == "__main__":
         for t in trange(env.time_length):
     
             r = 0
-            while True:
-                
-                n = len(env.get_living(t))
+            # Disjoint cycles, so one ranking serves the whole period
+            ranking = rank_cycles(net, env, t, evaluate = evaluate_policy)
+            n = len(ranking.living)
+            for a, score in ranking.top():
                 
                 if n < 10:
                     thres = thresholds[0]
@@ -180,12 +166,11 @@ if __name__ == "__main__":
                 elif n < 50:
                     thres = thresholds[4]
                     
-                a = best_cycle(env, t, thres = thres)
-                
-                if a is None:
+                if score < thres:
                     break
                 else:
                     r += len(a)
+                    n -= len(a)
                     env.removed_container[t].update(a)
             
             rewards.append(r)
@@ -11,7 +11,9 @@ from collections import defaultdict
 import networkx as nx
 import numpy as np
 
+from matching.environment.cycle_index import CycleIndex
 from matching.utils.data_utils import clock_seed
+from matching.utils.profiling import count, profiled, timer
 
 
 def draw(p_dict, n=1):
@@ -38,9 +40,17 @@ class BaseKidneyExchange(nx.DiGraph, abc.ABC):
         self.fraction_ndd = fraction_ndd
         self.removed_container = defaultdict(set)
         self.seed = clock_seed() if seed is None else seed
+        self.cycle_index = None
 
         if populate: self.populate(seed=seed)
 
+    def attach_cycle_index(self, max_cycle_length=2, max_chain_length=0):
+        """Keep an incremental CycleIndex of this environment up to date."""
+        self.cycle_index = CycleIndex(self,
+                                      max_cycle_length=max_cycle_length,
+                                      max_chain_length=max_chain_length)
+        return self.cycle_index
+
     def removed(self, t):
         output = set()
         for k, vs in self.removed_container.items():
@@ -71,6 +81,7 @@ class BaseKidneyExchange(nx.DiGraph, abc.ABC):
     def draw_edges(self, source_nodes, target_nodes):
         pass
 
+    @profiled("populate")
     def populate(self, t_begin=None, t_end=None, seed=None):
 
         if t_begin is None:
@@ -88,21 +99,28 @@ class BaseKidneyExchange(nx.DiGraph, abc.ABC):
 
         old_ids = list(self.nodes())
 
-        nodefts = self.draw_node_features(t_begin, t_end)
+        with timer("draw_node_features"):
+            nodefts = self.draw_node_features(t_begin, t_end)
         new_ids = tuple(range(next_id, next_id + len(nodefts)))
+        count("populate.nodes", len(new_ids))
 
         self.add_nodes_from(zip(new_ids, nodefts))
 
-        newnew_edges = self.draw_edges(new_ids, new_ids)
+        with timer("draw_edges"):
+            newnew_edges = self.draw_edges(new_ids, new_ids)
+
+            self.add_edges_from(newnew_edges, weight=1)
 
-        self.add_edges_from(newnew_edges, weight=1)
+            if len(old_ids):
+                oldnew_edges = self.draw_edges(old_ids, new_ids)
+                self.add_edges_from(oldnew_edges, weight=1)
 
-        if len(old_ids):
-            oldnew_edges = self.draw_edges(old_ids, new_ids)
-            self.add_edges_from(oldnew_edges, weight=1)
+                newold_edges = self.draw_edges(new_ids, old_ids)
+                self.add_edges_from(newold_edges, weight=1)
 
-            newold_edges = self.draw_edges(new_ids, old_ids)
-            self.add_edges_from(newold_edges, weight=1)
+        if self.cycle_index is not None:
+            with timer("cycle_index.add_vertices"):
+                self.cycle_index.add_vertices(new_ids)
 
     def attr(self, *attrs, nodes=None):
         if nodes is None:
@@ -130,21 +148,26 @@ class BaseKidneyExchange(nx.DiGraph, abc.ABC):
         """
         to_remove = [n for n, d in self.nodes(data=True) if d["entry"] >= t]
 
+        if self.cycle_index is not None:
+            self.cycle_index.remove_vertices(to_remove)
+
         self.remove_nodes_from(to_remove)
         for k in self.removed_container:
             if k > t:
                 self.removed_container[k].clear()
 
+    @profiled("get_living")
     def get_living(self, t_begin, t_end=None, indices_only=True):
         if t_end is None: t_end = t_begin
+        removed = self.removed(t_begin)
         if indices_only:
             return [n for n, d in self.nodes(data=True)
                     if d["entry"] <= t_end and d["death"] >= t_begin
-                    and n not in self.removed(t_begin)]
+                    and n not in removed]
         else:
             return [(n, d) for n, d in self.nodes(data=True)
                     if d["entry"] <= t_end and d["death"] >= t_begin
-                    and n not in self.removed(t_begin)]
+                    and n not in removed]
 
     def reindex_to_absolute(self, vs, t):
         living = self.get_living(t, indices_only=True)
@@ -11,6 +11,7 @@ from collections import defaultdict
 import networkx as nx
 import numpy as np
 
+from matching.environment.cycle_index import CycleIndex
 from matching.utils.data_utils import clock_seed
 
 
@@ -38,9 +39,17 @@ class BaseKidneyExchange(nx.DiGraph, abc.ABC):
         self.fraction_ndd = fraction_ndd
         self.removed_container = defaultdict(set)
         self.seed = clock_seed() if seed is None else seed
+        self.cycle_index = None
 
         if populate: self.populate(seed=seed)
 
+    def attach_cycle_index(self, max_cycle_length=2, max_chain_length=0):
+        """Keep an incremental CycleIndex of this environment up to date."""
+        self.cycle_index = CycleIndex(self,
+                                      max_cycle_length=max_cycle_length,
+                                      max_chain_length=max_chain_length)
+        return self.cycle_index
+
     def removed(self, t):
         output = set()
         for k, vs in self.removed_container.items():
@@ -104,6 +113,9 @@ class BaseKidneyExchange(nx.DiGraph, abc.ABC):
             newold_edges = self.draw_edges(new_ids, old_ids)
             self.add_edges_from(newold_edges, weight=1)
 
+        if self.cycle_index is not None:
+            self.cycle_index.add_vertices(new_ids)
+
     def validate_cycle(self, cycle):
         n = len(cycle)
         for i in range(n):
@@ -125,6 +137,8 @@ class BaseKidneyExchange(nx.DiGraph, abc.ABC):
         self.data = self.data.drop(to_remove, errors="ignore")
 
         # Remove from graph
+        if self.cycle_index is not None:
+            self.cycle_index.remove_vertices(to_remove)
         self.remove_nodes_from(to_remove)
 
         # Remove from removed_container
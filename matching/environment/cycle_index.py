@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental index of the cycles and chains of a kidney exchange.
+
+Arrivals only create cycles and chains that touch a new vertex, and departures
+(erasing, matching or dying) only invalidate those that touch the departing vertex.
+The index therefore keeps every cycle and chain of the environment in flat numpy
+arrays and updates them with work proportional to what actually changed.
+
+Pairs that die stay in the graph, so entries are also retired, in order of death,
+once a query shows they can no longer be returned (a query at t, or over pairs
+that all die at t or later). Retired entries leave the arrays and are archived
+by vertex, so queries only touch entries that are still alive. A later query
+reaching back before the retired deaths restores them from the archive.
+"""
+
+import heapq
+from collections import defaultdict
+
+import numpy as np
+
+
+class CycleIndex:
+
+    def __init__(self,
+                 env,
+                 max_cycle_length=2,
+                 max_chain_length=0,
+                 build=True):
+
+        self.env = env
+        self.max_cycle_length = max_cycle_length
+        self.max_chain_length = max_chain_length
+        # As in kidney_solver2, chain lengths count vertices (the ndd included)
+        self.width = max(max_cycle_length, max_chain_length, 1)
+
+        self.size = 0
+        self.n_inactive = 0
+        self.members = np.full((16, self.width), -1, dtype=int)
+        self.length = np.zeros(16, dtype=int)
+        self.is_chain = np.zeros(16, dtype=bool)
+        self.active = np.zeros(16, dtype=bool)
+        self.entry = np.zeros(16, dtype=int)  # Latest entry among members
+        self.death = np.zeros(16, dtype=int)  # Earliest death among members
+        self.n_removed = np.zeros(16, dtype=int)  # Members found in removed_container
+
+        self.by_vertex = defaultdict(set)
+        self.removed = set()
+
+        self.deaths = []  # Heap of (death, position) of the entries in the arrays
+        self.retired_before = -np.inf  # Entries dying before this are archived
+        self.archive = {}  # Archive key -> (members, is_chain, death)
+        self.archive_by_vertex = defaultdict(set)
+        self.n_archived = 0
+
+        if build:
+            self.add_vertices(list(env.nodes()))
+
+    def __len__(self):
+        return self.size - self.n_inactive + len(self.archive)
+
+    # Updates
+
+    def add_vertices(self, vs):
+        """Index every cycle and chain that goes through at least one vertex in vs."""
+        new = set(vs)
+        if not new:
+            return
+
+        if self.max_cycle_length >= 2:
+            for v in sorted(new):
+                if not self.is_ndd(v):
+                    self._add_cycles_from(v, new)
+
+        if self.max_chain_length >= 2:
+            for ndd in self._ndds_reaching(new):
+                self._add_chains_from(ndd, ndd in new, new)
+
+    def remove_vertices(self, vs):
+        """Drop every cycle and chain that goes through a vertex in vs."""
+        for v in vs:
+            for k in self.by_vertex.pop(v, ()):
+                if self.active[k]:
+                    self._deactivate(k, v)
+            for a in self.archive_by_vertex.pop(v, ()):
+                for w in self.archive.pop(a)[0]:
+                    if w != v:
+                        self.archive_by_vertex[w].discard(a)
+            self.removed.discard(v)
+
+        if self.n_inactive > max(1024, self.size // 2):
+            self._compact()
+
+    def refresh_vertices(self, vs):
+        """Re-read vertices whose edges or ndd status changed in place."""
+        self.remove_vertices(vs)
+        self.add_vertices(vs)
+
+    def sync_removed(self, t):
+        """Bring matched status in line with env.removed(t).
+
+        Only the difference with the previous call is applied, so an update of
+        removed_container costs work proportional to the vertices it touched.
+        """
+        removed = self.env.removed(t)
+        for v in removed.difference(self.removed):
+            for k in self.by_vertex.get(v, ()):
+                self.n_removed[k] += 1
+        for v in self.removed.difference(removed):
+            for k in self.by_vertex.get(v, ()):
+                self.n_removed[k] -= 1
+        self.removed = removed
+
+    def retire(self, t):
+        """Move entries with a member dying before t out of the arrays, or bring
+        them back from the archive if t is earlier than the previous call."""
+        if t < self.retired_before:
+            self.retired_before = t
+            self._restore(t)
+        while self.deaths and self.deaths[0][0] < t:
+            _, k = heapq.heappop(self.deaths)
+            if self.active[k]:
+                self._archive(k)
+                self._deactivate(k)
+        self.retired_before = t
+
+        if self.n_inactive > max(1024, self.size // 2):
+            self._compact()
+
+    def copy_for(self, env):
+        """Index restricted to the vertices of env (e.g. a snapshot), with its death times."""
+        new = CycleIndex(env,
+                         max_cycle_length=self.max_cycle_length,
+                         max_chain_length=self.max_chain_length,
+                         build=False)
+
+        nodes = list(env.nodes())
+        if nodes:
+            self.retire(self._min_death(nodes))
+        keep = np.flatnonzero(self.active[:self.size] &
+                              self._members_in(nodes, self.members[:self.size]))
+        for k in keep:
+            new._append(tuple(self.members[k, :self.length[k]].tolist()), self.is_chain[k])
+        return new
+
+    # Queries
+
+    def arrays(self, nodes=None, t=None, max_cycle_length=None, max_chain_length=None):
+        """Currently valid cycles and chains as arrays.
+
+        Args:
+            nodes: if given, only entries whose members are all in nodes
+            t: if given, only entries whose members are all alive and not removed at t
+            max_cycle_length, max_chain_length: length caps, defaulting to the index's
+
+        Returns:
+            weights: the number of vertices in each entry (chains include their ndd)
+            members: an array of vertex ids, one row per entry, padded with -1
+            is_chain: True for chains, False for cycles
+        """
+        if max_cycle_length is None:
+            max_cycle_length = self.max_cycle_length
+        if max_chain_length is None:
+            max_chain_length = self.max_chain_length
+
+        # Nothing dying before t, or before the first death among nodes, can be returned
+        bounds = [] if t is None else [t]
+        if nodes is not None:
+            nodes = list(nodes)
+            if nodes:
+                bounds.append(self._min_death(nodes))
+        if bounds:
+            self.retire(max(bounds))
+        elif nodes is None:
+            self.retire(-np.inf)
+
+        n = self.size
+        length = self.length[:n]
+        is_chain = self.is_chain[:n]
+        valid = self.active[:n] & \
+                np.where(is_chain, length <= max_chain_length, length <= max_cycle_length)
+
+        if nodes is not None:
+            valid &= self._members_in(nodes, self.members[:n])
+
+        if t is not None:
+            self.sync_removed(t)
+            valid &= (self.entry[:n] <= t) & (self.death[:n] >= t) & (self.n_removed[:n] == 0)
+
+        idx = np.flatnonzero(valid)
+        return length[idx], self.members[idx], is_chain[idx]
+
+    def get_cycles(self, nodes=None, max_cycle_length=None, t=None):
+        """Same output as kidney_solver2.get_cycles, before shuffling."""
+        weights, members, is_chain = self.arrays(nodes, t,
+                                                 max_cycle_length=max_cycle_length,
+                                                 max_chain_length=0)
+        return weights.tolist(), [set(row[:w]) for w, row in zip(weights, members.tolist())]
+
+    def get_chains(self, nodes=None, max_chain_length=None, t=None):
+        """Same output as kidney_solver2.get_chains."""
+        weights, members, is_chain = self.arrays(nodes, t,
+                                                 max_cycle_length=0,
+                                                 max_chain_length=max_chain_length)
+        return weights.tolist(), [set(row[:w]) for w, row in zip(weights, members.tolist())]
+
+    def ordered_chains(self, nodes=None, max_chain_length=None, t=None):
+        """Chains as tuples in edge order, starting from their ndd."""
+        weights, members, _ = self.arrays(nodes, t,
+                                          max_cycle_length=0,
+                                          max_chain_length=max_chain_length)
+        return [tuple(row[:w]) for w, row in zip(weights.tolist(), members.tolist())]
+
+    def ordered_cycles(self, nodes=None, max_cycle_length=None, t=None):
+        """Cycles as tuples in edge order, with the smallest vertex first."""
+        weights, members, _ = self.arrays(nodes, t,
+                                          max_cycle_length=max_cycle_length,
+                                          max_chain_length=0)
+        order = np.lexsort(members.T[::-1])
+        return [tuple(members[k, :weights[k]].tolist()) for k in order]
+
+    def two_cycles(self, nodes=None, t=None):
+        """Same output as env_utils.two_cycles when nodes are in increasing order."""
+        return self.ordered_cycles(nodes, max_cycle_length=2, t=t)
+
+    # Helpers
+
+    def is_ndd(self, v):
+        try:
+            return bool(self.env.data.loc[v, "ndd"])
+        except AttributeError:
+            return bool(self.env.node[v]["ndd"])
+
+    def _times(self, vs):
+        try:
+            d = self.env.data.loc[list(vs)]
+            return d["entry"].max(), d["death"].min()
+        except AttributeError:
+            return max(self.env.node[v]["entry"] for v in vs), \
+                   min(self.env.node[v]["death"] for v in vs)
+
+    def _min_death(self, nodes):
+        return self._times(nodes)[1]
+
+    def _members_in(self, nodes, members):
+        """Whether all the members of each row are in nodes, -1 padding included."""
+        nodes = np.fromiter(nodes, dtype=int)
+        real = members >= 0
+        if not real.any():
+            return np.ones(len(members), dtype=bool)
+        # The mask only spans the ids between the smallest and largest ones involved
+        lo = min(nodes.min(initial=np.iinfo(int).max), members[real].min())
+        hi = max(nodes.max(initial=-1), members.max())
+        mask = np.zeros(hi - lo + 1, dtype=bool)
+        mask[nodes - lo] = True
+        return np.where(real, mask[np.where(real, members - lo, 0)], True).all(1)
+
+    def _deactivate(self, k, v=None):
+        """Deactivate entry k and unlink it from its members other than v."""
+        self.active[k] = False
+        self.n_inactive += 1
+        for w in self.members[k, :self.length[k]]:
+            if w != v:
+                self.by_vertex[w].discard(k)
+
+    def _archive(self, k):
+        a = self.n_archived
+        self.n_archived += 1
+        vs = tuple(self.members[k, :self.length[k]].tolist())
+        self.archive[a] = (vs, self.is_chain[k], self.death[k])
+        for v in vs:
+            self.archive_by_vertex[v].add(a)
+
+    def _restore(self, t):
+        """Bring back the archived entries whose members all live until t."""
+        for a in [a for a, (_, _, death) in self.archive.items() if death >= t]:
+            vs, is_chain, _ = self.archive.pop(a)
+            for v in vs:
+                self.archive_by_vertex[v].discard(a)
+            self._append(vs, is_chain)
+
+    def _append(self, vs, is_chain):
+        if self.size == len(self.length):
+            self._grow()
+        k = self.size
+        self.size += 1
+        self.members[k, :len(vs)] = vs
+        self.members[k, len(vs):] = -1
+        self.length[k] = len(vs)
+        self.is_chain[k] = is_chain
+        self.active[k] = True
+        self.entry[k], self.death[k] = self._times(vs)
+        self.n_removed[k] = sum(v in self.removed for v in vs)
+        for v in vs:
+            self.by_vertex[v].add(k)
+        if self.death[k] < self.retired_before:
+            # Added after its members started dying, e.g. when a vertex is refreshed
+            self._archive(k)
+            self._deactivate(k)
+        else:
+            heapq.heappush(self.deaths, (self.death[k], k))
+
+    def _grow(self):
+        cap = 2 * len(self.length)
+        self.members = np.vstack([self.members,
+                                  np.full((cap - len(self.members), self.width), -1, dtype=int)])
+        for name in ["length", "is_chain", "active", "entry", "death", "n_removed"]:
+            old = getattr(self, name)
+            new = np.zeros(cap, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _compact(self):
+        keep = np.flatnonzero(self.active[:self.size])
+        n = len(keep)
+        self.members[:n] = self.members[keep]
+        for name in ["length", "is_chain", "active", "entry", "death", "n_removed"]:
+            arr = getattr(self, name)
+            arr[:n] = arr[keep]
+        self.active[n:] = False
+        self.size = n
+        self.n_inactive = 0
+        self.by_vertex = defaultdict(set)
+        for k in range(n):
+            for v in self.members[k, :self.length[k]]:
+                self.by_vertex[v].add(k)
+        self.deaths = [(self.death[k], k) for k in range(n)]
+        heapq.heapify(self.deaths)
+
+    def _add_cycles_from(self, v, new):
+        """Cycles through v whose other new vertices all have larger ids than v."""
+        path = [v]
+        on_path = {v}
+
+        def dfs():
+            last = path[-1]
+            if len(path) >= 2 and self.env.has_edge(last, v):
+                i = path.index(min(path))
+                self._append(tuple(path[i:] + path[:i]), False)
+            if len(path) < self.max_cycle_length:
+                for w in self.env.successors(last):
+                    if w not in on_path and (w not in new or w > v):
+                        path.append(w)
+                        on_path.add(w)
+                        dfs()
+                        on_path.discard(w)
+                        path.pop()
+
+        dfs()
+
+    def _ndds_reaching(self, new):
+        """NDDs that are new or can reach a new vertex along a chain."""
+        ndds = set()
+        frontier = set(new)
+        seen = set(new)
+        for _ in range(self.max_chain_length):
+            for v in frontier:
+                if self.is_ndd(v):
+                    ndds.add(v)
+            frontier = {u for v in frontier for u in self.env.predecessors(v)} - seen
+            seen |= frontier
+        return ndds
+
+    def _add_chains_from(self, ndd, ndd_is_new, new):
+        """Chains from ndd, keeping only those with a new vertex when the ndd is old
+        (the others are already indexed)."""
+        path = [ndd]
+        n_new = [int(ndd_is_new)]
+
+        def dfs():
+            if len(path) >= self.max_chain_length:
+                return
+            for w in self.env.successors(path[-1]):
+                if w not in path:
+                    path.append(w)
+                    n_new.append(n_new[-1] + (w in new))
+                    if n_new[-1] > 0:
+                        self._append(tuple(path), True)
+                    dfs()
+                    n_new.pop()
+                    path.pop()
+
+        dfs()
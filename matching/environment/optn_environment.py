@@ -94,6 +94,7 @@ class OPTNKidneyExchange(BaseKidneyExchange):
         if t_end is None:
             t_end = self.time_length
 
+        old_ids = set(self.nodes)
         if self.data is None:
             self.initial_populate(t_end=t_end, seed=seed)
         else:
@@ -111,6 +112,8 @@ class OPTNKidneyExchange(BaseKidneyExchange):
 
         nx.set_node_attributes(self, dict(zip(self.data.index, entries)))
 
+        if self.cycle_index is not None:
+            self.cycle_index.add_vertices(set(self.nodes) - old_ids)
 
     def draw_node_features(self, t_begin, t_end):
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Expected number of transplants when edges can fail at the final crossmatch.
+
+edge_success_prob is either a number (the same success probability for every
+edge) or "pra", in which case an edge v -> w succeeds with probability
+1 - pra(w), the sensitization of the patient of w. Saidman environments store
+it as "pra" and OPTN environments as "cpra_pat".
+
+A cycle only yields transplants if all of its edges succeed, so it is worth
+len(cycle) * prod(p). A chain (which starts at its ndd) goes on until its first
+failure, so each vertex counts with the probability that every edge up to it
+succeeded, the ndd counting as soon as its own donation does.
+"""
+
+from itertools import permutations
+
+import numpy as np
+
+
+def get_pra(env, nodes):
+    """Patient PRA of each node in nodes, as a fraction."""
+    try:
+        data = env.data
+    except AttributeError:
+        try:
+            return np.array([env.node[v]["pra"] for v in nodes], dtype=float)
+        except KeyError:
+            raise ValueError("Environment does not have a pra attribute")
+
+    col = "pra" if "pra" in data else "cpra_pat"
+    pra = data.loc[list(nodes), col].values.astype(float)
+    if data[col].max() > 1:
+        pra = pra / 100  # Percentages
+    return pra
+
+
+def edge_success_probs(env, sources, targets, edge_success_prob=1):
+    """Success probability of each edge sources[i] -> targets[i]."""
+    if isinstance(edge_success_prob, str):
+        if edge_success_prob != "pra":
+            raise ValueError("Cannot understand edge_success_prob")
+        targets = np.asarray(targets)
+        uniq, inv = np.unique(targets, return_inverse=True)
+        return 1 - get_pra(env, uniq)[inv]
+    return np.full(len(sources), edge_success_prob, dtype=float)
+
+
+def _padded(paths):
+    """Ordered paths as a -1 padded array, with their lengths."""
+    lengths = np.array([len(p) for p in paths], dtype=int)
+    width = lengths.max() if len(paths) else 0
+    members = np.full((len(paths), width), -1, dtype=int)
+    for k, p in enumerate(paths):
+        members[k, :len(p)] = p
+    return members, lengths
+
+
+def cycle_values(env, cycles, edge_success_prob=1):
+    """Expected transplants of each cycle, given as sequences in edge order."""
+    if len(cycles) == 0:
+        return np.zeros(0)
+    members, lengths = _padded(cycles)
+    n, width = members.shape
+    cols = np.arange(width)
+    # Successor of position i is i + 1, wrapping around at the cycle's own length
+    succ = members[np.arange(n)[:, None], (cols[None, :] + 1) % lengths[:, None]]
+    valid = cols[None, :] < lengths[:, None]
+    probs = np.ones((n, width))
+    probs[valid] = edge_success_probs(env, members[valid], succ[valid], edge_success_prob)
+    return lengths * probs.prod(1)
+
+
+def chain_values(env, chains, edge_success_prob=1):
+    """Expected transplants of each chain, given as sequences starting at the ndd."""
+    if len(chains) == 0:
+        return np.zeros(0)
+    members, lengths = _padded(chains)
+    n, width = members.shape
+    valid = np.arange(1, width)[None, :] < lengths[:, None]
+    probs = np.zeros((n, width - 1))
+    probs[valid] = edge_success_probs(env, members[:, :-1][valid], members[:, 1:][valid],
+                                      edge_success_prob)
+    reached = np.cumprod(probs, axis=1)
+    return reached[:, 0] + reached.sum(1)
+
+
+def orient_cycles(env, cycles):
+    """Turn unordered cycles (e.g. sets from kidney_solver2.get_cycles) into
+    sequences in edge order. When a cycle can be traversed in more than one order
+    all of them are returned, grouped by cycle, with the group sizes."""
+    ordered = []
+    sizes = []
+    for c in cycles:
+        c = sorted(c)
+        head, rest = c[0], c[1:]
+        found = 0
+        for perm in permutations(rest):
+            seq = (head,) + perm
+            if all(env.has_edge(seq[i - 1], seq[i]) for i in range(len(seq))):
+                ordered.append(seq)
+                found += 1
+        sizes.append(found)
+    return ordered, np.array(sizes, dtype=int)
+
+
+def unordered_cycle_values(env, cycles, edge_success_prob=1):
+    """Expected transplants of each unordered cycle, in its best orientation."""
+    if len(cycles) == 0:
+        return np.zeros(0)
+    ordered, sizes = orient_cycles(env, cycles)
+    values = cycle_values(env, ordered, edge_success_prob)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return np.maximum.reduceat(values, starts) if len(values) else np.zeros(len(cycles))
+
+
+def expected_value(env, cycles=(), chains=(), edge_success_prob=1):
+    """Expected transplants of a plan, i.e. of disjoint ordered cycles and chains.
+
+    Scores a matching without re-solving, e.g. at the end of a rollout.
+    """
+    return cycle_values(env, cycles, edge_success_prob).sum() + \
+           chain_values(env, chains, edge_success_prob).sum()
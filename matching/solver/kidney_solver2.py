@@ -11,19 +11,26 @@ from collections import defaultdict
 import networkx as nx
 import numpy as np
 
+from matching.solver.expected_value import chain_values, unordered_cycle_values
+from matching.utils.profiling import count, profiled, timer
 
+
+@profiled("get_cycles_and_chains")
 def get_cycles_and_chains(env,
                           nodes=None,
                           max_cycle_length=2,
-                          max_chain_length=0):
+                          max_chain_length=0,
+                          edge_success_prob=1):
     # Cycles
     cycle_weights, cycles = get_cycles(env,
                                        nodes,
-                                       max_cycle_length)
+                                       max_cycle_length,
+                                       edge_success_prob)
 
     chain_weights, chains = get_chains(env,
                                        nodes,
-                                       max_chain_length)
+                                       max_chain_length,
+                                       edge_success_prob)
 
     return cycle_weights + chain_weights, cycles + chains
 
@@ -47,42 +54,58 @@ def find_chains(g, source, depth):
     return chains
 
 
-def get_chains(env, nodes, max_chain_length=2):
+@profiled("get_chains")
+def get_chains(env, nodes, max_chain_length=2, edge_success_prob=1):
     if max_chain_length < 2:
         return [], []
 
-    if nodes is not None:
-        subgraph = env.subgraph(nodes)
-    else:
-        subgraph = env
+    index = getattr(env, "cycle_index", None)
+    if index is not None and index.max_chain_length >= max_chain_length:
+        paths = index.ordered_chains(nodes, max_chain_length)
 
-    weights = []
-    chains = []
-    for node, data in subgraph.nodes(data=True):
-        if data["ndd"]:
-            cs = find_chains(subgraph, node, max_chain_length)
-            for c in cs:
-                chains.append(set(c))
-                weights.append(len(c))
+    else:
+        if nodes is not None:
+            subgraph = env.subgraph(nodes)
+        else:
+            subgraph = env
+
+        paths = []
+        for node, data in subgraph.nodes(data=True):
+            if data["ndd"]:
+                paths.extend(find_chains(subgraph, node, max_chain_length))
+
+    if edge_success_prob == 1:
+        weights = [len(c) for c in paths]
+    else:
+        weights = list(chain_values(env, paths, edge_success_prob))
 
-    return weights, chains
+    return weights, [set(c) for c in paths]
 
 
-def get_cycles(env, nodes, max_cycle_length=2):
+@profiled("get_cycles")
+def get_cycles(env, nodes, max_cycle_length=2, edge_success_prob=1):
     if max_cycle_length < 2:
         return [], []
 
-    if max_cycle_length > 3:
+    index = getattr(env, "cycle_index", None)
+    if index is not None and index.max_cycle_length >= max_cycle_length:
+        weights, cycles = index.get_cycles(nodes, max_cycle_length)
+
+    elif max_cycle_length > 3:
         raise ValueError("Not supported cycle length")
 
-    cycles = []
-    c2s = get_two_cycles(env, nodes)
-    cycles.extend(c2s)
-    weights = [2] * len(c2s)
-    if max_cycle_length == 3:
-        c3s = get_three_cycles(env, nodes)
-        cycles.extend(c3s)
-        weights.extend([3] * len(c3s))
+    else:
+        cycles = []
+        c2s = get_two_cycles(env, nodes)
+        cycles.extend(c2s)
+        weights = [2] * len(c2s)
+        if max_cycle_length == 3:
+            c3s = get_three_cycles(env, nodes)
+            cycles.extend(c3s)
+            weights.extend([3] * len(c3s))
+
+    if edge_success_prob != 1:
+        weights = list(unordered_cycle_values(env, cycles, edge_success_prob))
 
     idx = np.random.permutation(len(cycles))
     weights = [weights[i] for i in idx]
@@ -134,6 +157,7 @@ def remove_from_cycles(ws_full, cs_full, restrict):
     return ws_restr, cs_restr
 
 
+@profiled("parse_solution")
 def parse_solution(env, cycles, model, t_begin=None, weights=None):
     matched_cycles = defaultdict(list)
     matched = defaultdict(set)
@@ -161,27 +185,31 @@ def parse_solution(env, cycles, model, t_begin=None, weights=None):
             "obj": obj}
 
 
+@profiled("solve")
 def solve(weights, cycles):
     cycle_constraints = defaultdict(list)
 
-    m = gb.Model()
-    m.setParam("OutputFlag", 0)
-    m.setParam("Threads", 1)
+    count("solve.cycles", len(cycles))
+    with timer("solve.build"):
+        m = gb.Model()
+        m.setParam("OutputFlag", 0)
+        m.setParam("Threads", 1)
 
-    xs = [m.addVar(vtype=gb.GRB.BINARY) for _ in cycles]
+        xs = [m.addVar(vtype=gb.GRB.BINARY) for _ in cycles]
 
-    for x, cyc in zip(xs, cycles):
-        for v in cyc:
-            cycle_constraints[v].append(x)
+        for x, cyc in zip(xs, cycles):
+            for v in cyc:
+                cycle_constraints[v].append(x)
 
-    for v in cycle_constraints:
-        m.addConstr(gb.quicksum(cycle_constraints[v]) <= 1)
+        for v in cycle_constraints:
+            m.addConstr(gb.quicksum(cycle_constraints[v]) <= 1)
 
-    m.update()
+        m.update()
 
-    m.setObjective(gb.quicksum([w * v for w, v in zip(weights, xs)]),
-                   gb.GRB.MAXIMIZE)
-    m.optimize()
+        m.setObjective(gb.quicksum([w * v for w, v in zip(weights, xs)]),
+                       gb.GRB.MAXIMIZE)
+    with timer("solve.optimize"):
+        m.optimize()
     return m
 
 
@@ -192,6 +220,7 @@ def find_matching_date(env, nodes):
         return max(env.node[v]["entry"] for v in nodes)
 
 
+@profiled("optimal_with_discount")
 def optimal_with_discount(env,
                           t_begin=None, t_end=None,
                           max_cycle_length=2,
@@ -211,12 +240,14 @@ def optimal_with_discount(env,
     return parse_solution(env, cs, m, t_begin, weights=ws)
 
 
+@profiled("optimal")
 def optimal(env,
             t_begin=None,
             t_end=None,
             subset=None,
             max_cycle_length=2,
-            max_chain_length=0):
+            max_chain_length=0,
+            edge_success_prob=1):
     if t_begin is None:
         t_begin = 0
     if t_end is None:
@@ -230,20 +261,27 @@ def optimal(env,
     ws, cs = get_cycles_and_chains(env,
                                    nodes=nodes,
                                    max_cycle_length=max_cycle_length,
-                                   max_chain_length=max_chain_length)
+                                   max_chain_length=max_chain_length,
+                                   edge_success_prob=edge_success_prob)
 
     m = solve(ws, cs)
 
-    solution = parse_solution(env, cs, m, t_begin)
+    # With edge failures, obj is the expected number of transplants
+    solution = parse_solution(env, cs, m, t_begin,
+                              weights=None if edge_success_prob == 1 else ws)
 
     return solution
 
 
+@profiled("compare_optimal")
 def compare_optimal(env,
                     t_begin,
                     t_end,
                     perturb,
-                    max_cycle_length=2):
+                    max_cycle_length=2,
+                    full=False):
+    """Optimal objectives with perturb matched up front (take) and with it
+    left available (leave). With full=True the solutions are returned."""
     if t_begin is None:
         t_begin = 0
     if t_end is None:
@@ -258,9 +296,13 @@ def compare_optimal(env,
 
     ws_take, cs_take = remove_from_cycles(ws_full, cs_full, perturb)
 
-    i = cs_full.index(perturb)
-    ws_leave = ws_full[:i] + ws_full[i + 1:]
-    cs_leave = cs_full[:i] + cs_full[i + 1:]
+    # Perturb may not be available anymore, e.g. one of its pairs dies at t_begin
+    if perturb in cs_full:
+        i = cs_full.index(perturb)
+        ws_leave = ws_full[:i] + ws_full[i + 1:]
+        cs_leave = cs_full[:i] + cs_full[i + 1:]
+    else:
+        ws_leave, cs_leave = ws_full, cs_full
 
     m_take = solve(ws_take, cs_take)
     m_leave = solve(ws_leave, cs_leave)
@@ -272,9 +314,12 @@ def compare_optimal(env,
     sol_take["matched"][t_begin].update(perturb)
     sol_take["matched_cycles"][t_begin].append(perturb)
 
+    if full:
+        return sol_take, sol_leave
     return sol_take["obj"], sol_leave["obj"]
 
 
+@profiled("same_rewards")
 def same_rewards(env,
                  t_begin,
                  t_end,
@@ -306,7 +351,8 @@ def same_rewards(env,
     return sol_take["obj"] == sol_leave["obj"]
 
 
-def greedy(env, t_begin=None, t_end=None, max_cycle_length=2):
+@profiled("greedy")
+def greedy(env, t_begin=None, t_end=None, max_cycle_length=2, edge_success_prob=1):
     if t_begin is None:
         t_begin = 0
     if t_end is None:
@@ -317,14 +363,16 @@ def greedy(env, t_begin=None, t_end=None, max_cycle_length=2):
     obj = 0
     for t in range(t_begin, t_end):
         nodes = set(env.get_living(t))
-        ws, cs = get_cycles(env, nodes - removed, max_cycle_length)
+        ws, cs = get_cycles(env, nodes - removed, max_cycle_length, edge_success_prob)
         if not cs:
             continue
         solution = solve(ws, cs)
-        m = parse_solution(env, cs, solution, t)["matched_pairs"]
+        sol = parse_solution(env, cs, solution, t,
+                             weights=None if edge_success_prob == 1 else ws)
+        m = sol["matched_pairs"]
         removed |= m
         matched[t] = m
-        obj += len(m)
+        obj += sol["obj"]
 
     return {"matched": matched,
             "matched_pairs": removed,
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Budgets for MCTS decisions.
+
+A Budget stops a search after max_ms milliseconds of wall-clock time, after
+max_rollouts rollouts, or as soon as the decision is clear: when every child of
+the root has at least min_visits visits and the lower confidence bound of the
+best one (by average reward) is above the upper confidence bounds of all others.
+The bounds are normal approximations, with each child's variance floored at the
+pooled variance of all children.
+
+Iterations that simulate nothing (advancing a period, transpositions) do not
+count as rollouts. So that a search reaching only such leaves still ends,
+iterations are capped at max_iterations, by default 10 * max_rollouts when
+there is no time limit.
+
+    budget = Budget(max_ms=500, max_rollouts=200)
+    a = mcts(env, t, budget=budget)
+    budget.stopped  # "time", "rollouts", "iterations" or "separated"
+"""
+
+from collections import Counter
+from copy import copy
+from statistics import NormalDist
+from time import time
+
+import numpy as np
+
+
+class Budget:
+
+    def __init__(self, max_ms=None, max_rollouts=None, confidence=0.95, min_visits=2,
+                 max_iterations=None):
+        self.max_ms = max_ms
+        self.max_rollouts = max_rollouts
+        self.max_iterations = max_iterations
+        self.confidence = confidence
+        self.min_visits = min_visits
+        self.z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+        self.start()
+
+    def start(self):
+        self.t0 = time()
+        self.rollouts = 0
+        self.iterations = 0
+        self.stopped = None
+        return self
+
+    @property
+    def elapsed_ms(self):
+        return 1000 * (time() - self.t0)
+
+    def spend(self, n=1, iterations=1):
+        """Counts n rollouts, run over the given number of iterations."""
+        self.rollouts += n
+        self.iterations += iterations
+
+    @property
+    def iteration_cap(self):
+        if self.max_iterations is not None:
+            return self.max_iterations
+        if self.max_ms is None and self.max_rollouts is not None:
+            return 10 * self.max_rollouts
+        return None
+
+    def with_default(self, max_rollouts):
+        """Copy with a rollout cap, if this budget could otherwise run forever."""
+        budget = copy(self)
+        if budget.max_ms is None and budget.max_rollouts is None:
+            budget.max_rollouts = max_rollouts
+        return budget
+
+    def split(self, n):
+        """Budget of each of n searches running in parallel."""
+        budget = copy(self)
+        if budget.max_rollouts is not None:
+            budget.max_rollouts = int(np.ceil(budget.max_rollouts / n))
+        if budget.max_iterations is not None:
+            budget.max_iterations = int(np.ceil(budget.max_iterations / n))
+        return budget.start()
+
+    def outcome(self):
+        return self.stopped, self.rollouts, self.iterations
+
+    def record(self, *outcomes):
+        """Keeps on this budget the outcome of the searches that ran on
+        copies of it (see with_default and split): the most common reason
+        they stopped and their total rollouts and iterations."""
+        reasons = Counter(o[0] for o in outcomes if o[0] is not None)
+        self.stopped = reasons.most_common(1)[0][0] if reasons else None
+        self.rollouts = sum(o[1] for o in outcomes)
+        self.iterations = sum(o[2] for o in outcomes)
+
+    def exhausted(self, visits=None, reward=None, reward_sq=None):
+        """Checks the limits and, given the statistics of the root's children,
+        whether the best child is already separated from the others."""
+        if self.max_ms is not None and self.elapsed_ms >= self.max_ms:
+            self.stopped = "time"
+        elif self.max_rollouts is not None and self.rollouts >= self.max_rollouts:
+            self.stopped = "rollouts"
+        elif self.iteration_cap is not None and self.iterations >= self.iteration_cap:
+            self.stopped = "iterations"
+        elif visits is not None and separated(visits, reward, reward_sq,
+                                              self.z, self.min_visits):
+            self.stopped = "separated"
+        return self.stopped is not None
+
+
+def confidence_bounds(visits, reward, reward_sq, z):
+    visits = np.asarray(visits, dtype=float)
+    reward = np.asarray(reward, dtype=float)
+    reward_sq = np.asarray(reward_sq, dtype=float)
+    mean = reward / visits
+    # A child seen a few times may have identical rewards, so the variance
+    # is never taken below the pooled variance of all children
+    pooled = reward_sq.sum() / visits.sum() - (reward.sum() / visits.sum()) ** 2
+    var = np.maximum(reward_sq / visits - mean ** 2, max(pooled, 0))
+    half = z * np.sqrt(var / visits)
+    return mean - half, mean + half
+
+
+def separated(visits, reward, reward_sq, z, min_visits=2):
+    visits = np.asarray(visits)
+    if len(visits) < 2 or np.any(visits < max(min_visits, 1)):
+        return False
+    lcb, ucb = confidence_bounds(visits, reward, reward_sq, z)
+    best = np.argmax(np.asarray(reward) / visits)
+    return lcb[best] > np.delete(ucb, best).max()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Array-based MCTS tree.
+
+A tree of node objects, each with a full environment snapshot, holds
+thousands of graph copies once it has a few thousand nodes. CompactTree stores
+the tree as parallel numpy arrays instead (parent, visits, reward, t, action, first child,
+number of children and a seed), a few dozen bytes per node, and keeps a single
+environment: the root's. The environment of any other node is rebuilt on demand
+by replaying the actions on its path from the root, with the node seeds making
+the sampled arrivals and deaths the same every time. A small LRU cache keeps
+the most recently rebuilt environments.
+
+The children of a node are allocated together, as one contiguous block, the
+first time the node is expanded, so the statistics of all siblings are slices
+of the arrays. Unvisited children are the ones still to be expanded. Their
+priors are only needed to select among visited children, so they are left
+unscored until then and score() evaluates those of several blocks at once.
+
+With transpositions, nodes reached through different orders of the same
+actions share one row of statistics (see transpositions.py): rows(node) is the
+row holding node's visits and rewards, which is node itself otherwise.
+
+Which actions exist and how they change the environment are given by a
+strategy (see engine.py, which also runs the search on this storage).
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from matching.tree_search.transpositions import state_key
+from matching.utils.env_utils import snapshot
+from matching.utils.futures import FuturePool
+
+
+NO_ACTION = -1  # Action id of the root and of the children that advance time
+
+
+class CompactTree:
+
+    def __init__(self, env, t, strategy, actions=None, capacity=1024, cache_size=16,
+                 seed=None, transpositions=False):
+        self.strategy = strategy
+        self.root_env = snapshot(env, t)
+        self.rng = np.random.RandomState(seed)
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+        self.first_child = np.full(capacity, -1, dtype=np.int32)
+        self.n_children = np.full(capacity, -1, dtype=np.int32)  # -1: not allocated
+        self.action = np.full(capacity, NO_ACTION, dtype=np.int32)
+        self.t = np.zeros(capacity, dtype=np.int32)
+        self.seed = np.zeros(capacity, dtype=np.int64)
+        self.visits = np.zeros(capacity, dtype=np.int64)
+        self.reward = np.zeros(capacity, dtype=np.float64)
+        self.reward_sq = np.zeros(capacity, dtype=np.float64)
+        self.prior = np.ones(capacity, dtype=np.float64)
+
+        # Only allocated with transpositions: node -> row of its statistics
+        self.stat = None
+        self.table = None
+        self.hits = 0
+        if transpositions:
+            self.stat = np.arange(capacity, dtype=np.int32)
+            self.table = {}
+
+        # Futures sampled from each node's state, shared by its children
+        self.future_pools = {}
+
+        # Nodes whose children do not have their priors yet, in order of allocation
+        self.unscored = {}
+
+        # Actions are stored once, and referred to by their position here
+        self.action_table = []
+        self.action_ids = {}
+
+        self.size = 1
+        self.t[0] = t
+        self.seed[0] = self.rng.randint(2**31)
+        if self.table is not None:
+            self.table[state_key(self.root_env, t)] = 0
+        if actions is None:
+            actions = strategy.actions(self.root_env, t)
+        self.root_actions = list(actions)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, a).nbytes for a in
+                   ("parent", "first_child", "n_children", "action",
+                    "t", "seed", "visits", "reward", "reward_sq", "prior", "stat")
+                   if getattr(self, a) is not None)
+
+    def action_id(self, a):
+        if a is None:
+            return NO_ACTION
+        if a not in self.action_ids:
+            self.action_ids[a] = len(self.action_table)
+            self.action_table.append(a)
+        return self.action_ids[a]
+
+    def get_action(self, node):
+        k = self.action[node]
+        return None if k == NO_ACTION else self.action_table[k]
+
+    def rows(self, nodes):
+        """Rows of visits, reward and reward_sq holding the statistics of nodes."""
+        return nodes if self.stat is None else self.stat[nodes]
+
+    def stats(self, nodes):
+        rows = self.rows(nodes)
+        return self.visits[rows], self.reward[rows], self.reward_sq[rows]
+
+    def children(self, node):
+        return np.arange(self.first_child[node],
+                         self.first_child[node] + max(self.n_children[node], 0))
+
+    def actions(self, node):
+        """Actions available at node."""
+        if node == 0:
+            return self.root_actions
+        a = self.get_action(node)
+        if self.strategy.is_advance(a):
+            # Time advanced, so there are new pairs
+            return self.strategy.actions(self.env(node), self.t[node])
+        # Same period: what is left of the parent's actions
+        p = self.parent[node]
+        return self.strategy.child_actions([self.get_action(c) for c in self.children(p)], a)
+
+    def allocate_children(self, node):
+        acts = self.actions(node)
+        n = len(acts)
+        self._reserve(self.size + n)
+        block = np.arange(self.size, self.size + n)
+        self.first_child[node] = self.size
+        self.n_children[node] = n
+        self.parent[block] = node
+        self.action[block] = [self.action_id(a) for a in acts]
+        self.t[block] = self.t[node] + np.array([self.strategy.is_advance(a) for a in acts],
+                                                dtype=int)
+        self.seed[block] = self.rng.randint(2**31, size=n)
+        if n > 0:
+            self.unscored[node] = None
+        self.size += n
+        return block
+
+    def score(self, nodes=None):
+        """Evaluates the priors of the children of nodes (by default, of every
+        node still without them) in one batch. Priors never change, so they
+        are evaluated once."""
+        if nodes is None:
+            nodes = list(self.unscored)
+        else:
+            nodes = [v for v in nodes if v in self.unscored]
+        if not nodes:
+            return
+        priors = self.strategy.priors_batch(
+            [self.env(v) for v in nodes],
+            [self.t[v] for v in nodes],
+            [[self.get_action(c) for c in self.children(v)] for v in nodes])
+        for v, p in zip(nodes, priors):
+            del self.unscored[v]
+            if p is not None:
+                self.prior[self.children(v)] = p
+
+    def path(self, node):
+        nodes = []
+        while node != -1:
+            nodes.append(node)
+            node = self.parent[node]
+        return nodes[::-1]
+
+    def env(self, node):
+        """Environment at node, rebuilt from the closest cached ancestor."""
+        if node == 0:
+            return self.root_env
+        if node in self.cache:
+            self.cache.move_to_end(node)
+            return self.cache[node]
+
+        path = self.path(node)
+        start = max(i for i, v in enumerate(path) if i == 0 or v in self.cache)
+        env = self.root_env if start == 0 else self.cache[path[start]]
+
+        # Rebuilding reseeds the global state, which the search also uses
+        state = np.random.get_state()
+        for v in path[start + 1:]:
+            env = self._step(env, v)
+        np.random.set_state(state)
+
+        self.cache[node] = env
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return env
+
+    def _step(self, env, node):
+        """Environment after node's action: the same period with the action's
+        pairs removed, or the next period with new arrivals."""
+        t = self.t[self.parent[node]]
+        np.random.seed(self.seed[node])
+        child_env = snapshot(env, t)
+        a = self.get_action(node)
+        if self.strategy.is_advance(a):
+            child_env.populate(t + 1, t + 2, seed=self.seed[node])
+        else:
+            child_env.removed_container[t].update(a)
+        return child_env
+
+    def backup(self, node, reward):
+        rows = self.rows(self.path(node))
+        self.visits[rows] += 1
+        self.reward[rows] += reward
+        self.reward_sq[rows] += reward ** 2
+
+    def add_virtual_loss(self, node, loss):
+        """Counts loss visits with no reward on the path from node to the root."""
+        self.visits[self.rows(self.path(node))] += loss
+
+    def share(self, node):
+        """Points node to the statistics of its state, if another node not on
+        its path already has them. Returns whether those were visited."""
+        row = self.table.setdefault(state_key(self.env(node), self.t[node]), node)
+        # An action that removes nothing leads back to the same state,
+        # which must not share stats with its own ancestor
+        if row == node or row in self.rows(self.path(self.parent[node])):
+            return False
+        self.hits += 1
+        self.stat[node] = row
+        return self.visits[row] > 0
+
+    def futures(self, node, horizon, n_futures):
+        """Futures of node's state, sampled on first use."""
+        if node not in self.future_pools:
+            self.future_pools[node] = FuturePool(self.env(node), self.t[node], horizon,
+                                                 n_futures, seed=self.seed[node])
+        return self.future_pools[node]
+
+    def _reserve(self, n):
+        capacity = len(self.parent)
+        if n <= capacity:
+            return
+        new_capacity = max(n, 2 * capacity)
+        for name, fill in (("parent", -1), ("first_child", -1), ("n_children", -1),
+                           ("action", NO_ACTION), ("t", 0), ("seed", 0),
+                           ("visits", 0), ("reward", 0), ("reward_sq", 0),
+                           ("prior", 1)):
+            old = getattr(self, name)
+            new = np.full(new_capacity, fill, dtype=old.dtype)
+            new[:capacity] = old
+            setattr(self, name, new)
+        if self.stat is not None:
+            self.stat = np.concatenate([self.stat,
+                                        np.arange(capacity, new_capacity, dtype=np.int32)])
+
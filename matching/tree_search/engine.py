@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MCTS engine shared by the tree search variants.
+
+mcts, mcts_greedy, mcts_supergreedy and mcts_increasing differ only in how
+actions are generated, how priors are computed, which solver the rollout uses
+and how ties are broken at selection. Here those are the hooks of a Strategy,
+and the search itself is written once: compact array storage, priors evaluated
+in batches, transpositions, futures shared by the children of a node, budgets,
+and root or leaf parallelization. The mcts() of each variant module runs here
+with its strategy:
+
+    from matching.tree_search.engine import mcts, GreedyStrategy
+
+    a = mcts(env, t, GreedyStrategy(net), tpa=5, seed=0)
+
+Strategies:
+    Strategy            mcts.py: 2-cycles and "do nothing" (None, which
+                        advances time), ratio of take/leave optimal rollouts
+    GreedyStrategy      mcts_greedy.py: the pairs matched by optimal solutions
+                        of today, and (), valued by optimal rollouts
+    SuperGreedyStrategy mcts_supergreedy.py: the same without (), valued by
+                        greedy rollouts
+    IncreasingStrategy  mcts_increasing.py: increasing sets of cycles ordered
+                        by priors, valued by greedy rollouts
+"""
+
+from multiprocessing import Pool
+import random
+
+import numpy as np
+
+from matching.tree_search import mcts_greedy, mcts_supergreedy, mcts_increasing
+from matching.tree_search.compact_tree import CompactTree
+from matching.tree_search.mcts import evaluate_policies, priors_from_policy, rollout, \
+    rollout_value
+from matching.utils.env_utils import get_actions, remove_taken
+from matching.utils.profiling import profiled, timer
+
+
+class Strategy:
+
+    def __init__(self, net=None):
+        self.net = net
+
+    def actions(self, env, t):
+        return get_actions(env, t)
+
+    def child_actions(self, actions, taken):
+        """Actions left in the same period after taking one."""
+        return remove_taken(actions, taken)
+
+    def is_advance(self, action):
+        return action is None
+
+    def priors(self, env, t, actions):
+        """Exploration weight of each action, or None for uniform."""
+        return self.priors_batch([env], [t], [actions])[0]
+
+    def priors_batch(self, envs, ts, actions):
+        """Priors of several nodes, evaluating all of their policies in one
+        forward pass."""
+        priors = [None] * len(envs)
+        if self.net is None:
+            return priors
+        todo = [i for i, acts in enumerate(actions) if len(acts) > 1]
+        if todo:
+            ps = evaluate_policies(self.net, [envs[i] for i in todo], [ts[i] for i in todo])
+            for i, p in zip(todo, ps):
+                priors[i] = priors_from_policy(p, tuple(actions[i]))
+        return priors
+
+    def rollout(self, env, t_begin, t_end, taken, gamma, seed=None):
+        return rollout(env, t_begin, t_end, taken, gamma, seed)
+
+    def future_value(self, futures, k, t_begin, t_end, taken, gamma):
+        """Same as rollout, in the k-th of futures (a FuturePool) shared with
+        the other children of the same node."""
+        return rollout_value(*futures.compare(k, taken), t_begin, t_end, taken, gamma)
+
+    def advance_value(self):
+        """Value backed up when the selected action advances time."""
+        return 1
+
+    def select(self, rewards, visits, priors, scalar):
+        scores = rewards / visits + scalar * priors * np.sqrt(np.log(visits.sum()) / visits)
+        return np.flatnonzero(scores == scores.max())
+
+
+class GreedyStrategy(Strategy):
+
+    def actions(self, env, t):
+        return mcts_greedy.get_actions(env, t)
+
+    def priors(self, env, t, actions):
+        return mcts_greedy.evaluate_priors(self.net, env, t, list(actions))
+
+    def priors_batch(self, envs, ts, actions):
+        # Its policy is evaluated one state at a time
+        return [self.priors(env, t, acts) for env, t, acts in zip(envs, ts, actions)]
+
+    def rollout(self, env, t_begin, t_end, taken, gamma, seed=None):
+        return mcts_greedy.rollout(env, t_begin, t_end, taken, gamma, seed)
+
+    def future_value(self, futures, k, t_begin, t_end, taken, gamma):
+        raise ValueError("Shared futures are not supported by {}"
+                         .format(type(self).__name__))
+
+    def select(self, rewards, visits, priors, scalar):
+        if len(visits) == 1:
+            return np.array([0])
+        scores = rewards / visits + scalar * priors * np.sqrt(np.log(visits.sum()) / visits)
+        return np.flatnonzero(np.isclose(scores, scores.max(), 1e-3))
+
+
+class SuperGreedyStrategy(GreedyStrategy):
+
+    def actions(self, env, t):
+        return mcts_supergreedy.get_actions(env, t)
+
+    def rollout(self, env, t_begin, t_end, taken, gamma, seed=None):
+        return mcts_supergreedy.rollout(env, t_begin, t_end, taken, gamma, seed)
+
+
+class IncreasingStrategy(Strategy):
+
+    def actions(self, env, t):
+        return mcts_increasing.get_actions(self.net, env, t)
+
+    def priors(self, env, t, actions):
+        return None
+
+    def priors_batch(self, envs, ts, actions):
+        return [None] * len(envs)
+
+    def rollout(self, env, t_begin, t_end, taken, gamma, seed=None):
+        return mcts_increasing.rollout(env, t_begin, t_end, taken, gamma, seed)
+
+    def future_value(self, futures, k, t_begin, t_end, taken, gamma):
+        raise ValueError("Shared futures are not supported by {}"
+                         .format(type(self).__name__))
+
+
+@profiled("mcts.run")
+def run(tree, scalar, tree_horizon, rollout_horizon, n_rollouts, gamma=0.97, n_futures=None):
+    """One iteration; returns the number of rollouts simulated. With n_futures,
+    rollouts are evaluated against n_futures futures sampled once per parent
+    node and shared by all of its actions."""
+
+    node = tree_policy(tree, tree.t[0] + tree_horizon, scalar)
+    if transposed(tree, node):
+        return 0
+    strategy = tree.strategy
+
+    a = tree.get_action(node)
+    if node != 0 and not strategy.is_advance(a):
+        t_begin, t_end = tree.t[node], tree.t[node] + rollout_horizon
+        with timer("mcts.strategy_rollout"):
+            if n_futures is not None:
+                futures = tree.futures(tree.parent[node], rollout_horizon, n_futures)
+                r = np.mean([strategy.future_value(futures, k, t_begin, t_end, a, gamma)
+                             for k in range(len(futures))])
+                n_simulated = len(futures)
+            else:
+                env = tree.env(tree.parent[node])
+                # Futures are drawn from the search's own (seeded) random state
+                r = np.mean([strategy.rollout(env, t_begin, t_end, a, gamma,
+                                              np.random.randint(2**31))
+                             for _ in range(n_rollouts)])
+                n_simulated = n_rollouts
+    else:
+        r = strategy.advance_value()
+        n_simulated = 0
+
+    tree.backup(node, r)
+    return n_simulated
+
+
+@profiled("mcts.run_batch")
+def run_batch(tree, pool, batch_size, scalar, tree_horizon, rollout_horizon, n_rollouts,
+              gamma=0.97, virtual_loss=1):
+    """Leaf parallelization: selects batch_size leaves, adding a virtual loss
+    along each path so that the following selections spread out, and then
+    farms all of their rollouts to the worker pool at once. Returns the
+    number of rollouts simulated."""
+    strategy = tree.strategy
+
+    leaves = []
+    for _ in range(batch_size):
+        node = tree_policy(tree, tree.t[0] + tree_horizon, scalar)
+        if transposed(tree, node):
+            continue
+        tree.add_virtual_loss(node, virtual_loss)
+        leaves.append((node, node != 0 and not strategy.is_advance(tree.get_action(node))))
+    # Priors of the nodes expanded by this batch, in one forward pass
+    tree.score()
+
+    jobs = [(strategy,
+             tree.env(tree.parent[node]),
+             tree.t[node],
+             tree.t[node] + rollout_horizon,
+             tree.get_action(node),
+             gamma,
+             np.random.randint(2**31))
+            for node, rolled in leaves if rolled
+            for _ in range(n_rollouts)]
+    results = iter(pool.map(_rollout_job, jobs))
+
+    for node, rolled in leaves:
+        if rolled:
+            r = np.mean([next(results) for _ in range(n_rollouts)])
+        else:
+            r = strategy.advance_value()
+        tree.add_virtual_loss(node, -virtual_loss)
+        tree.backup(node, r)
+    return len(jobs)
+
+
+def transposed(tree, node):
+    """With transpositions, shares the statistics of a node selected for the
+    first time with those of the same state reached through another path. If
+    that state was already visited, its average reward is backed up from the
+    node's parent instead of rolling it out again."""
+    if tree.table is None or node == 0 or tree.rows(node) != node or tree.visits[node] > 0:
+        return False
+    if not tree.share(node):
+        return False
+    row = tree.rows(node)
+    tree.backup(tree.parent[node], tree.reward[row] / tree.visits[row])
+    return True
+
+
+def _seed_worker(seed):
+    # Forked workers inherit the parent's random state
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def _rollout_job(args):
+    strategy, env, t_begin, t_end, taken, gamma, seed = args
+    _seed_worker(seed)
+    return strategy.rollout(env, t_begin, t_end, taken, gamma, seed)
+
+
+@profiled("mcts.tree_policy")
+def tree_policy(tree, tree_horizon, scalar):
+    node = 0
+    while tree.t[node] < tree_horizon:
+        if tree.n_children[node] < 0:
+            tree.allocate_children(node)
+        kids = tree.children(node)
+        if len(kids) == 0:
+            return node
+        unvisited = kids[tree.visits[tree.rows(kids)] == 0]
+        if len(unvisited):
+            return unvisited[0]
+        tree.score([node])
+        node = best_child(tree, kids, scalar)
+    return node
+
+
+def best_child(tree, kids, scalar):
+    if scalar is None:
+        return np.random.choice(kids)
+    visits, reward, _ = tree.stats(kids)
+    best = tree.strategy.select(reward, visits, tree.prior[kids], scalar)
+    return kids[np.random.choice(best)]
+
+
+def root_stats(tree):
+    """(action, visits, reward) of the children of the root."""
+    kids = tree.children(0)
+    visits, reward, _ = tree.stats(kids)
+    return [(tree.get_action(c), v, r) for c, v, r in zip(kids, visits, reward)]
+
+
+def choose(stats, criterion="visits"):
+    stats = [s for s in stats if s[1] > 0]
+    if criterion == "visits":
+        # Break ties with avg rewards
+        most_visits = max(v for _, v, _ in stats)
+        best = max([s for s in stats if s[1] == most_visits], key=lambda s: s[2] / s[1])
+    elif criterion == "rewards":
+        best = max(stats, key=lambda s: s[2] / s[1])
+    return best[0]
+
+
+def merge_stats(stats):
+    totals = {}
+    for tree_stats in stats:
+        for a, visits, reward in tree_stats:
+            v, r = totals.get(a, (0, 0))
+            totals[a] = (v + visits, r + reward)
+    return [(a, v, r) for a, (v, r) in totals.items()]
+
+
+def budget_stats(tree):
+    """Statistics of the root's children for early stopping, once they
+    have all been expanded."""
+    kids = tree.children(0)
+    if len(kids) == 0:
+        return ()
+    stats = tree.stats(kids)
+    if np.any(stats[0] == 0):
+        return ()
+    return stats
+
+
+@profiled("mcts.grow")
+def grow(env, t, strategy, n_iters, seed=None, actions=None, cache_size=16, budget=None,
+         transpositions=False, pool=None, batch_size=1, virtual_loss=1, **kwargs):
+    """Builds a tree from env at t and runs n_iters iterations on it, or as
+    many as budget allows. With a pool, iterations run in batches of
+    batch_size leaves whose rollouts are evaluated in the pool (see run_batch)."""
+    if seed is not None:
+        np.random.seed(seed)
+    tree = CompactTree(env, t, strategy, actions=actions, seed=seed, cache_size=cache_size,
+                       transpositions=transpositions)
+
+    if pool is None:
+        def step(n):
+            return run(tree, **kwargs)
+    else:
+        def step(n):
+            return run_batch(tree, pool, n, virtual_loss=virtual_loss, **kwargs)
+
+    if budget is None:
+        for i_iter in range(0, n_iters, batch_size):
+            step(min(batch_size, n_iters - i_iter))
+    else:
+        budget.start()
+        while not budget.exhausted(*budget_stats(tree)):
+            budget.spend(step(batch_size), iterations=batch_size)
+    return tree
+
+
+def _grow_job(args):
+    """Root statistics of an independent tree, and the outcome of its budget
+    (None without one)."""
+    env, t, strategy, n_iters, seed, actions, cache_size, budget, transpositions, kwargs = args
+    _seed_worker(seed)
+    tree = grow(env, t, strategy, n_iters, seed, actions, cache_size, budget, transpositions,
+                **kwargs)
+    return root_stats(tree), None if budget is None else budget.outcome()
+
+
+@profiled("mcts")
+def mcts(env,
+         t,
+         strategy=None,
+         criterion="visits",
+         scl=1,
+         tpa=5,
+         tree_horizon=None,
+         rollout_horizon=None,
+         n_rolls=1,
+         gamma=0.97,
+         seed=None,
+         n_workers=1,
+         parallel="root",
+         virtual_loss=1,
+         pool=None,
+         n_futures=None,
+         transpositions=False,
+         cache_size=16,
+         budget=None):
+    """Same arguments as mcts.mcts, with the variant given by strategy.
+
+    With n_futures, each node samples that many futures once and evaluates
+    all of its actions against them (see run). A seed makes the search
+    reproducible. With transpositions, nodes reached through different
+    orders of the same actions share their statistics.
+
+    A Budget (see budget.py) replaces the tpa * n_actions iterations.
+
+    With n_workers > 1, iterations run in parallel:
+        parallel = "root": n_workers independent trees split the iterations
+            and their root statistics are merged by visit counts
+        parallel = "leaf": batches of n_workers leaves are selected using a
+            virtual loss and their rollouts are evaluated in a worker pool
+    A multiprocessing pool can be passed in to be reused across decisions.
+    """
+
+    if strategy is None:
+        strategy = Strategy()
+    if tree_horizon is None:
+        tree_horizon = int(1 / env.death_rate)
+    if rollout_horizon is None:
+        rollout_horizon = int(1 / env.death_rate)
+    if seed is not None:
+        np.random.seed(seed)
+        random.seed(seed)
+
+    actions = list(strategy.actions(env, t))
+    n_act = len(actions)
+    if n_act == 0:
+        return None
+    if n_act == 1:
+        return actions[0]
+
+    n_iters = int(tpa * n_act)
+    kwargs = dict(scalar=scl,
+                  tree_horizon=tree_horizon,
+                  rollout_horizon=rollout_horizon,
+                  n_rollouts=n_rolls,
+                  gamma=gamma,
+                  n_futures=n_futures)
+    # The search runs on a copy, whose outcome is recorded on budget
+    used = None if budget is None else budget.with_default(n_iters * n_rolls)
+
+    if n_workers > 1:
+        if parallel not in ("root", "leaf"):
+            raise ValueError("Unknown parallelization {}".format(parallel))
+        if parallel == "leaf" and n_futures is not None:
+            raise ValueError("Shared futures are not supported "
+                             "with leaf parallelization")
+        own_pool = pool is None
+        if own_pool:
+            pool = Pool(n_workers)
+
+        if parallel == "root":
+            worker_budget = None if used is None else used.split(n_workers)
+            jobs = [(env, t, strategy, n, np.random.randint(2**31), actions, cache_size,
+                     worker_budget, transpositions, kwargs)
+                    for n in np.diff(np.linspace(0, n_iters, n_workers + 1).astype(int))]
+            results = pool.map(_grow_job, jobs)
+            stats = merge_stats([s for s, _ in results])
+            if used is not None:
+                used.record(*[outcome for _, outcome in results])
+        else:
+            del kwargs["n_futures"]
+            tree = grow(env, t, strategy, n_iters, np.random.randint(2**31), actions,
+                        cache_size, used, transpositions, pool=pool, batch_size=n_workers,
+                        virtual_loss=virtual_loss, **kwargs)
+            stats = root_stats(tree)
+
+        if own_pool:
+            pool.close()
+            pool.join()
+    else:
+        tree = grow(env, t, strategy, n_iters, np.random.randint(2**31), actions,
+                    cache_size, used, transpositions, **kwargs)
+        stats = root_stats(tree)
+
+    if budget is not None:
+        budget.record(used.outcome())
+
+    return choose(stats, criterion)
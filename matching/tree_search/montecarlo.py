@@ -7,61 +7,127 @@ Created on Tue Dec 12 12:50:51 2017
 """
 
 import numpy as np
+import pandas as pd
 import torch
-from collections import OrderedDict
+from multiprocessing import Pool
 
-from matching.solver.kidney_solver2 import optimal, greedy, compare_optimal
+from matching.solver.kidney_solver2 import optimal, greedy
+from matching.tree_search.budget import Budget, confidence_bounds
 from matching.utils.data_utils import  clock_seed, evaluate_policy, get_cycle_probabilities
 from matching.utils.env_utils import snapshot, two_cycles
-from matching.policy_function.policy_function_lstm import RNN
-from matching.policy_function.policy_function_mlp import MLPNet
-from matching.policy_function.policy_function_gcn import GCNet
-from matching.policy_function.policy_function_rgcn import RGCNet
+from matching.utils.futures import FuturePool
 
     
 class MonteCarlo:
+    """
+    Evaluates every 2-cycle at t by how often taking it now is strictly
+    better than leaving it, in simulated futures.
+
+    Each round samples one future per horizon, shared by all arms: its cycles
+    and optimal matching are found once, and only the solves that depend on
+    the arm are repeated. The futures of a round (or of several rounds, with
+    more workers than horizons) are evaluated in parallel. Simulation runs for
+    n_iters futures per arm or until the budget (e.g. Budget(max_ms=500))
+    is exhausted, or the best arm is clearly separated from the others.
+
+    The chosen arm has the most successes, counting the priors, unless the
+    simulation stopped because an arm was separated: that arm is chosen, as
+    separation only compares the simulated futures.
+    """
     
     def __init__(self,
                  env,
                  t,
                  priors,
                  prior_counts,
-                 algo = "opt"):
+                 algo = "opt",
+                 horizons = (1, 5, 10, 20),
+                 n_workers = 1,
+                 pool = None):
         
         self.env = snapshot(env, t)
         self.t = t
         self.arms = two_cycles(self.env, t)
         self.n_arms = len(self.arms)
-        self.successes = np.zeros(self.n_arms)
         self.solver = optimal
-        self.horizons = [1, 5, 10, 20]
+        self.horizons = list(horizons)
+        self.n_workers = n_workers
+        self.pool = pool
         self.successes = prior_counts * get_cycle_probabilities(self.env.get_living(t),
                                               self.arms,
                                               priors) + 1e-8
+        self.wins = np.zeros(self.n_arms)
+        self.trials = np.zeros(self.n_arms)
+        # Populating reseeds the global state, so seeds come from their own
+        self.rng = np.random.RandomState(np.random.randint(2**31))
+        self.budget = None
         
         
     
-    def simulate(self, n_iters):
-
-        for i in range(n_iters):
-            for a in range(len(self.arms)): 
-                horizon = choice(self.horizons)
-                self.env.populate(self.t+1,
-                              self.t+horizon+1,
-                              seed = clock_seed())
-                take, leave = compare_optimal(self.env, 
-                          t_begin = self.t,
-                          t_end = self.t+horizon+1,
-                          perturb = self.arms[a])
-
-                if take > leave:
-                    self.successes[a] += 1
-                
-        print(self.successes)
-        return self.arms[np.argmax(self.successes)]
+    def simulate(self, n_iters = None, budget = None):
+        
+        if budget is None:
+            budget = Budget(max_rollouts = n_iters)
+        # Runs on a copy, whose outcome is recorded on budget
+        self.budget = budget.with_default(len(self.horizons)).start()
+        
+        own_pool = self.pool is None and self.n_workers > 1
+        if own_pool:
+            self.pool = Pool(self.n_workers)
+            
+        try:
+            rounds = max(1, self.n_workers // len(self.horizons))
+            while not self.budget.exhausted(self.trials, self.wins, self.wins):
+                horizons = self.horizons * rounds
+                seeds = self.rng.randint(2**31, size = len(horizons))
+                jobs = [(self.env, self.t, h, seed, self.arms)
+                        for h, seed in zip(horizons, seeds)]
+                if self.pool is None:
+                    wins = list(map(_future_job, jobs))
+                else:
+                    wins = self.pool.map(_future_job, jobs)
+                self.wins += np.sum(wins, axis = 0)
+                self.trials += len(jobs)
+                self.budget.spend(len(jobs))
+        finally:
+            if own_pool:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+        budget.record(self.budget.outcome())
+        
+        if self.budget.stopped == "separated":
+            best = np.argmax(self.wins / self.trials)
+        else:
+            best = np.argmax(self.successes + self.wins)
+        return self.arms[best]
     
     
+    def success_rates(self, confidence = .95):
+        """Share of the simulated futures in which each arm was better taken,
+        with normal confidence intervals (priors are not included)."""
+        z = Budget(confidence = confidence).z
+        trials = np.maximum(self.trials, 1)
+        lower, upper = confidence_bounds(trials, self.wins, self.wins, z)
+        return pd.DataFrame({"arm": self.arms,
+                             "trials": self.trials,
+                             "successes": self.wins,
+                             "rate": self.wins / trials,
+                             "lower": np.clip(lower, 0, 1),
+                             "upper": np.clip(upper, 0, 1)})
+    
+
 
+def _future_job(args):
+    """Whether each arm is strictly better taken at t in one future
+    populated up to t + horizon"""
+    env, t, horizon, seed, arms = args
+    futures = FuturePool(env, t, horizon + 1, n_futures = 1, seed = seed)
+    wins = np.zeros(len(arms), dtype = bool)
+    for a, arm in enumerate(arms):
+        take, leave = futures.compare(0, arm, t_end = t + horizon + 1, t_begin = t)
+        wins[a] = take["obj"] > leave["obj"]
+    return wins
     
     
         
@@ -73,6 +139,10 @@ if __name__ == "__main__":
     from tqdm import trange
     from os import listdir
     
+    from matching.deep_ml.policy_function_lstm import RNN
+    from matching.deep_ml.policy_function_mlp import MLPNet
+    from matching.deep_ml.policy_function_gcn import GCNet
+    
     from matching.environment.optn_environment import OPTNKidneyExchange
     from matching.environment.abo_environment import ABOKidneyExchange
     from matching.environment.saidman_environment import SaidmanKidneyExchange
@@ -178,6 +248,7 @@ if __name__ == "__main__":
  
 
     if platform == "darwin":
+        import matplotlib.pyplot as plt
         plt.plot(cumavg(rewards), linewidth = 5);
         plt.plot(cumavg(g));
         plt.plot(cumavg(o))
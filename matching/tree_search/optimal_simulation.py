@@ -6,151 +6,243 @@ Created on Tue Dec 12 12:50:51 2017
 @author: vitorhadad
 """
 
+from multiprocessing import Pool
+
 import numpy as np
 
 
 from matching.solver.kidney_solver2 import optimal, greedy
-from matching.utils.data_utils import  clock_seed
 from matching.utils.env_utils import snapshot, two_cycles
 
 
 
 
 class OptimalSimulation:
+    """
+    Frequency with which each arm (2-cycle, or pair, of period t) is matched
+    at t by the optimal matching of simulated futures up to t + horizon.
+
+    Each future is solved over the window [t, t + horizon] only, so its cost
+    does not grow with the length of the simulation.
+
+    Futures can be solved in a pool of workers, batch_size at a time. Sampling
+    stops after n_iters futures, once an arm was matched in more than half of
+    n_iters, or once Wald's sequential probability ratio test separates the
+    two most frequent arms: among the futures that match exactly one of them,
+    it tests whether the leader is matched with probability 1/2 + delta
+    against 1/2 - delta, with error rates alpha and beta.
+
+    Each future is solved once, and both its matched cycles and its matched
+    pairs are kept, so frequencies for the other method come for free
+    (see counts).
+    """
     
     def __init__(self, env, t, method = "cycles"):
         self.env = snapshot(env, t)
         self.t = t
         self.method = method
         
-        if method == "cycles": 
-            self.arms = list(map(lambda x: tuple(sorted(x)), 
-                                 two_cycles(self.env, t))) + [None]
-        elif method == "pairs":
-            self.arms = self.env.get_living(self.t) + [None]
-        else:
+        if method not in ("cycles", "pairs"):
             raise ValueError("Unknown optimal simulation method.")
-        
+        self.arms = self.get_arms(method)
         self.n_arms = len(self.arms)
+        self.samples = []  # (cycles, pairs) matched at t in each future
+        self.stopped = None
         
     
-    def simulate_optimal(self, horizon, n_iters):
-        arm_values = dict.fromkeys(self.arms, 0)  
-        earlystop = False 
-        for i in range(n_iters):
-            self.env.populate(self.t+1,
-                              self.t+horizon+1,
-                              seed = clock_seed())  
-            pulled_arms = self.optimize(self.env, self.t)
-            noaction = True
-            for a in arm_values:
-                if a in pulled_arms:
-                    arm_values[a] += 1
-                    noaction = False
-                    if arm_values[a] > (n_iters//2):
-                        earlystop = True
-                    
-            if noaction:
-                pass #arm_values[None] += 1
+    def get_arms(self, method):
+        if method == "cycles": 
+            return list(map(lambda x: tuple(sorted(x)), 
+                            two_cycles(self.env, self.t))) + [None]
+        else:
+            return self.env.get_living(self.t) + [None]
+    
+    
+    def simulate_optimal(self, horizon, n_iters,
+                         n_workers = 1,
+                         pool = None,
+                         batch_size = None,
+                         alpha = .05,
+                         beta = .05,
+                         delta = .1):
+        
+        if batch_size is None:
+            batch_size = n_workers
+        own_pool = pool is None and n_workers > 1
+        if own_pool:
+            pool = Pool(n_workers)
+        
+        # Solving in this process reseeds the global state, so the seeds
+        # of the futures come from their own generator
+        rng = np.random.RandomState(np.random.randint(2**31))
+        self.stopped = None
+        start = len(self.samples)
+        while len(self.samples) - start < n_iters:
+            size = min(batch_size, n_iters - (len(self.samples) - start))
+            jobs = [(self.env, self.t, horizon, seed)
+                    for seed in rng.randint(2**31, size = size)]
+            if pool is None:
+                self.samples.extend(map(_future_job, jobs))
+            else:
+                self.samples.extend(pool.map(_future_job, jobs))
             
-            if earlystop:
+            arm_values = self.counts()
+            if max(arm_values.values()) > (n_iters//2):
+                self.stopped = "majority"
+            elif sprt_separated(self.matches(), alpha, beta, delta):
+                self.stopped = "sprt"
+            if self.stopped is not None:
                 break
+        
+        if own_pool:
+            pool.close()
+            pool.join()
             
-        return arm_values
+        return self.counts()
     
     
+    def matches(self, method = None):
+        """Futures by arms matrix, True where the arm was matched at t."""
+        method = method or self.method
+        arms = self.arms if method == self.method else self.get_arms(method)
+        index = {a: i for i, a in enumerate(arms)}
+        m = np.zeros((len(self.samples), len(arms)), dtype = bool)
+        for k, sample in enumerate(self.samples):
+            pulled = sample[0] if method == "cycles" else sample[1]
+            m[k, [index[a] for a in pulled if a in index]] = True
+        return m
     
-    def optimize(self, env, t):
-        if self.method == "cycles":
-           pulled_arms = optimal(env)["matched_cycles"][t]
-           pulled_arms = list(map(lambda x: tuple(sorted(x)), pulled_arms))
-        else:
-           pulled_arms = optimal(env)["matched"][t]
-        return pulled_arms
     
+    def counts(self, method = None):
+        """Number of futures in which each arm was matched at t."""
+        method = method or self.method
+        arms = self.arms if method == self.method else self.get_arms(method)
+        return dict(zip(arms, self.matches(method).sum(0).tolist()))
     
     
-        
-if __name__ == "__main__":
+    def optimize(self, env, t, horizon):
+        cycles, pairs = optimal_matches(env, t, horizon)
+        return cycles if self.method == "cycles" else pairs
     
-    from sys import argv, platform
-    from random import choice
     
-    from matching.environment.optn_environment import OPTNKidneyExchange
-    from matching.environment.abo_environment import ABOKidneyExchange
-    from matching.environment.saidman_environment import SaidmanKidneyExchange
-    from matching.utils.data_utils import get_n_matched, cumavg
+
+def optimal_matches(env, t, horizon):
+    """Cycles (sorted tuples) and pairs matched at t by one optimal solve
+    over the pairs alive between t and t + horizon, the only ones populated."""
+    solution = optimal(env, t, t + horizon)
+    cycles = list(map(lambda x: tuple(sorted(x)), solution["matched_cycles"][t]))
+    return cycles, list(solution["matched"][t])
+
+
+
+def _future_job(args):
+    env, t, horizon, seed = args
+    env.populate(t+1, t+horizon+1, seed = seed)
+    return optimal_matches(env, t, horizon)
+
+
+
+def sprt_separated(matches, alpha, beta, delta):
+    """Wald's SPRT between the two most frequent arms, on the futures that
+    match exactly one of them."""
+    if matches.shape[1] < 2:
+        return matches.shape[0] > 0
+    counts = matches.sum(0)
+    first, second = np.argsort(-counts, kind = "stable")[:2]
+    wins = np.sum(matches[:, first] & ~matches[:, second])
+    losses = np.sum(~matches[:, first] & matches[:, second])
+    llr = (wins - losses) * np.log((.5 + delta) / (.5 - delta))
+    return llr >= np.log((1 - beta) / alpha)
+    
     
-    if len(argv) > 1:
-        entry_rate = int(argv[1])
-        death_rate = float(argv[2])
-        horizon = int(argv[3])
-        n_iters = int(argv[4])
-        max_time = int(argv[5])
-    else:
-        entry_rate = 8
-        death_rate = .1
-        horizon = 1
-        n_iters = 1000
-        max_time = 50
-        
-    if len(argv) > 6:
-        seed = int(argv[6])
-    else:
-        seed = 123456#clock_seed()
         
-    env_type = "abo"
+def run(entry_rate, death_rate, horizon, n_iters, max_time, seed, n_workers=1):
+    """Runs the optimal-simulation policy on an ABO environment and
+    returns its per-period rewards alongside greedy and optimal.
+    Futures are solved across n_workers processes."""
+
+    from random import choice
+
+    from matching.environment.abo_environment import ABOKidneyExchange
+    from matching.utils.data_utils import get_n_matched
+
     env = ABOKidneyExchange(entry_rate, death_rate, max_time, seed=seed)
-    
+
     opt = optimal(env)
     gre = greedy(env)
-    
+
     o = get_n_matched(opt["matched"], 0, env.time_length)
     g = get_n_matched(gre["matched"], 0, env.time_length)
-    
+
     rewards = np.zeros(env.time_length)
+    log = []
+
+    np.random.seed(seed)
+    pool = Pool(n_workers) if n_workers > 1 else None
 
-    
-    outfile = "{}_optsim_entry{}_death{}_hor{}_nit{}_seed{}"\
-            .format(env_type,
-                    int(env.entry_rate),
-                    int(env.death_rate*100),
-                    horizon,
-                    n_iters,
-                    seed)
-    #%%
     for t in range(env.time_length):
         if t % 2 == 0:
             continue
-            
+
         acts = []
         while True:
-        
+
             optsim = OptimalSimulation(env, t)
             if optsim.n_arms == 1:
                 a = None
             else:
-                probs = optsim.simulate_optimal(horizon, n_iters)
+                probs = optsim.simulate_optimal(horizon, n_iters,
+                                                n_workers=n_workers, pool=pool)
                 x = probs[max(probs, key = lambda x: probs[x])]
                 a = choice([p for p,v in probs.items() if v == x])
             acts.append(a)
-            
+
             if a is not None:
                 env.removed_container[t].update(a)
                 rewards[t] += len(a)
-            
+
             else:
                 break
-            
+
         print(t, acts)
-        
-        if platform == "linux":
-            with open("results/optsim_data/".format(env_type) + outfile + ".txt", "a") as f:
-                print(rewards[t], g[t], o[t], file = f)
-            
-    if platform == "linux":
-        with open("results/optsim_results.txt", "a") as f:
-            print(env_type, int(env.entry_rate), int(100*env.death_rate), seed,env.time_length,
-               horizon, n_iters, np.sum(rewards), np.sum(g), np.sum(o), file = f) 
-            
+        log.append({"t": t, "reward": rewards[t], "greedy": g[t], "optimal": o[t]})
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
     print(np.sum(rewards), np.sum(g), np.sum(o))
+    return log
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+    from functools import partial
+
+    from matching.utils.runner import param_grid, ResultStore, run_experiment
+
+    parser = ArgumentParser(description="Optimal simulation sweep")
+    parser.add_argument("--entry_rate", nargs="+", type=int, default=[8])
+    parser.add_argument("--death_rate", nargs="+", type=float, default=[.1])
+    parser.add_argument("--horizon", nargs="+", type=int, default=[1])
+    parser.add_argument("--n_iters", nargs="+", type=int, default=[1000])
+    parser.add_argument("--max_time", type=int, default=50)
+    parser.add_argument("--seed", nargs="+", type=int, default=[123456])
+    parser.add_argument("--n_workers", type=int, default=1,
+                        help="Processes solving futures within each job")
+    parser.add_argument("--n_jobs", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--store", default="results/results.db")
+    args = parser.parse_args()
+
+    grid = param_grid(entry_rate=args.entry_rate,
+                      death_rate=args.death_rate,
+                      horizon=args.horizon,
+                      n_iters=args.n_iters,
+                      max_time=[args.max_time],
+                      seed=args.seed)
+
+    run_experiment("optsim", partial(run, n_workers=args.n_workers), grid,
+                   ResultStore(args.store),
+                   n_jobs=args.n_jobs, timeout=args.timeout)
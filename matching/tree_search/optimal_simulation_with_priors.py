@@ -54,7 +54,7 @@ class OptimalSimulationWithPriors:
             self.env.populate(self.t+1,
                               self.t+horizon+1,
                               seed = clock_seed())  
-            pulled_arms = self.optimize(self.env, self.t)
+            pulled_arms = self.optimize(self.env, self.t, horizon)
             if len(pulled_arms) > 0:
                 for a in pulled_arms:
                     arm_values[a] += 1
@@ -67,12 +67,14 @@ class OptimalSimulationWithPriors:
     
     
     
-    def optimize(self, env, t):
+    def optimize(self, env, t, horizon):
+        # Only the window [t, t + horizon] was populated
+        solution = optimal(env, t, t + horizon)
         if self.method == "cycles":
-           pulled_arms = optimal(env, t, t)["matched_cycles"][t]
+           pulled_arms = solution["matched_cycles"][t]
            pulled_arms = list(map(lambda x: tuple(sorted(x)), pulled_arms))
         else:
-           pulled_arms = optimal(env, t, t)["matched"][t]
+           pulled_arms = solution["matched"][t]
         return pulled_arms
     
     
@@ -54,7 +54,7 @@ class OptimalSimulationWithPriors:
             self.env.populate(self.t+1,
                               self.t+horizon+1,
                               seed = clock_seed())  
-            pulled_arms = self.optimize(self.env, self.t)
+            pulled_arms = self.optimize(self.env, self.t, horizon)
             if len(pulled_arms) > 0:
                 for a in pulled_arms:
                     arm_values[a] += 1
@@ -67,12 +67,14 @@ class OptimalSimulationWithPriors:
     
     
     
-    def optimize(self, env, t):
+    def optimize(self, env, t, horizon):
+        # Only the window [t, t + horizon] was populated
+        solution = optimal(env, t, t + horizon)
         if self.method == "cycles":
-           pulled_arms = optimal(env, t, t)["matched_cycles"][t]
+           pulled_arms = solution["matched_cycles"][t]
            pulled_arms = list(map(lambda x: tuple(sorted(x)), pulled_arms))
         else:
-           pulled_arms = optimal(env, t, t)["matched"][t]
+           pulled_arms = solution["matched"][t]
         return pulled_arms
     
     
@@ -128,93 +130,83 @@ class OptimalSimulationWithPriors:
     
     
 #%%
-if __name__ == "__main__":
-    
+def run(entry_rate, death_rate, n_iters, horizon, mix, none_prob, thres_coeff, seed,
+        max_time=500):
+    """Runs the optimal-simulation policy with priors and threshold on an OPTN
+    environment and returns average rewards alongside greedy and optimal."""
+
     from matching.environment.optn_environment import OPTNKidneyExchange
     from matching.utils.data_utils import get_n_matched
-    from random import choice
-    from sys import platform
-    
-    seed = clock_seed()
-    
-    
-    if platform == "linux":
-        entry_rate = choice([3, 5, 10])
-        death_rate = choice([.01, .05, .1])
-        n_iters = choice([1, 10, 20, 100])
-        horizon = choice([5, 10, 20])
-        mix = choice([0, .25, .5, .75, 1])
-        none_prob = choice([0, None])
-        thres_coeff = np.random.uniform(0, .5, size = 2)
-    else:
-        entry_rate = 3
-        death_rate = .01
-        n_iters = 5
-        horizon = 10
-        mix = .5
-        none_prob = 0
-        thres_coeff = 0.5, .01
-        
-        
+
     max_expected_size = entry_rate/death_rate
-    
-    env = OPTNKidneyExchange(5, .1, 500, 
-                             seed = 12345,
-                             initial_size = 0)
-    
+
+    env = OPTNKidneyExchange(entry_rate, death_rate, max_time,
+                             seed = seed)
+
     opt = optimal(env)
     gre = greedy(env)
-    
+
     o = get_n_matched(opt["matched"], 0, env.time_length)
     g = get_n_matched(gre["matched"], 0, env.time_length)
-    
+
     rewards = np.zeros(env.time_length)
 
-    #%%
     for t in range(env.time_length):
-    
+
         while True:
-        
+
             optsim = OptimalSimulationWithPriors(
-                             env, t,      
+                             env, t,
                              none_prob = none_prob,
                              mix = mix)
-            
+
             if thres_coeff is not None:
                 size = len(env.get_living(t))/max_expected_size
                 thres = thres_coeff[0] * size ** thres_coeff[1]
             else:
                 thres = None
             a = optsim.choose(horizon, n_iters, thres)
-            
-            
+
+
             if a is not None:
                 env.removed_container[t].update(a)
                 rewards[t] += len(a)
-            
+
             else:
                 break
-            
-            
+
+
         print("Time:", t,
               "R:", rewards[:t].mean(),
               "G:", g[:t].mean(),
               "O:", o[:t].mean())
-        
-    
-    print(env.entry_rate,
-          env.death_rate,
-          env.time_length,
-          seed,
-          horizon,
-          n_iters,
-          none_prob,
-          thres_coeff[0],
-          thres_coeff[1],
-          rewards[:t].mean(),
-          g[:t].mean(),
-          o[:t].mean(),
-          file = open("results/optsim_results_priors_and_threshold.txt", "a"))
-    
-              
-              
+
+    return {"rewards": rewards[:t].mean(),
+            "greedy": g[:t].mean(),
+            "optimal": o[:t].mean()}
+
+
+if __name__ == "__main__":
+
+    from argparse import ArgumentParser
+
+    from matching.utils.runner import param_grid, ResultStore, run_experiment
+
+    parser = ArgumentParser(description="Optimal simulation with priors and threshold sweep")
+    parser.add_argument("--n_seeds", type=int, default=1)
+    parser.add_argument("--n_jobs", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--store", default="results/results.db")
+    args = parser.parse_args()
+
+    grid = param_grid(entry_rate=[3, 5, 10],
+                      death_rate=[.01, .05, .1],
+                      n_iters=[1, 10, 20, 100],
+                      horizon=[5, 10, 20],
+                      mix=[0, .25, .5, .75, 1],
+                      none_prob=[0, None],
+                      thres_coeff=[(a, b) for a in [.1, .25, .5] for b in [.01, .25, .5]],
+                      seed=range(args.n_seeds))
+
+    run_experiment("optsim_priors_and_threshold", run, grid, ResultStore(args.store),
+                   n_jobs=args.n_jobs, timeout=args.timeout)
@@ -32,27 +32,23 @@ from matching.solver.kidney_solver2 import optimal_with_discount, optimal, greed
 from matching.utils.data_utils import  clock_seed, cumavg
 from matching.utils.env_utils import snapshot, remove_taken, get_loss
 from matching.utils.data_utils import flatten_matched, disc_mean , get_n_matched
+from matching.utils.cycle_ranking import rank_cycles
 #%%
 
 
 
-def evaluate_cycle_priors(net, env, t, thres = 0):
-    priors = {(): None}
-    liv_idx = dict({j:i for i,j in enumerate(env.get_living(t))})
-    if len(liv_idx) == 0:
-        return {(): 1}
-    a_probs = evaluate_policy(net, env, t) 
-    cycles = list(map(tuple, optimal(env, t, t)["matched_cycles"][t])) 
-    if len(cycles) == 0:
+def evaluate_cycle_priors(net, env, t, thres = 0, k = None):
+    """Priors of the (up to k) best cycles scoring at least thres,
+    or of the empty cycle if there are none.
+
+    Returns a dict from cycle to prior; it used to return only the best
+    cycle (or None), so callers that expect a cycle should take the key with
+    the highest prior."""
+    ranking = rank_cycles(net, env, t, evaluate = evaluate_policy)
+    priors = dict(ranking.top(k, thres))
+    if len(priors) == 0:
         return {(): 1}
-    np_probs = np.zeros(len(cycles))
-    for q,(i,j) in enumerate(cycles):
-        np_probs[q] = np.mean((a_probs[liv_idx[i]], a_probs[liv_idx[j]]))
-    selected = np.argmax(np_probs)
-    if np_probs[selected] >= thres:
-        return cycles[selected]
-    else:
-        return None
+    return priors
     
     
 def evaluate_policy(net, env, t):
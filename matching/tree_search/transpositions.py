@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Transpositions in the MCTS engine.
+
+Taking cycle A then B, or B then A, at the same t leads to the same pool, yet
+the search tree holds them as two different nodes. With transpositions, nodes
+are keyed by their pool, (t, frozenset(pairs living at t)), which excludes every
+pair taken on the way to the node, in any earlier period as well as at t. Nodes
+with the same key share one row of statistics (visits and total reward) of the
+CompactTree, so the statistics gathered for one path serve every equivalent path.
+
+A node selected for the first time whose state was already visited is
+transposed: instead of rolling it out again, the search backs up its stored
+average reward from its parent (see engine.transposed).
+"""
+
+
+def state_key(env, t):
+    # Pairs taken at t are removed in env, and those taken earlier were
+    # dropped by the snapshots of later periods
+    return t, frozenset(env.get_living(t))
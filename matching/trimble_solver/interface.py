@@ -3,9 +3,13 @@ from copy import deepcopy
 import networkx as nx
 
 import matching.trimble_solver.kidney_ip as k_ip
+import matching.trimble_solver.kidney_ip_sparse as k_ip_sparse
 from matching.trimble_solver.kidney_digraph import Digraph
 from matching.trimble_solver.kidney_ndds import Ndd, NddEdge
+from matching.trimble_solver.kidney_reachability import BoundedReachability
+from matching.solver.expected_value import edge_success_probs
 from matching.environment.optn_environment import OPTNKidneyExchange
+from matching.utils.profiling import profiled, timer
 
 
 def separate_ndds(g):
@@ -18,8 +22,17 @@ def separate_ndds(g):
     return g_pairs, g_ndds
 
 
-def nx_to_trimble(g):
-    """Reads a digraph from a networkx DiGraph into the timble input format."""
+# Formulations whose objective accounts for edge failures
+FAILURE_AWARE_FORMULATIONS = ("picef", "ccf", "picef_sparse")
+
+
+def nx_to_trimble(g, reachability=None, edge_probs=None):
+    """Reads a digraph from a networkx DiGraph into the timble input format.
+
+    If a BoundedReachability is given, its pool is updated to the pairs in g
+    and attached to the digraph, so that cycle search reuses it.
+    If edge_probs is given, edge_probs[v, w] is the success probability of edge (v, w).
+    """
 
     g_pairs, g_ndds = separate_ndds(g)
     digraph = Digraph(len(g_pairs))
@@ -28,17 +41,50 @@ def nx_to_trimble(g):
     ndds = [Ndd() for _ in g_ndds]
 
     for v, w in g.edges():
+        p = 1 if edge_probs is None else edge_probs[v, w]
         if not g.node[v]["ndd"]:
             src_id, tgt_id = pair_map[v], pair_map[w]
-            digraph.add_edge(1, digraph.vs[src_id], digraph.vs[tgt_id])
+            digraph.add_edge(1, digraph.vs[src_id], digraph.vs[tgt_id], p)
         else:
             src_id, tgt_id = ndd_map[v], pair_map[w]
-            ndds[src_id].add_edge(NddEdge(digraph.vs[tgt_id], 1))
+            ndds[src_id].add_edge(NddEdge(digraph.vs[tgt_id], 1, p))
+
+    if reachability is not None:
+        reachability.update(g, g_pairs)
+        digraph.attach_reachability(reachability, g_pairs)
 
     return digraph, ndds
 
 
-def solve(g, max_cycle, max_chain, formulation="hpief_prime_full_red"):
+def indexed_cycles(digraph, g_pairs, cycle_index, max_cycle):
+    """Cycles of the pairs g_pairs read from a CycleIndex, as lists of digraph vertices
+    starting from the lowest id (as generate_cycles would find them)."""
+    pair_map = {v: k for k, v in enumerate(g_pairs)}
+    cycles = []
+    for c in cycle_index.ordered_cycles(g_pairs, max_cycle):
+        ids = [pair_map[v] for v in c]
+        i = ids.index(min(ids))
+        cycles.append([digraph.vs[k] for k in ids[i:] + ids[:i]])
+    return cycles
+
+
+@profiled("trimble.solve")
+def solve(g, max_cycle, max_chain, formulation="hpief_prime_full_red",
+          reachability=None, cycle_index=None, edge_success_prob=1):
+    """Solve the exchange g.
+
+    edge_success_prob is either a number or a dict of per-edge probabilities keyed
+    by (v, w). Formulations that cannot account for it are replaced by PICEF, or by
+    the cycle formulation for per-edge probabilities with chains (PICEF only knows
+    the position of a chain edge, not the path that led to it).
+    """
+    per_edge = isinstance(edge_success_prob, dict)
+    if per_edge and (max_chain > 0 or formulation not in FAILURE_AWARE_FORMULATIONS):
+        formulation = "ccf"
+    elif not per_edge and edge_success_prob != 1 \
+            and formulation not in FAILURE_AWARE_FORMULATIONS:
+        formulation = "picef"
+
     if formulation == "hpief_prime_full_red":
         fn = k_ip.optimise_hpief_prime_full_red
     elif formulation == "hpief_prime":
@@ -53,11 +99,26 @@ def solve(g, max_cycle, max_chain, formulation="hpief_prime_full_red"):
         fn = k_ip.optimise_uuef
     elif formulation == "eef":
         fn = k_ip.optimise_eef
+    elif formulation == "picef_sparse":
+        fn = k_ip_sparse.optimise_picef_sparse
+    elif formulation == "hpief_prime_sparse":
+        fn = k_ip_sparse.optimise_hpief_prime_sparse
+    elif formulation == "hpief_prime_full_red_sparse":
+        fn = k_ip_sparse.optimise_hpief_prime_full_red_sparse
+    elif formulation == "hpief_2prime_sparse":
+        fn = k_ip_sparse.optimise_hpief_2prime_sparse
     else:
         raise ValueError("Cannot understand formulation")
 
-    d, ndds = nx_to_trimble(g)
-    opt_result = fn(k_ip.OptConfig(d, ndds, max_cycle, max_chain))
+    with timer("trimble.build"):
+        d, ndds = nx_to_trimble(g, reachability, edge_success_prob if per_edge else None)
+        cycles = None
+        if cycle_index is not None and formulation in ("picef", "ccf", "picef_sparse") \
+                and cycle_index.max_cycle_length >= max_cycle:
+            cycles = indexed_cycles(d, separate_ndds(g)[0], cycle_index, max_cycle)
+    with timer("trimble.optimise"):
+        opt_result = fn(k_ip.OptConfig(d, ndds, max_cycle, max_chain, cycles=cycles,
+                                       edge_success_prob=1 if per_edge else edge_success_prob))
     return opt_result
 
 
@@ -111,9 +172,18 @@ def parse_trimble_solution(opt, g):
     return opt.ip_model.ObjVal, matched, timing, new_heads
 
 
+@profiled("trimble.optimal")
 def optimal(env, max_cycle, max_chain,
             t_begin=None, t_end=None,
-            formulation="hpief_prime_full_red"):
+            formulation="hpief_prime_full_red",
+            reachability=None,
+            edge_success_prob=1):
+    """Optimal matching of the pairs alive in [t_begin, t_end].
+
+    edge_success_prob is a number, or "pra" for per-edge probabilities read from the
+    environment (see matching.solver.expected_value). When it is not 1, obj is the
+    expected number of transplants.
+    """
 
     if t_begin is None:
         t_begin = 0
@@ -121,7 +191,16 @@ def optimal(env, max_cycle, max_chain,
         t_end = env.time_length
 
     g = env.subgraph(env.get_living(t_begin, t_end))
-    opt = solve(g, max_cycle=max_cycle, max_chain=max_chain, formulation=formulation)
+    if isinstance(edge_success_prob, str):
+        edges = list(g.edges())
+        probs = edge_success_probs(env, [v for v, _ in edges], [w for _, w in edges],
+                                   edge_success_prob)
+        edge_success_prob = dict(zip(edges, probs))
+
+    opt = solve(g, max_cycle=max_cycle, max_chain=max_chain,
+                formulation=formulation, reachability=reachability,
+                cycle_index=getattr(env, "cycle_index", None),
+                edge_success_prob=edge_success_prob)
     obj, matched, timing, new_heads = parse_trimble_solution(opt, g)
     return {"obj": obj,
             "matched": matched,
@@ -130,7 +209,9 @@ def optimal(env, max_cycle, max_chain,
             "new_heads": new_heads}
 
 
-def greedy(env, max_cycle, max_chain, t_begin=None, t_end=None, formulation="hpief_prime_full_red"):
+@profiled("trimble.greedy")
+def greedy(env, max_cycle, max_chain, t_begin=None, t_end=None, formulation="hpief_prime_full_red",
+           edge_success_prob=1):
     if t_begin is None:
         t_begin = 0
     if t_end is None:
@@ -138,12 +219,17 @@ def greedy(env, max_cycle, max_chain, t_begin=None, t_end=None, formulation="hpi
 
     #container = deepcopy(env.removed_container)
     env = deepcopy(env)
+    # Consecutive pools share most vertices, so cycle-search pruning is kept up to date
+    # incrementally instead of being recomputed by BFS in every period
+    reachability = BoundedReachability(max_cycle - 1)
     obj = 0
     matched = []
     opts = []
     timing = defaultdict(list)
     for t in range(t_begin, t_end):
-        opt_t = optimal(env, max_cycle, max_chain, t_begin=t, t_end=t, formulation=formulation)
+        opt_t = optimal(env, max_cycle, max_chain, t_begin=t, t_end=t,
+                        formulation=formulation, reachability=reachability,
+                        edge_success_prob=edge_success_prob)
         obj += opt_t["obj"]
         matched.extend(opt_t["matched"])
         env.removed_container[t].update(opt_t["matched"])
@@ -159,6 +245,9 @@ def greedy(env, max_cycle, max_chain, t_begin=None, t_end=None, formulation="hpi
             # Delete incoming edges
             in_edges = list(env.in_edges(node))
             env.remove_edges_from(in_edges)
+            reachability.discard(node)
+            if getattr(env, "cycle_index", None) is not None:
+                env.cycle_index.refresh_vertices([node])
 
     #env.removed_container = container
     return {"obj": obj,
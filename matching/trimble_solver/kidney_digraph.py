@@ -25,11 +25,15 @@ def failure_aware_cycle_score(cycle, digraph, edge_success_prob):
     Args:
         cycle: A list of Vertex objects in the cycle, with the first Vertex not repeated.
         digraph: The digraph in which this cycle appears.
-        edge_success_prob: The problem that any given edge will NOT fail
+        edge_success_prob: The problem that any given edge will NOT fail, on top
+            of each edge's own success_prob
     """
 
-    return sum(digraph.adj_mat[cycle[i-1].id][cycle[i].id].score
-                    for i in range(len(cycle))) * edge_success_prob**len(cycle)
+    edges = [digraph.adj_mat[cycle[i-1].id][cycle[i].id] for i in range(len(cycle))]
+    prob = edge_success_prob**len(cycle)
+    for e in edges:
+        prob *= e.success_prob
+    return sum(e.score for e in edges) * prob
 
 class Vertex:
     """A vertex in a directed graph (see the Digraph class)."""
@@ -44,11 +48,12 @@ class Vertex:
 class Edge:
     """An edge in a directed graph (see the Digraph class)."""
 
-    def __init__(self, id, score, src, tgt):
+    def __init__(self, id, score, src, tgt, success_prob=1):
         self.id = id
         self.score = score
         self.src = src   # source vertex
         self.tgt = tgt # target vertex
+        self.success_prob = success_prob # probability that the edge will NOT fail
 
     def __str__(self):
         return ("V" + str(self.src.id) + "-V" + str(self.tgt.id))
@@ -60,6 +65,9 @@ class Digraph:
         n: the number of vertices in the digraph
         vs: an array of Vertex objects, such that vs[i].id == i
         es: an array of Edge objects, such that es[i].id = i
+        labels: labels[i] is the original label of vertex i, or None
+        reachability: an optional BoundedReachability over the labels, used
+            instead of a fresh BFS when pruning cycle search
     """
 
     def __init__(self, n):
@@ -68,22 +76,38 @@ class Digraph:
         self.vs = [Vertex(i) for i in range(n)]
         self.adj_mat = [[None for x in range(n)] for x in range(n)]
         self.es = []
+        self.labels = None
+        self.reachability = None
 
-    def add_edge(self, score, source, tgt):
+    def add_edge(self, score, source, tgt, success_prob=1):
         """Add an edge to the digraph
 
         Args:
             score: the edge's score, as a float
             source: the source Vertex
             tgt: the edge's target Vertex
+            success_prob: the probability that the edge will NOT fail
         """
 
         id = len(self.es)
-        e = Edge(id, score, source, tgt)
+        e = Edge(id, score, source, tgt, success_prob)
         self.es.append(e)
         source.edges.append(e)
         self.adj_mat[source.id][tgt.id] = e
-    
+
+    def attach_reachability(self, reachability, labels):
+        """Use a precomputed BoundedReachability for cycle-search pruning.
+
+        Args:
+            reachability: a BoundedReachability whose pool contains every labelled
+                vertex and (at least) every edge of this digraph
+            labels: labels[i] is the label of vertex i in the reachability pool
+        """
+
+        self.labels = list(labels)
+        self.reachability = reachability
+        self._label_to_id = {label: i for i, label in enumerate(self.labels)}
+
     def find_cycles(self, max_length):
         """Find cycles of length up to max_length in the digraph.
 
@@ -119,15 +143,20 @@ class Digraph:
                         vtx_used[v.id] = False
                         del current_path[-1]
 
-        # Adjacency lists for transpose graph
-        transp_adj_lists = [[] for v in self.vs]
-        for edge in self.es:
-            transp_adj_lists[edge.tgt.id].append(edge.src)
+        if self.has_reachability(max_length - 1):
+            shortest_paths = lambda v: self.cached_shortest_path_to_low_vtx(v.id, max_length - 1)
+        else:
+            # Adjacency lists for transpose graph
+            transp_adj_lists = [[] for v in self.vs]
+            for edge in self.es:
+                transp_adj_lists[edge.tgt.id].append(edge.src)
 
-        for v in self.vs:
-            shortest_paths_to_low_vtx = self.calculate_shortest_path_lengths(
+            shortest_paths = lambda v: self.calculate_shortest_path_lengths(
                     v, max_length - 1,
                     lambda u: (w for w in transp_adj_lists[u.id] if w.id > v.id))
+
+        for v in self.vs:
+            shortest_paths_to_low_vtx = shortest_paths(v)
             vtx_used[v.id] = True
             for c in cycle([v]):
                 yield c
@@ -146,6 +175,9 @@ class Digraph:
             path to low_vtx from v is shorter than max_path, then element v of the array
             will be the length of this shortest path. Otherwise, element v will be
             999999999."""
+        if self.has_reachability(max_path):
+            return self.cached_shortest_path_to_low_vtx(low_vtx, max_path)
+
         def adj_list_accessor(v):
             for i in range(low_vtx, len(self.vs)):
                 if self.adj_mat[i][v.id]:
@@ -154,6 +186,23 @@ class Digraph:
         return self.calculate_shortest_path_lengths(self.vs[low_vtx], max_path,
                     adj_list_accessor=adj_list_accessor)
 
+    def has_reachability(self, max_path):
+        """True if an attached BoundedReachability records paths up to max_path."""
+        return self.reachability is not None and self.reachability.max_dist >= max_path
+
+    def cached_shortest_path_to_low_vtx(self, low_vtx, max_path):
+        """Same output format as get_shortest_path_to_low_vtx, read from the attached
+            BoundedReachability. The cached paths may leave the vertices indexed
+            above low_vtx, so each element is a lower bound on the restricted path
+            length. This keeps every pruning decision valid."""
+        distances = [999999999] * len(self.vs)
+        for label, d in self.reachability.dist_to[self.labels[low_vtx]].items():
+            v_id = self._label_to_id.get(label)
+            if v_id is not None and v_id > low_vtx and d <= max_path:
+                distances[v_id] = d
+        distances[low_vtx] = 0
+        return distances
+
     def calculate_shortest_path_lengths(self, from_v, max_dist,
                 adj_list_accessor=lambda v: (e.tgt for e in v.edges)):
         """Calculate the length of the shortest path from vertex from_v to each
@@ -202,7 +251,10 @@ class Digraph:
                 if e is not None:
                     new_src = subgraph.vs[i]
                     new_tgt = subgraph.vs[j]
-                    subgraph.add_edge(e.score, new_src, new_tgt)
+                    subgraph.add_edge(e.score, new_src, new_tgt, e.success_prob)
+        if self.reachability is not None:
+            subgraph.attach_reachability(self.reachability,
+                                         [self.labels[v.id] for v in vertices])
         return subgraph
 
     def __str__(self):
@@ -28,11 +28,15 @@ class OptConfig(object):
         eef_alt_constraints: True if and only if alternative EEF constraints should be used
         lp_file: The name of a .lp file to write, or None if the file should not be written
         relax: True if and only if the LP relaxation should be solved also
+        cycles: A precomputed list of the digraph's cycles (each a list of vertices)
+            for the formulations that enumerate them, or None to find them here
+        matrix_file: The name of a .npz file to which the sparse formulations save
+            their constraint matrix and objective, or None
     """
 
     def __init__(self, digraph, ndds, max_cycle, max_chain, verbose=False,
                  timelimit=None, edge_success_prob=1, eef_alt_constraints=False,
-                 lp_file=None, relax=False):
+                 lp_file=None, relax=False, cycles=None, matrix_file=None):
         self.digraph = digraph
         self.ndds = ndds
         self.max_cycle = max_cycle
@@ -43,6 +47,8 @@ class OptConfig(object):
         self.eef_alt_constraints = eef_alt_constraints
         self.lp_file = lp_file
         self.relax = relax
+        self.cycles = cycles
+        self.matrix_file = matrix_file
 
 
 class OptSolution(object):
@@ -144,6 +150,8 @@ def optimise_relabelled(formulation_fun, cfg):
     relabelled_cfg = copy.copy(cfg)
     relabelled_cfg.digraph = relabelled_digraph
     relabelled_cfg.ndds = relabelled_ndds
+    if cfg.cycles is not None:
+        relabelled_cfg.cycles = [[old_to_new_vtx[v.id] for v in c] for c in cfg.cycles]
 
     opt_result = formulation_fun(relabelled_cfg)
     return opt_result.relabelled_copy(sorted_vertices, cfg.digraph)
@@ -292,14 +300,14 @@ def add_chain_vars_and_constraints(digraph, ndds, max_chain, m, vtx_to_vars,
         # Add pair->pair edge variables, indexed by position in chain
         for e in digraph.es:
             e.grb_vars = []
-            # if store_edge_positions:
-            #     e.grb_var_positions = []
+            if store_edge_positions:
+                e.grb_var_positions = []
             for i in range(max_chain - 1):
                 if dists_from_ndd[e.src.id] <= i + 1:
                     edge_var = m.addVar(vtype=GRB.BINARY)
                     e.grb_vars.append(edge_var)
-                    # if store_edge_positions:
-                    #     e.grb_var_positions.append(i+1)
+                    if store_edge_positions:
+                        e.grb_var_positions.append(i+1)
                     vtx_to_vars[e.tgt.id].append(edge_var)
                     e.src.grb_vars_out[i].append(edge_var)
                     if i < max_chain - 2:
@@ -319,22 +327,14 @@ def add_chain_vars_and_constraints(digraph, ndds, max_chain, m, vtx_to_vars,
 #                                                                                                 #
 ###################################################################################################
 
-def add_hpief_prime_vars_partial_red(max_cycle, digraph, m, hpief_2_prime=False):
-    vars_and_edges = []  # A list of (gurobi_var, position, edge, low_vertex) tuples
+def hpief_prime_positions_partial_red(max_cycle, digraph, hpief_2_prime=False):
+    """The (position, edge, low_vertex) triples that get a variable in HPIEF', pruned
+    using shortest-path lengths from and to each low vertex."""
+    positions = []
 
     # max_pos is the maximum edge position for which variables may be created
     max_pos = max_cycle - 2 if hpief_2_prime else max_cycle - 1
 
-    # Index i is in the list edge_vars_in[pos][v][low_v] if and only if
-    # vars_and_edges[i] corresponds to an edge at position pos, pointing to vertex
-    # v, in low_v's graph copy 
-    edge_vars_in = [[[[] for __ in range(digraph.n)] for __ in range(digraph.n)] for __ in range(max_pos + 1)]
-
-    # Index i is in the list edge_vars_out[pos][v][low_v] if and only if
-    # vars_and_edges[i] corresponds to an edge at position pos, leaving vertex
-    # v, in low_v's graph copy 
-    edge_vars_out = [[[[] for __ in range(digraph.n)] for __ in range(digraph.n)] for __ in range(max_pos + 1)]
-
     for low_vtx in range(digraph.n - 1):
         # Length of shortest path from low vertex to each vertex with a higher index
         # Default value is 999999999 (which represents infinity)
@@ -347,42 +347,59 @@ def add_hpief_prime_vars_partial_red(max_cycle, digraph, m, hpief_2_prime=False)
                     for pos in range(1, max_pos + 1):
                         if (shortest_path_from_lv[e.src.id] <= pos and
                                 shortest_path_to_lv[e.tgt.id] < max_cycle - pos):
-                            new_var = m.addVar(vtype=GRB.BINARY)
-                            vars_and_edges.append((new_var, pos, e, low_vtx))
-                            idx = len(vars_and_edges) - 1  # Index of tuple just added
-                            edge_vars_in[pos][e.tgt.id][low_vtx].append(idx)
-                            edge_vars_out[pos][e.src.id][low_vtx].append(idx)
-    m.update()
-    return vars_and_edges, edge_vars_in, edge_vars_out
+                            positions.append((pos, e, low_vtx))
+    return positions
 
 
-def add_hpief_prime_vars_full_red(max_cycle, digraph, m, hpief_2_prime=False):
+def hpief_prime_positions_full_red(max_cycle, digraph, hpief_2_prime=False):
+    """The (position, edge, low_vertex) triples that get a variable in HPIEF', keeping
+    only those that appear in some cycle."""
+    edges_seen = set()  # (low_v_id, src_v_id, tgt_v_id, pos) tuples
+    for cycle in digraph.generate_cycles(max_cycle):
+        for i in range(1, len(cycle) - 1):
+            edges_seen.add((cycle[0].id, cycle[i].id, cycle[i + 1].id, i))
+        if not hpief_2_prime or len(cycle) < max_cycle:
+            edges_seen.add((cycle[0].id, cycle[-1].id, cycle[0].id, len(cycle) - 1))
+
+    return [(pos, digraph.adj_mat[src_v][tgt_v], low_v) for low_v, src_v, tgt_v, pos in edges_seen]
+
+
+def add_hpief_prime_vars(positions, max_cycle, digraph, m, hpief_2_prime=False):
     vars_and_edges = []  # A list of (gurobi_var, position, edge, low_vertex) tuples
 
     # max_pos is the maximum edge position for which variables may be created
     max_pos = max_cycle - 2 if hpief_2_prime else max_cycle - 1
 
+    # Index i is in the list edge_vars_in[pos][v][low_v] if and only if
+    # vars_and_edges[i] corresponds to an edge at position pos, pointing to vertex
+    # v, in low_v's graph copy 
     edge_vars_in = [[[[] for __ in range(digraph.n)] for __ in range(digraph.n)] for __ in range(max_pos + 1)]
-    edge_vars_out = [[[[] for __ in range(digraph.n)] for __ in range(digraph.n)] for __ in range(max_pos + 1)]
 
-    edges_seen = set()  # (low_v_id, src_v_id, tgt_v_id, pos) tuples
-    for cycle in digraph.generate_cycles(max_cycle):
-        for i in range(1, len(cycle) - 1):
-            edges_seen.add((cycle[0].id, cycle[i].id, cycle[i + 1].id, i))
-        if not hpief_2_prime or len(cycle) < max_cycle:
-            edges_seen.add((cycle[0].id, cycle[-1].id, cycle[0].id, len(cycle) - 1))
+    # Index i is in the list edge_vars_out[pos][v][low_v] if and only if
+    # vars_and_edges[i] corresponds to an edge at position pos, leaving vertex
+    # v, in low_v's graph copy 
+    edge_vars_out = [[[[] for __ in range(digraph.n)] for __ in range(digraph.n)] for __ in range(max_pos + 1)]
 
-    for low_v, src_v, tgt_v, pos in edges_seen:
+    for pos, e, low_vtx in positions:
         new_var = m.addVar(vtype=GRB.BINARY)
-        e = digraph.adj_mat[src_v][tgt_v]
-        vars_and_edges.append((new_var, pos, e, low_v))
+        vars_and_edges.append((new_var, pos, e, low_vtx))
         idx = len(vars_and_edges) - 1  # Index of tuple just added
-        edge_vars_in[pos][tgt_v][low_v].append(idx)
-        edge_vars_out[pos][src_v][low_v].append(idx)
+        edge_vars_in[pos][e.tgt.id][low_vtx].append(idx)
+        edge_vars_out[pos][e.src.id][low_vtx].append(idx)
     m.update()
     return vars_and_edges, edge_vars_in, edge_vars_out
 
 
+def add_hpief_prime_vars_partial_red(max_cycle, digraph, m, hpief_2_prime=False):
+    positions = hpief_prime_positions_partial_red(max_cycle, digraph, hpief_2_prime)
+    return add_hpief_prime_vars(positions, max_cycle, digraph, m, hpief_2_prime)
+
+
+def add_hpief_prime_vars_full_red(max_cycle, digraph, m, hpief_2_prime=False):
+    positions = hpief_prime_positions_full_red(max_cycle, digraph, hpief_2_prime)
+    return add_hpief_prime_vars(positions, max_cycle, digraph, m, hpief_2_prime)
+
+
 def add_hpief_prime_vars_and_constraints(max_cycle, digraph, vtx_to_in_edges, m, full_red, hpief_2_prime=False):
     max_pos = max_cycle - 2 if hpief_2_prime else max_cycle - 1
 
@@ -527,7 +544,7 @@ def optimise_picef(cfg):
         an OptSolution object
     """
 
-    cycles = cfg.digraph.find_cycles(cfg.max_cycle)
+    cycles = cfg.cycles if cfg.cycles is not None else cfg.digraph.find_cycles(cfg.max_cycle)
 
     m = create_ip_model(cfg.timelimit, cfg.verbose)
     m.params.method = 2
@@ -590,7 +607,7 @@ def optimise_ccf(cfg):
         an OptSolution object
     """
 
-    cycles = cfg.digraph.find_cycles(cfg.max_cycle)
+    cycles = cfg.cycles if cfg.cycles is not None else cfg.digraph.find_cycles(cfg.max_cycle)
     chains = find_chains(cfg.digraph, cfg.ndds, cfg.max_chain, cfg.edge_success_prob)
 
     m = create_ip_model(cfg.timelimit, cfg.verbose)
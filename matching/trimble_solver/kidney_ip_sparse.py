@@ -0,0 +1,280 @@
+"""PICEF and HPIEF' assembled as sparse matrices and loaded into Gurobi in bulk.
+
+The formulations in kidney_ip create one Gurobi object per variable and per
+constraint, and for large instances building the model takes longer than solving
+it. Here the same models are written as an objective vector c and a sparse
+constraint matrix A (with one sense and right-hand side per row), which are
+passed to Gurobi's matrix interface in a single call. The matrices can also be
+saved to disk (OptConfig.matrix_file) and read back with load_matrices.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from gurobipy import GRB
+
+from . import kidney_utils
+from .kidney_digraph import cycle_score, failure_aware_cycle_score
+from .kidney_ip import OptSolution, create_ip_model, optimise, \
+    hpief_prime_positions_full_red, hpief_prime_positions_partial_red
+from .kidney_ndds import Chain
+
+
+class SparseModel(object):
+    """Columns, rows and nonzeros of a binary maximisation problem.
+
+    Rows are created the first time one of their entries is added, and are
+    identified by an arbitrary hashable key, so that empty constraints are never
+    materialised.
+
+    Data members:
+        obj: the objective coefficient of each column
+        row_keys: maps a row key to its index
+        sense: the sense of each row (GRB.LESS_EQUAL, GRB.GREATER_EQUAL or GRB.EQUAL)
+        rhs: the right-hand side of each row
+    """
+
+    def __init__(self):
+        self.obj = []
+        self.row_keys = {}
+        self.sense = []
+        self.rhs = []
+        self._rows = []
+        self._cols = []
+        self._vals = []
+
+    @property
+    def n_cols(self):
+        return len(self.obj)
+
+    def add_column(self, obj):
+        self.obj.append(obj)
+        return len(self.obj) - 1
+
+    def add_entry(self, key, sense, rhs, col, val=1):
+        row = self.row_keys.get(key)
+        if row is None:
+            row = self.row_keys[key] = len(self.sense)
+            self.sense.append(sense)
+            self.rhs.append(rhs)
+        self._rows.append(row)
+        self._cols.append(col)
+        self._vals.append(val)
+
+    def matrices(self):
+        """Returns c, A (in CSR format), sense and rhs as numpy/scipy objects."""
+        A = sp.csr_matrix((np.array(self._vals, dtype=float),
+                           (np.array(self._rows, dtype=int), np.array(self._cols, dtype=int))),
+                          shape=(len(self.sense), self.n_cols))
+        return (np.array(self.obj, dtype=float), A,
+                np.array(self.sense, dtype="U1"), np.array(self.rhs, dtype=float))
+
+
+def save_matrices(filename, c, A, sense, rhs):
+    np.savez_compressed(filename, c=c, data=A.data, indices=A.indices, indptr=A.indptr,
+                        shape=A.shape, sense=sense, rhs=rhs)
+
+
+def load_matrices(filename):
+    """Read back the output of save_matrices as (c, A, sense, rhs)."""
+    f = np.load(filename)
+    A = sp.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+    return f["c"], A, f["sense"], f["rhs"]
+
+
+def solve_sparse_model(model, cfg):
+    """Load a SparseModel into a new Gurobi model, optimise it and return
+    (gurobi_model, column_values)."""
+
+    c, A, sense, rhs = model.matrices()
+    if cfg.matrix_file:
+        save_matrices(cfg.matrix_file, c, A, sense, rhs)
+
+    m = create_ip_model(cfg.timelimit, cfg.verbose)
+    m.params.method = 2
+    x = m.addMVar(len(c), vtype=GRB.BINARY, obj=c)
+    if A.shape[0] > 0:
+        m.addMConstr(A, x, sense, rhs)
+    m.ModelSense = GRB.MAXIMIZE
+    optimise(m, cfg)
+    return m, (x.X if len(c) > 0 else np.zeros(0))
+
+
+def add_chain_columns(model, digraph, ndds, max_chain, edge_success_prob=1):
+    """Sparse counterpart of kidney_ip.add_chain_vars_and_constraints.
+
+    Vertex capacity rows are keyed ("cap", v_id), so that cycle columns can share them.
+
+    Returns:
+        ndd_cols: a list of (column, ndd_index, ndd_edge) tuples
+        edge_cols: a list of (column, edge) tuples for pair->pair chain edges
+    """
+
+    ndd_cols = []
+    edge_cols = []
+    if max_chain == 0:
+        return ndd_cols, edge_cols
+
+    for i, ndd in enumerate(ndds):
+        for e in ndd.edges:
+            col = model.add_column(e.score * edge_success_prob)
+            ndd_cols.append((col, i, e))
+            model.add_entry(("ndd", i), GRB.LESS_EQUAL, 1, col)
+            model.add_entry(("cap", e.target_v.id), GRB.LESS_EQUAL, 1, col)
+            if max_chain > 1:
+                model.add_entry(("flow", 0, e.target_v.id), GRB.GREATER_EQUAL, 0, col)
+
+    dists_from_ndd = kidney_utils.get_dist_from_nearest_ndd(digraph, ndds)
+
+    # Pair->pair edge columns, indexed by position in chain
+    for e in digraph.es:
+        for i in range(max_chain - 1):
+            if dists_from_ndd[e.src.id] <= i + 1:
+                col = model.add_column(e.score * edge_success_prob ** (i + 2))
+                edge_cols.append((col, e))
+                model.add_entry(("cap", e.tgt.id), GRB.LESS_EQUAL, 1, col)
+                # At each chain position, sum of edges into a vertex must be >= sum of edges out
+                model.add_entry(("flow", i, e.src.id), GRB.GREATER_EQUAL, 0, col, -1)
+                if i < max_chain - 2:
+                    model.add_entry(("flow", i + 1, e.tgt.id), GRB.GREATER_EQUAL, 0, col)
+
+    return ndd_cols, edge_cols
+
+
+def selected_chains(digraph, ndd_cols, edge_cols, x, edge_success_prob=1):
+    """Sparse counterpart of kidney_utils.get_optimal_chains."""
+
+    chain_next_vv = {e.src.id: e.tgt.id for col, e in edge_cols if x[col] > 0.1}
+
+    optimal_chains = []
+    for col, i, e in ndd_cols:
+        if x[col] > 0.1:
+            vtx_indices = kidney_utils.find_selected_path(e.target_v.id, chain_next_vv)
+            score = e.score * edge_success_prob
+            for j in range(len(vtx_indices) - 1):
+                score += digraph.adj_mat[vtx_indices[j]][vtx_indices[j + 1]].score * \
+                         edge_success_prob ** (j + 2)
+            optimal_chains.append(Chain(i, vtx_indices, score))
+    return optimal_chains
+
+
+def optimise_picef_sparse(cfg):
+    """Optimise using the PICEF formulation, built as a sparse matrix.
+
+    Args:
+        cfg: an OptConfig object
+
+    Returns:
+        an OptSolution object
+    """
+
+    cycles = cfg.cycles if cfg.cycles is not None else cfg.digraph.find_cycles(cfg.max_cycle)
+
+    model = SparseModel()
+    ndd_cols, edge_cols = add_chain_columns(model, cfg.digraph, cfg.ndds, cfg.max_chain,
+                                            cfg.edge_success_prob)
+
+    cycle_cols = []
+    for c in cycles:
+        # Same scores as kidney_ip.optimise_picef, which reads per-edge
+        # success probabilities whenever there are no chains
+        if cfg.max_chain > 0 and cfg.edge_success_prob == 1:
+            col = model.add_column(cycle_score(c, cfg.digraph))
+        else:
+            col = model.add_column(failure_aware_cycle_score(c, cfg.digraph, cfg.edge_success_prob))
+        cycle_cols.append(col)
+        for v in c:
+            model.add_entry(("cap", v.id), GRB.LESS_EQUAL, 1, col)
+
+    m, x = solve_sparse_model(model, cfg)
+
+    return OptSolution(ip_model=m,
+                       cycles=[c for c, col in zip(cycles, cycle_cols) if x[col] > 0.5],
+                       chains=selected_chains(cfg.digraph, ndd_cols, edge_cols, x,
+                                              cfg.edge_success_prob),
+                       digraph=cfg.digraph,
+                       edge_success_prob=cfg.edge_success_prob)
+
+
+def optimise_hpief_prime_sparse(cfg, full_red=False, hpief_2_prime=False):
+    """Optimise using the HPIEF' or HPIEF'' formulation, built as a sparse matrix.
+
+    Args:
+        cfg: an OptConfig object
+        full_red: True if cycles should be generated in order to reduce number of variables further
+        hpief_2_prime: Use HPIEF''? Default: HPIEF'
+
+    Returns:
+        an OptSolution object
+    """
+
+    if cfg.edge_success_prob != 1:
+        raise ValueError("This formulation does not support failure-aware matching.")
+
+    if cfg.max_cycle < 3:
+        hpief_2_prime = False
+
+    max_pos = cfg.max_cycle - 2 if hpief_2_prime else cfg.max_cycle - 1
+
+    model = SparseModel()
+    ndd_cols, edge_cols = add_chain_columns(model, cfg.digraph, cfg.ndds, cfg.max_chain)
+
+    if full_red:
+        positions = hpief_prime_positions_full_red(cfg.max_cycle, cfg.digraph, hpief_2_prime)
+    else:
+        positions = hpief_prime_positions_partial_red(cfg.max_cycle, cfg.digraph, hpief_2_prime)
+
+    cycle_cols = []
+    for pos, edge, low_v_id in positions:
+        score = edge.score
+        if pos == 1:
+            score += cfg.digraph.adj_mat[low_v_id][edge.src.id].score
+        closes = hpief_2_prime and pos == cfg.max_cycle - 2 and edge.tgt.id != low_v_id
+        if closes:
+            score += cfg.digraph.adj_mat[edge.tgt.id][low_v_id].score
+
+        col = model.add_column(score)
+        cycle_cols.append(col)
+
+        # Capacity constraint for vertices
+        model.add_entry(("cap", edge.tgt.id), GRB.LESS_EQUAL, 1, col)
+        if pos == 1:
+            model.add_entry(("cap", edge.src.id), GRB.LESS_EQUAL, 1, col)
+        if closes:
+            model.add_entry(("cap", low_v_id), GRB.LESS_EQUAL, 1, col)
+
+        # Cycle flow-conservation constraint for vertices other than the low vertex
+        if pos < max_pos and edge.tgt.id != low_v_id:
+            model.add_entry(("cycle", pos, edge.tgt.id, low_v_id), GRB.EQUAL, 0, col)
+        if pos > 1:
+            model.add_entry(("cycle", pos - 1, edge.src.id, low_v_id), GRB.EQUAL, 0, col, -1)
+
+    m, x = solve_sparse_model(model, cfg)
+
+    cycle_start_vv = []
+    cycle_next_vv = {}
+    for col, (pos, edge, low_v_id) in zip(cycle_cols, positions):
+        if x[col] > 0.1:
+            cycle_next_vv[edge.src.id] = edge.tgt.id
+            if pos == 1:
+                cycle_start_vv.append(low_v_id)
+                cycle_next_vv[low_v_id] = edge.src.id
+            if hpief_2_prime and pos == cfg.max_cycle - 2 and edge.tgt.id != low_v_id:
+                cycle_next_vv[edge.tgt.id] = low_v_id
+
+    return OptSolution(ip_model=m,
+                       cycles=kidney_utils.selected_edges_to_cycles(
+                           cfg.digraph, cycle_start_vv, cycle_next_vv),
+                       chains=selected_chains(cfg.digraph, ndd_cols, edge_cols, x),
+                       digraph=cfg.digraph)
+
+
+def optimise_hpief_prime_full_red_sparse(cfg):
+    return optimise_hpief_prime_sparse(cfg, full_red=True)
+
+
+def optimise_hpief_2prime_sparse(cfg, full_red=False):
+    return optimise_hpief_prime_sparse(cfg, full_red, hpief_2_prime=True)
+
+
+def optimise_hpief_2prime_full_red_sparse(cfg):
+    return optimise_hpief_2prime_sparse(cfg, full_red=True)
@@ -20,9 +20,10 @@ class Ndd:
 
 class NddEdge:
     """An edge pointing from an NDD to a vertex in the directed graph"""
-    def __init__(self, target_v, score):
+    def __init__(self, target_v, score, success_prob=1):
         self.target_v = target_v
         self.score = score
+        self.success_prob = success_prob # probability that the edge will NOT fail
 
 def create_relabelled_ndds(ndds, old_to_new_vtx):
     """Creates a copy of a n array of NDDs, with target vertices changed.
@@ -33,7 +34,8 @@ def create_relabelled_ndds(ndds, old_to_new_vtx):
     new_ndds = [Ndd() for ndd in ndds]
     for i, ndd in enumerate(ndds):
         for edge in ndd.edges:
-            new_ndds[i].add_edge(NddEdge(old_to_new_vtx[edge.target_v.id], edge.score))
+            new_ndds[i].add_edge(NddEdge(old_to_new_vtx[edge.target_v.id], edge.score,
+                                         edge.success_prob))
 
     return new_ndds
 
@@ -113,13 +115,15 @@ class Chain(object):
 def find_chains(digraph, ndds, max_chain, edge_success_prob=1):
     """Generate all chains with up to max_chain edges."""
 
-    def find_chains_recurse(vertices, score):
+    # prob is the probability that every edge of the chain so far succeeds
+    def find_chains_recurse(vertices, score, prob):
         chains.append(Chain(ndd_idx, vertices[:], score))
         if len(vertices) < max_chain:
             for e in digraph.vs[vertices[-1]].edges:
                 if e.tgt.id not in vertices:
                     vertices.append(e.tgt.id)
-                    find_chains_recurse(vertices, score+e.score*edge_success_prob**len(vertices))
+                    next_prob = prob*e.success_prob*edge_success_prob
+                    find_chains_recurse(vertices, score+e.score*next_prob, next_prob)
                     del vertices[-1]
     chains = []
     if max_chain == 0:
@@ -127,6 +131,7 @@ def find_chains(digraph, ndds, max_chain, edge_success_prob=1):
     for ndd_idx, ndd in enumerate(ndds):
         for e in ndd.edges:
             vertices = [e.target_v.id]
-            find_chains_recurse(vertices, e.score*edge_success_prob)
+            prob = e.success_prob*edge_success_prob
+            find_chains_recurse(vertices, e.score*prob, prob)
     return chains
 
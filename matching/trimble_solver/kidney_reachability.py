@@ -0,0 +1,144 @@
+"""Bounded-depth reachability that is maintained incrementally as the pool changes.
+
+Cycle generation prunes every DFS branch using the length of the shortest path
+back to the cycle's lowest vertex. Computing those lengths from scratch means one
+BFS per vertex on every call, even though consecutive pools of a simulation share
+almost all of their vertices. A BoundedReachability object is keyed by the
+original (environment) vertex labels and only re-runs the BFS of vertices whose
+ball of radius max_dist is touched by an arrival or a departure.
+"""
+
+from collections import deque
+
+INFINITY = 999999999
+
+
+class BoundedReachability:
+    """Shortest-path lengths up to max_dist between vertices of a changing pool.
+
+    Data members:
+        max_dist: paths longer than this are not recorded
+        dist_from: dist_from[u][v] is the length of the shortest path from u to v,
+            for each v reachable from u in at most max_dist steps
+        dist_to: the transpose of dist_from, i.e. dist_to[v][u] == dist_from[u][v]
+        out_adj, in_adj: adjacency sets restricted to vertices in the pool
+    """
+
+    def __init__(self, max_dist):
+        self.max_dist = max_dist
+        self.dist_from = {}
+        self.dist_to = {}
+        self.out_adj = {}
+        self.in_adj = {}
+
+    def __contains__(self, v):
+        return v in self.out_adj
+
+    def __len__(self):
+        return len(self.out_adj)
+
+    def update(self, g, vertices):
+        """Make the pool equal to vertices, reading new edges from the graph g.
+
+        Args:
+            g: a networkx DiGraph containing every vertex in the pool
+            vertices: the vertex labels that should be in the pool after the update
+        """
+
+        vertices = set(vertices)
+        departed = [v for v in self.out_adj if v not in vertices]
+        arrived = [v for v in vertices if v not in self.out_adj]
+        self.remove_vertices(departed)
+        self.add_vertices(g, arrived)
+
+    def add_vertices(self, g, vertices):
+        """Add vertices to the pool along with their edges to vertices already in it."""
+
+        vertices = [v for v in vertices if v not in self.out_adj]
+        if not vertices:
+            return
+
+        for v in vertices:
+            self.out_adj[v] = set()
+            self.in_adj[v] = set()
+            self.dist_from[v] = {}
+            self.dist_to[v] = {}
+
+        for v in vertices:
+            for w in g.successors(v):
+                if w in self.out_adj and w != v:
+                    self.out_adj[v].add(w)
+                    self.in_adj[w].add(v)
+            for u in g.predecessors(v):
+                if u in self.out_adj and u != v:
+                    self.out_adj[u].add(v)
+                    self.in_adj[v].add(u)
+
+        # A new shortest path must end with an edge into a new vertex, so only the
+        # sources that reach an in-neighbour of a new vertex are affected
+        affected = set(vertices)
+        for v in vertices:
+            for u in self.in_adj[v]:
+                affected.add(u)
+                affected.update(u_ for u_, d in self.dist_to[u].items() if d < self.max_dist)
+        self._refresh(affected)
+
+    def remove_vertices(self, vertices):
+        """Remove vertices (and all of their edges) from the pool."""
+
+        vertices = [v for v in vertices if v in self.out_adj]
+        if not vertices:
+            return
+
+        # Only sources whose ball contained a departing vertex can see their distances grow
+        affected = set()
+        for v in vertices:
+            affected.update(self.dist_to[v])
+
+        for v in vertices:
+            for w in self.out_adj.pop(v):
+                if w in self.in_adj:
+                    self.in_adj[w].discard(v)
+            for u in self.in_adj.pop(v):
+                if u in self.out_adj:
+                    self.out_adj[u].discard(v)
+            for w in self.dist_from.pop(v):
+                if w in self.dist_to:
+                    self.dist_to[w].pop(v, None)
+            for u in self.dist_to.pop(v):
+                if u in self.dist_from:
+                    self.dist_from[u].pop(v, None)
+
+        self._refresh(affected.difference(vertices))
+
+    def discard(self, v):
+        """Forget a vertex so that its edges are re-read on the next update."""
+
+        self.remove_vertices([v])
+
+    def distance(self, u, v):
+        """Length of the shortest path from u to v, or INFINITY if longer than max_dist."""
+
+        return self.dist_from.get(u, {}).get(v, INFINITY)
+
+    def _refresh(self, sources):
+        for u in sources:
+            for w in self.dist_from[u]:
+                self.dist_to[w].pop(u, None)
+            dists = self._bfs(u)
+            self.dist_from[u] = dists
+            for w, d in dists.items():
+                self.dist_to[w][u] = d
+
+    def _bfs(self, source):
+        dists = {source: 0}
+        q = deque([source])
+        while q:
+            v = q.popleft()
+            if dists[v] >= self.max_dist:
+                break
+            for w in self.out_adj[v]:
+                if w not in dists:
+                    dists[w] = dists[v] + 1
+                    q.append(w)
+        return dists
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ranking of the cycles available at t by a policy network.
+
+The network is evaluated once on the pool of pairs living at t, and every
+candidate cycle (by default, those of an optimal matching at t) is scored by
+the average probability of its pairs. Cycles are kept as an array of positions
+in the pool, padded with -1, so all cycles are scored with a single gather.
+A ranking is built once per period; since the candidates are disjoint, taking
+the best cycles in turn needs no further solves or network evaluations:
+
+    ranking = rank_cycles(net, env, t, evaluate=evaluate_policy)
+    for cycle in ranking.select(thres=.5):
+        env.removed_container[t].update(cycle)
+"""
+
+import numpy as np
+
+from matching.solver.kidney_solver2 import optimal
+
+
+class CycleRanking:
+
+    def __init__(self, living, cycles, probs):
+        self.living = list(living)
+        self.cycles = [tuple(c) for c in cycles]
+        self.index = cycle_index(self.living, self.cycles)
+        self.scores = cycle_scores(probs, self.index)
+        # Best first, ties in candidate order
+        self.order = np.argsort(-self.scores, kind="stable")
+
+    def __len__(self):
+        return len(self.cycles)
+
+    def top(self, k=None, thres=None):
+        """Up to k (cycle, score) pairs, best first, scoring at least thres."""
+        order = self.order if thres is None else \
+            self.order[self.scores[self.order] >= thres]
+        return [(self.cycles[i], self.scores[i]) for i in order[:k]]
+
+    def select(self, thres=0):
+        """Cycles scoring at least thres, best first."""
+        return [c for c, _ in self.top(thres=thres)]
+
+    def best(self, thres=0):
+        """Best cycle if it scores at least thres, else None."""
+        selected = self.top(k=1, thres=thres)
+        return selected[0][0] if selected else None
+
+
+def rank_cycles(net, env, t, evaluate, cycles=None):
+    """Ranks cycles (by default, those matched at t by an optimal solution
+    over [t, t]) by evaluate(net, env, t), the probabilities of the pairs
+    living at t."""
+    living = env.get_living(t)
+    if cycles is None:
+        cycles = optimal(env, t, t)["matched_cycles"][t] if living else []
+    probs = node_probabilities(evaluate(net, env, t)) if cycles else np.zeros(len(living))
+    return CycleRanking(living, cycles, probs)
+
+
+def node_probabilities(output):
+    """Per-node probabilities as a flat array, from either a tensor or the
+    (probs, counts) returned by data_utils.evaluate_policy."""
+    if isinstance(output, tuple):
+        output = output[0]
+    if hasattr(output, "detach"):
+        output = output.detach().numpy()
+    return np.asarray(output, dtype=float).ravel()
+
+
+def cycle_index(living, cycles):
+    """Positions in living of the nodes of each cycle, padded with -1."""
+    width = max([len(c) for c in cycles] + [0])
+    index = np.full((len(cycles), width), -1, dtype=int)
+    if not cycles:
+        return index
+    living = np.asarray(living, dtype=int)
+    lengths = np.array([len(c) for c in cycles])
+    members = np.fromiter((v for c in cycles for v in c), dtype=int, count=lengths.sum())
+    lookup = np.full(max(living.max(initial=-1), members.max(initial=-1)) + 1, -1, dtype=int)
+    lookup[living] = np.arange(len(living))
+    positions = lookup[members]
+    if np.any(positions < 0):
+        raise ValueError("Cycle with pairs not living at t")
+    index[np.arange(width) < lengths[:, np.newaxis]] = positions
+    return index
+
+
+def cycle_scores(probs, index):
+    """Mean probability of the nodes of each cycle."""
+    mask = index >= 0
+    gathered = np.where(mask, np.asarray(probs)[np.where(mask, index, 0)], 0)
+    return gathered.sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
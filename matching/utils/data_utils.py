@@ -18,6 +18,7 @@ import torch.nn.functional as F
 from tqdm import trange
 
 from matching.solver.kidney_solver2 import optimal
+from matching.utils.cycle_ranking import cycle_index, cycle_scores
 
 
 def summary(env, timing):
@@ -139,11 +140,7 @@ def evaluate_policy(net, env, t, dtype="numpy"):
 
 
 def get_cycle_probabilities(living, cycles, probs):
-    liv_idx = {j: i for i, j in enumerate(living)}
-    cycle_probs = np.zeros(len(cycles))
-    for k, cyc in enumerate(cycles):
-        cycle_probs[k] = np.mean([probs[liv_idx[i]] for i in cyc])
-    return cycle_probs
+    return cycle_scores(probs, cycle_index(living, cycles))
 
 
 def softmax(x, T=1):
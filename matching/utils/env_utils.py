@@ -2,6 +2,8 @@ from random import shuffle
 from re import findall
 import numpy as np
 from collections import defaultdict
+
+from matching.utils.profiling import profiled
 #from matching.environment.optn_environment import OPTNKidneyExchange
 
 def get_actions(env, t):
@@ -15,6 +17,9 @@ def get_actions(env, t):
 def two_cycles(env, t, nodes = None):
     if nodes is None and t is not None:
         nodes = list(env.get_living(t))
+    index = getattr(env, "cycle_index", None)
+    if index is not None and index.max_cycle_length >= 2:
+        return index.two_cycles(nodes)
     cycles = []
     for i, u in enumerate(nodes):
         for w in nodes[i:]:
@@ -64,6 +69,7 @@ def get_loss(env, t_begin, t_end, matched):
 
 
     
+@profiled("snapshot")
 def snapshot(env, t):
     
     new_env = env.__class__(entry_rate = env.entry_rate,
@@ -96,6 +102,9 @@ def snapshot(env, t):
             new_env.node[node]["death"] = t + \
                                 np.random.geometric(new_env.death_rate) - 1
         
+    # Copied after the death times are redrawn, since the index caches them
+    if getattr(env, "cycle_index", None) is not None:
+        new_env.cycle_index = env.cycle_index.copy_for(new_env)
     
     return new_env
 
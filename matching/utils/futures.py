@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pools of pre-sampled futures, shared by every action evaluated from the same
+state (common random numbers).
+
+A FuturePool holds K futures of an environment after time t: each is a snapshot
+at t (with fresh death times) populated with arrivals up to t + horizon, or,
+with horizon=None, up to the death of the last pair living at t. They are
+sampled once, from seeds drawn when the pool is created, so evaluating actions
+against the pool is reproducible and every action sees the same arrivals.
+Evaluations may stop before the end of a future (t_end). For each future and
+evaluation window, the cycles and the optimal matching with nothing taken are
+computed once and reused: the "leave" solution of an action is only re-solved
+when that optimal matching used the action's cycle.
+
+Usage:
+
+    pool = FuturePool(env, t, horizon=10, n_futures=8, seed=123)
+    take, leave = pool.compare(k, taken=(3, 7))
+    same = pool.same_rewards(k, taken=(3, 7), t_end=t + 4)
+"""
+
+import numpy as np
+
+from matching.solver.kidney_solver2 import get_cycles, remove_from_cycles, \
+    solve, parse_solution
+from matching.utils.env_utils import snapshot
+
+
+class FuturePool:
+
+    def __init__(self, env, t, horizon, n_futures, seed=None, max_cycle_length=2):
+        self.env = env
+        self.t = t
+        self.horizon = horizon
+        self.n_futures = n_futures
+        self.max_cycle_length = max_cycle_length
+        self.seeds = np.random.RandomState(seed).randint(2**31, size=n_futures)
+        self.futures = [None] * n_futures
+        self.ends = [None] * n_futures  # Last period populated in each future
+        self._cycles = {}  # (k, t_begin, t_end) -> (weights, cycles)
+        self._full = {}    # (k, t_begin, t_end) -> solution with nothing taken
+
+    def __len__(self):
+        return self.n_futures
+
+    def future(self, k):
+        """k-th future, populated between t + 1 and its end."""
+        if self.futures[k] is None:
+            # Snapshot draws death times from the global state
+            np.random.seed(self.seeds[k])
+            snap = snapshot(self.env, self.t)
+            if self.horizon is None:
+                end = max([self.t] + list(death_times(snap, snap.nodes()))) + 1
+            else:
+                end = self.t + self.horizon
+            snap.populate(self.t + 1, end, seed=self.seeds[k])
+            self.futures[k] = snap
+            self.ends[k] = end
+        return self.futures[k]
+
+    def end(self, k):
+        self.future(k)
+        return self.ends[k]
+
+    def cycles(self, k, t_end=None, t_begin=None):
+        """Cycles of pairs living between t_begin (default: t + 1) and t_end
+        in the k-th future."""
+        key = self._window(k, t_begin, t_end)
+        if key not in self._cycles:
+            fut = self.future(k)
+            nodes = set(fut.get_living(key[1], key[2]))
+            self._cycles[key] = get_cycles(fut, nodes, self.max_cycle_length)
+        return self._cycles[key]
+
+    def full_solution(self, k, t_end=None, t_begin=None):
+        """Optimal matching of the k-th future between t_begin and t_end
+        with nothing taken."""
+        key = self._window(k, t_begin, t_end)
+        if key not in self._full:
+            ws, cs = self.cycles(k, key[2], key[1])
+            self._full[key] = parse_solution(self.future(k), cs, solve(ws, cs), key[1])
+        return self._full[key]
+
+    def compare(self, k, taken, t_end=None, t_begin=None):
+        """Same as kidney_solver2.compare_optimal(future, t_begin, t_end, taken,
+        full=True), for the k-th future (t_begin defaults to t + 1)."""
+        _, t_begin, t_end = self._window(k, t_begin, t_end)
+        fut = self.future(k)
+        perturb = set(taken)
+        ws_full, cs_full = self.cycles(k, t_end, t_begin)
+
+        full = self.full_solution(k, t_end, t_begin)
+        if uses(full, perturb):
+            i = cs_full.index(perturb)
+            ws_leave = ws_full[:i] + ws_full[i + 1:]
+            cs_leave = cs_full[:i] + cs_full[i + 1:]
+            sol_leave = parse_solution(fut, cs_leave, solve(ws_leave, cs_leave), t_begin)
+        else:
+            # Removing an unused cycle leaves the optimum unchanged
+            sol_leave = full
+
+        ws_take, cs_take = remove_from_cycles(ws_full, cs_full, perturb)
+        sol_take = parse_solution(fut, cs_take, solve(ws_take, cs_take), t_begin)
+        sol_take["obj"] += len(perturb)
+        sol_take["matched"][t_begin].update(perturb)
+        sol_take["matched_cycles"][t_begin].append(perturb)
+
+        return sol_take, sol_leave
+
+    def same_rewards(self, k, taken, t_end=None):
+        """Same as kidney_solver2.same_rewards(future, t, t_end, taken), for
+        the k-th future: whether taking the cycle now keeps the optimum."""
+        _, t_begin, t_end = self._window(k, self.t, t_end)
+        perturb = set(taken)
+        ws_full, cs_full = self.cycles(k, t_end, t_begin)
+
+        full = self.full_solution(k, t_end, t_begin)
+        if uses(full, perturb):
+            # An optimal matching already takes the cycle
+            return True
+
+        ws_take, cs_take = remove_from_cycles(ws_full, cs_full, perturb)
+        take = parse_solution(self.future(k), cs_take, solve(ws_take, cs_take), t_begin)
+        return take["obj"] + len(perturb) == full["obj"]
+
+    def _window(self, k, t_begin, t_end):
+        if t_begin is None:
+            t_begin = self.t + 1
+        if t_end is None:
+            return k, t_begin, self.end(k)
+        if t_end > self.end(k):
+            raise ValueError("Future {} only goes up to {}".format(k, self.end(k)))
+        return k, t_begin, t_end
+
+
+def death_times(env, nodes):
+    try:
+        return env.data.loc[list(nodes), "death"].tolist()
+    except AttributeError:
+        return [env.nodes[n]["death"] for n in nodes]
+
+
+def uses(solution, cycle):
+    return any(cycle == set(c) for cs in solution["matched_cycles"].values() for c in cs)
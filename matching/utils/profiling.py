@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt-in timers and counters for the hot paths of the environment, solvers,
+bandits and MCTS.
+
+Instrumented code calls timer(name) or is decorated with profiled(name); while
+no Profiler is active these only check a module global, so their cost is one
+function call. Inside a Profiler, every timed call is recorded under its stack
+of enclosing timers, e.g. ("bandit.simulate", "same_rewards", "solve.optimize"):
+
+    with Profiler() as prof:
+        algo.simulate()
+    prof.report()                                # Totals by stack and by name
+    prof.to_json("results/profile.json")
+    prof.to_collapsed("results/profile.folded")  # flamegraph.pl, speedscope
+
+Only the process that enters the Profiler is profiled: work sent to worker
+processes shows up as the time spent waiting for it.
+"""
+
+import json
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from time import perf_counter
+
+
+_active = None
+_null = nullcontext()
+
+
+class Profiler:
+
+    def __init__(self):
+        self.calls = defaultdict(int)      # stack -> calls
+        self.seconds = defaultdict(float)  # stack -> inclusive seconds
+        self.counters = Counter()
+        self.stack = ()
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        self._previous, _active = _active, self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self._previous
+        self._previous = None
+        return False
+
+    @contextmanager
+    def timer(self, name):
+        parent = self.stack
+        self.stack = parent + (name,)
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[self.stack] += perf_counter() - t0
+            self.calls[self.stack] += 1
+            self.stack = parent
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def self_seconds(self, stack):
+        """Time in stack not spent in the timers nested in it."""
+        children = sum(s for k, s in self.seconds.items()
+                       if len(k) == len(stack) + 1 and k[:-1] == stack)
+        return max(self.seconds[stack] - children, 0.)
+
+    def report(self):
+        stacks = [{"stack": list(k),
+                   "calls": self.calls[k],
+                   "seconds": self.seconds[k],
+                   "self_seconds": self.self_seconds(k)}
+                  for k in sorted(self.seconds)]
+        names = defaultdict(lambda: {"calls": 0, "seconds": 0., "self_seconds": 0.})
+        for s in stacks:
+            total = names[s["stack"][-1]]
+            total["calls"] += s["calls"]
+            total["self_seconds"] += s["self_seconds"]
+            # Recursive calls are already included in the outermost one
+            if s["stack"][-1] not in s["stack"][:-1]:
+                total["seconds"] += s["seconds"]
+        return {"stacks": stacks,
+                "names": dict(sorted(names.items(), key=lambda kv: -kv[1]["seconds"])),
+                "counters": dict(self.counters)}
+
+    def to_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def to_collapsed(self, path):
+        """One line per stack with its self time in microseconds, the input
+        format of flamegraph.pl and speedscope."""
+        with open(path, "w") as f:
+            for k in sorted(self.seconds):
+                us = int(round(1e6 * self.self_seconds(k)))
+                if us > 0:
+                    print("{} {}".format(";".join(k), us), file=f)
+
+
+def active():
+    return _active
+
+
+def timer(name):
+    """Times the enclosed block if a Profiler is active."""
+    if _active is None:
+        return _null
+    return _active.timer(name)
+
+
+def count(name, n=1):
+    if _active is not None:
+        _active.count(name, n)
+
+
+def profiled(name=None):
+    """Decorator timing every call of a function under name (by default, its
+    qualified name) if a Profiler is active."""
+    def decorator(fn):
+        label = name or fn.__qualname__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return fn(*args, **kwargs)
+            with _active.timer(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
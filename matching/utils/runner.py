@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local experiment runner.
+
+Runs a function over a grid of parameters in a pool of worker processes, with a
+limit on how many run at once and an optional per-job timeout. Every finished
+job is recorded in a SQLite file, and jobs already recorded there are skipped,
+so an interrupted sweep resumes where it stopped when it is started again.
+
+Usage:
+
+    from matching.utils.runner import param_grid, ResultStore, run_experiment
+
+    grid = param_grid(environment=["ABO", "RSU"], entry_rate=[3, 5], seed=range(10))
+    store = ResultStore("results/results.db")
+    run_experiment("comparison", run, grid, store, n_jobs=32, timeout=3600)
+    df = store.to_frame("comparison")
+
+The job function must be defined at module level (so that it can be sent to a
+worker process) and return something JSON serializable. Returning a list of
+dicts stores one row per dict, which is how per-period logs are kept.
+"""
+
+import json
+import os
+import signal
+import sqlite3
+import traceback
+from itertools import product
+from multiprocessing import Pipe, Process, cpu_count
+from multiprocessing.connection import wait
+from time import time, strftime
+
+import numpy as np
+import pandas as pd
+
+
+def param_grid(**axes):
+    """Cartesian product of the given lists of values, as a list of dicts."""
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in product(*[list(axes[n]) for n in names])]
+
+
+def job_key(params):
+    return json.dumps(params, sort_keys=True, default=_to_builtin)
+
+
+def _to_builtin(x):
+    if isinstance(x, np.generic):
+        return x.item()
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    raise TypeError("Cannot serialize {}".format(type(x)))
+
+
+class ResultStore:
+    """SQLite file holding one row per finished job.
+
+    Only the parent process records jobs. Subclasses whose jobs also write
+    to the file (see bandits/results.py) rely on SQLite's locking, each
+    connection waiting up to a minute for the others.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with self.connect() as con:
+            con.execute("""CREATE TABLE IF NOT EXISTS runs (
+                               experiment TEXT NOT NULL,
+                               key TEXT NOT NULL,
+                               params TEXT NOT NULL,
+                               status TEXT NOT NULL,
+                               result TEXT,
+                               seconds REAL,
+                               finished TEXT,
+                               PRIMARY KEY (experiment, key))""")
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def finished(self, experiment, statuses=("ok",)):
+        """Keys of the jobs of experiment that ended with one of statuses."""
+        marks = ",".join("?" * len(statuses))
+        with self.connect() as con:
+            rows = con.execute("SELECT key FROM runs WHERE experiment = ? AND status IN ({})"
+                               .format(marks), (experiment, *statuses))
+            return set(r[0] for r in rows)
+
+    def record(self, experiment, params, status, result=None, seconds=None):
+        encoded = json.dumps(result, default=_to_builtin)
+        with self.connect() as con:
+            con.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (experiment,
+                         job_key(params),
+                         json.dumps(params, default=_to_builtin),
+                         status,
+                         encoded,
+                         seconds,
+                         strftime("%Y-%m-%d %H:%M:%S")))
+            self.on_record(con, experiment, params, status, json.loads(encoded))
+
+    def on_record(self, con, experiment, params, status, result):
+        """Called in the same transaction as each record, with the result as
+        stored (plain JSON types), so that subclasses can keep derived tables
+        up to date."""
+        pass
+
+    def to_frame(self, experiment, status="ok"):
+        """Parameters and results of an experiment as a DataFrame, one row per
+        job or, for jobs that returned a list of dicts, one row per dict."""
+        with self.connect() as con:
+            rows = con.execute("SELECT params, result, seconds FROM runs "
+                               "WHERE experiment = ? AND status = ?", (experiment, status))
+            records = []
+            for params, result, seconds in rows:
+                params = json.loads(params)
+                result = json.loads(result)
+                if not isinstance(result, list):
+                    result = [result]
+                for r in result:
+                    rec = dict(params, seconds=seconds)
+                    if isinstance(r, dict):
+                        rec.update(r)
+                    else:
+                        rec["result"] = r
+                    records.append(rec)
+        return pd.DataFrame(records)
+
+
+_current_job = None
+
+
+def current_job():
+    """Parameters of the job running in this process, when called from a job
+    function started by run_experiment (None otherwise)."""
+    return _current_job
+
+
+def _work(fn, params, conn):
+    global _current_job
+    _current_job = params
+    if hasattr(os, "setpgrp"):
+        # Own process group, so that a timeout also stops the worker pools
+        # the job starts (see _kill)
+        os.setpgrp()
+    try:
+        conn.send(("ok", fn(**params)))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def run_experiment(experiment, fn, grid, store,
+                   n_jobs=None,
+                   timeout=None,
+                   retry_failed=False,
+                   verbose=True):
+    """Run fn(**params) for each params in grid that is not already in store.
+
+    Args:
+        experiment: name under which results are stored
+        fn: module-level job function
+        grid: list of parameter dicts, e.g. from param_grid
+        store: a ResultStore
+        n_jobs: maximum number of jobs running at once (default: number of cpus)
+        timeout: seconds after which a job is killed and recorded as "timeout"
+        retry_failed: also rerun jobs recorded as "error" or "timeout"
+
+    Returns:
+        the number of jobs that ended with each status
+    """
+    if n_jobs is None:
+        n_jobs = cpu_count()
+
+    done = store.finished(experiment,
+                          ("ok",) if retry_failed else ("ok", "error", "timeout"))
+    pending = [p for p in grid if job_key(p) not in done]
+    counts = {"ok": 0, "error": 0, "timeout": 0, "skipped": len(grid) - len(pending)}
+
+    if verbose:
+        print("{}: {} jobs, {} already done".format(experiment, len(grid), counts["skipped"]))
+
+    running = {}  # reader -> (process, params, start time)
+    pending.reverse()
+    try:
+        while pending or running:
+            while pending and len(running) < n_jobs:
+                params = pending.pop()
+                reader, writer = Pipe(duplex=False)
+                # Not daemonic, so that jobs can start their own worker pools
+                proc = Process(target=_work, args=(fn, params, writer))
+                proc.start()
+                writer.close()
+                running[reader] = (proc, params, time())
+
+            if timeout is None:
+                wait_for = None
+            else:
+                now = time()
+                wait_for = max(0, min(start + timeout - now for _, _, start in running.values()))
+
+            ready = wait(list(running), timeout=wait_for)
+
+            for reader in ready:
+                proc, params, start = running.pop(reader)
+                try:
+                    status, result = reader.recv()
+                except EOFError:
+                    status, result = "error", "Worker exited with code {}".format(proc.exitcode)
+                reader.close()
+                proc.join()
+                _finish(store, experiment, params, status, result, time() - start, counts, verbose)
+
+            if timeout is not None:
+                now = time()
+                for reader in [r for r, (_, _, start) in running.items() if now - start >= timeout]:
+                    proc, params, start = running.pop(reader)
+                    _kill(proc)
+                    reader.close()
+                    _finish(store, experiment, params, "timeout", None, now - start,
+                            counts, verbose)
+    finally:
+        # Jobs are not in our process group and so miss a Ctrl-C at the
+        # terminal: stop the ones still running if we are interrupted
+        for proc, _, _ in running.values():
+            _kill(proc)
+
+    return counts
+
+
+def _kill(proc):
+    """Terminate a job together with any processes it started."""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        # No process groups here, or the job has not made its own yet
+        proc.terminate()
+    proc.join()
+
+
+def _finish(store, experiment, params, status, result, seconds, counts, verbose):
+    store.record(experiment, params, status, result, seconds)
+    counts[status] += 1
+    if verbose:
+        print("[{}] {} {} in {:.2f} seconds".format(status, experiment, job_key(params), seconds))
+        if status == "error":
+            print(result)
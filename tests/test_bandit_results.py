@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+from matching.bandits.results import BanditResultStore
+from matching.bandits.run_bandits import run
+from matching.utils.runner import current_job, job_key, param_grid, run_experiment
+
+
+def fake_run(environment, algorithm, entry_rate, death_rate, seed, max_time):
+    return [{"algorithm": algorithm,
+             "param": np.nan if algorithm == "Thompson" else .1,
+             "ipa": 20,
+             "thres": .5,
+             "environment": "{}({},{})".format(environment, entry_rate, death_rate),
+             "t": t,
+             "entry_rate": int(entry_rate),
+             "death_rate": int(death_rate * 100),
+             "reward": np.float64(t % 3),
+             "greedy": np.int64(1),
+             "optimal": 2}
+            for t in range(1, max_time)]
+
+
+@pytest.fixture
+def store(tmpdir):
+    return BanditResultStore(str(tmpdir.join("results.db")))
+
+
+def test_aggregates_follow_appends(store):
+    grid = param_grid(environment=["ABO"], algorithm=["UCB1", "Thompson"],
+                      entry_rate=[3], death_rate=[.1], seed=range(2), max_time=[7])
+    for params in grid:
+        store.record("bandits", params, "ok", fake_run(**params))
+    # Only the bandits experiment is streamed
+    store.record("other", grid[0], "ok", fake_run(**grid[0]))
+
+    runs = store.run_means()
+    assert len(runs) == 4
+    assert np.all(runs.n_periods == 6)
+    assert np.allclose(runs.reward, 1)
+    assert set(runs.param.isnull()) == {True, False}
+
+    # Same numbers from the periods, and a window
+    windowed = store.run_means(t_min=0, t_max=10)
+    assert np.allclose(windowed.reward, 1)
+    assert np.allclose(store.run_means(t_max=2).reward, 1.5)
+
+    # A rerun replaces the previous periods
+    store.record("bandits", grid[0], "ok", fake_run(**dict(grid[0], max_time=4)))
+    runs = store.run_means(where="algorithm = 'UCB1' AND seed = 0")
+    assert list(runs.n_periods) == [3]
+    assert store.query("SELECT COUNT(*) AS n FROM bandit_periods").n[0] == 21
+
+
+def test_missing(store):
+    grid = param_grid(environment=["ABO"], algorithm=["UCB1"],
+                      entry_rate=[3, 5], death_rate=[.1], seed=range(2), max_time=[5])
+    for params in grid:
+        if params["entry_rate"] == 5 and params["seed"] == 1:
+            store.record("bandits", params, "error", "Traceback")
+        else:
+            store.record("bandits", params, "ok", fake_run(**params))
+
+    assert store.missing(["ABO"], ["UCB1"], [3, 5], [10], n_seeds=2) == \
+        [("ABO", "UCB1", 5, 10)]
+    assert store.missing(["ABO"], ["UCB1"], [3, 5], [10], n_seeds=1, min_max_t=10) == \
+        [("ABO", "UCB1", 3, 10), ("ABO", "UCB1", 5, 10)]
+
+
+def test_runner_and_rebuild(tmpdir):
+    path = str(tmpdir.join("results.db"))
+    store = BanditResultStore(path)
+    grid = param_grid(environment=["ABO"], algorithm=["EXP3"],
+                      entry_rate=[3], death_rate=[.1], seed=range(2), max_time=[4])
+    run_experiment("bandits", fake_run, grid, store, n_jobs=2, verbose=False)
+    assert len(store.run_means()) == 2
+
+    with store.connect() as con:
+        con.execute("DELETE FROM bandit_periods")
+        con.execute("DELETE FROM bandit_runs")
+    store.rebuild()
+    assert store.query("SELECT SUM(n_periods) AS n FROM bandit_runs").n[0] == 6
+
+
+def test_import_text(store, tmpdir):
+    path = tmpdir.join("bandit_results.txt")
+    path.write('UCB1,0.1,0.5,"ABO(5,.1,1)",0,1,5,10,1,1,2\n'
+               'UCB1,0.1,0.5,"ABO(5,.1,1)",0,2,5,10,0,1,2\n'
+               'Thompson,,0.5,,1,1,5,10,1,1,2\n')
+    store.import_text(str(path))
+    runs = store.run_means().sort_values("algorithm")
+    assert list(runs.algorithm) == ["Thompson", "UCB1"]
+    assert list(runs.n_periods) == [1, 2]
+    assert list(runs.env) == ["ABO", "ABO"]
+
+
+def test_import_text_with_ipa(store, tmpdir):
+    path = tmpdir.join("bandit_results5.txt")
+    path.write('UCB1,0.1,20,0.5,"ABO(5,.1,1)",0,1,5,10,1,1,2\n'
+               'Thompson,nan,20,0.5,"ABO(5,.1,1)",1,1,5,10,0,3,4\n')
+    store.import_text(str(path))
+    runs = store.run_means().sort_values("algorithm")
+    assert list(runs.algorithm) == ["Thompson", "UCB1"]
+    assert list(runs.ipa) == [20, 20]
+    assert list(runs.thres) == [.5, .5]
+    assert list(runs.greedy) == [3, 1]
+    assert list(runs.optimal) == [4, 2]
+
+
+def test_import_text_rejects_other_formats(store, tmpdir):
+    path = tmpdir.join("bandit_results.txt")
+    path.write("UCB1,0.1,0.5\n")
+    with pytest.raises(ValueError):
+        store.import_text(str(path))
+
+
+def test_failed_runs_keep_streamed_periods(store):
+    params = dict(environment="ABO", algorithm="UCB1", entry_rate=3, death_rate=.1,
+                  seed=0, max_time=700)
+    key = job_key(params)
+    store.start_run(key)
+    for period in fake_run(**dict(params, max_time=5)):
+        store.add_periods(key, [dict(period, env="ABO", seed=0)])
+    store.record("bandits", params, "timeout")
+
+    runs = store.run_means()
+    assert list(runs.n_periods) == [4]
+    assert store.missing(["ABO"], ["UCB1"], [3], [10], min_max_t=4) == []
+    assert store.missing(["ABO"], ["UCB1"], [3], [10], min_max_t=699) == \
+        [("ABO", "UCB1", 3, 10)]
+
+
+def test_run_streams_periods(store):
+    assert current_job() is None
+    log = run("ABO", "Thompson", 3, .1, seed=1, max_time=5, ipa=2, store=store.path)
+    runs = store.run_means()
+    assert list(runs.n_periods) == [len(log)]
+    assert store.completed(min_max_t=log[-1]["t"]).n_seeds.tolist() == [1]
+    assert runs.reward[0] == pytest.approx(np.mean([p["reward"] for p in log]))
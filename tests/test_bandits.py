@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from matching.bandits.core import Bandit
+from matching.bandits.exp3 import EXP3
+from matching.bandits.halving import SequentialHalving, halving_schedule
+from matching.bandits.thompson import Thompson
+from matching.bandits.ucb1 import UCB1
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.utils.futures import death_times
+
+
+@pytest.fixture
+def env():
+    return ABOKidneyExchange(entry_rate=3, death_rate=.1, time_length=10, seed=1)
+
+
+def first_t_with_arms(env):
+    return next(t for t in range(env.time_length) if len(Bandit(env, t).arms) > 1)
+
+
+@pytest.mark.parametrize("policy", [UCB1, Thompson, EXP3])
+def test_batched_pulls(env, policy):
+    t = first_t_with_arms(env)
+    np.random.seed(0)
+    algo = policy(env, t, iters_per_arm=4, batch_size=3)
+    algo.simulate()
+    assert algo.n.sum() == 4 * algo.n_arms
+    assert np.all((algo.r >= 0) & (algo.r <= 1))
+    res = algo.choose()
+    assert res is None or res in algo.arms
+
+
+def test_update_matches_sequential(env):
+    t = first_t_with_arms(env)
+    arms = np.array([0, 1, 0, 0])
+    x = np.array([1., 0., 0., 1.])
+
+    batched = Thompson(env, t)
+    batched.update(arms, x)
+
+    sequential = Thompson(env, t)
+    for a, xa in zip(arms, x):
+        sequential.update(np.array([a]), np.array([xa]))
+
+    assert np.allclose(batched.r, sequential.r)
+    assert np.allclose(batched.n, sequential.n)
+    assert np.allclose(batched.s, sequential.s)
+    assert np.allclose(batched.f, sequential.f)
+
+
+def test_ucb_batch_spreads(env):
+    t = first_t_with_arms(env)
+    algo = UCB1(env, t)
+    algo.n[:] = 1
+    arms = algo.draw_arms(algo.n_arms)
+    # Arms with the same stats score the same, and a pending pull lowers its arm
+    assert sorted(arms) == list(range(algo.n_arms))
+
+
+def test_workers_reproducible(env):
+    t = first_t_with_arms(env)
+    rewards, after = [], []
+    for n_workers in (1, 2):
+        np.random.seed(0)
+        algo = UCB1(env, t, iters_per_arm=2, batch_size=4, n_workers=n_workers)
+        algo.simulate()
+        rewards.append(algo.r)
+        after.append(np.random.randint(2**31))
+    assert np.allclose(rewards[0], rewards[1])
+    # Serial pulls do not reseed the caller's random state
+    assert after[0] == after[1]
+
+
+def test_shared_futures(env):
+    t = first_t_with_arms(env)
+    rewards = []
+    for _ in range(2):
+        np.random.seed(0)
+        algo = Thompson(env, t, iters_per_arm=4, batch_size=2, n_futures=2)
+        algo.simulate()
+        rewards.append(algo.r)
+    assert np.allclose(rewards[0], rewards[1])
+    # Two futures for four pulls: every arm sees each future twice
+    assert np.all(np.isin(algo.r, [0, .5, 1]))
+    with pytest.raises(ValueError):
+        UCB1(env, t, n_futures=2, n_workers=2)
+
+
+@pytest.mark.parametrize("make", [
+    lambda env, t: Thompson(env, t, iters_per_arm=2, n_futures=2),
+    lambda env, t: SequentialHalving(env, t, iters_per_arm=2)])
+def test_shared_window_matches_arm_reward(env, monkeypatch, make):
+    t = first_t_with_arms(env)
+    np.random.seed(0)
+    algo = make(env, t)
+    windows = []
+    same_rewards = algo.futures.same_rewards
+    monkeypatch.setattr(algo.futures, "same_rewards",
+                        lambda k, cycle, t_end: windows.append((k, cycle, t_end))
+                        or same_rewards(k, cycle, t_end))
+    algo.simulate()
+    for k, cycle, t_end in windows:
+        fut = algo.futures.future(k)
+        # arm_reward populates its future up to, not including, h + 1
+        assert t_end == max(death_times(fut, cycle))
+
+
+def test_halving_schedule():
+    assert halving_schedule(0, 100) == []
+    assert halving_schedule(1, 100) == [100]
+    # 5 -> 3 -> 2 -> 1 arms, never over budget
+    schedule = halving_schedule(5, 60)
+    assert schedule == [4, 6, 10]
+    assert sum(p * n for p, n in zip(schedule, [5, 3, 2])) <= 60
+
+
+def test_halving_eliminates(env):
+    t = first_t_with_arms(env)
+    np.random.seed(0)
+    algo = SequentialHalving(env, t, iters_per_arm=4)
+    algo.simulate()
+    assert len(algo.best_arms()) == 1
+    # Survivors of later rounds were pulled more
+    best = algo.best_arms()[0]
+    assert algo.n[best] == sum(algo.schedule) == algo.n.max()
+    assert algo.n.sum() <= 4 * algo.n_arms
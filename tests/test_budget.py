@@ -0,0 +1,116 @@
+import pytest
+import random
+import numpy as np
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.tree_search import engine, mcts
+from matching.tree_search.budget import Budget, separated
+from matching.utils.env_utils import get_actions
+
+
+@pytest.fixture
+def env():
+    return ABOKidneyExchange(entry_rate=3, death_rate=.01, time_length=10, seed=1)
+
+
+class OneGoodAction(engine.Strategy):
+    """One action per period, with rollouts worth 1 for the first action and
+    0 for the others."""
+
+    def actions(self, env, t):
+        return sorted(engine.Strategy.actions(self, env, t), key=str)
+
+    def child_actions(self, actions, taken):
+        return []
+
+    def rollout(self, env, t_begin, t_end, taken, gamma, seed=None):
+        return float(taken == self.actions(env, t_begin)[0])
+
+    def advance_value(self):
+        return 0
+
+
+def test_separated():
+    assert separated([10, 10], [9, 1], [9, 1], z=2)
+    assert separated([100, 1], [100, 0], [100, 0], z=2, min_visits=1)
+    assert not separated([3, 1], [3, 0], [3, 0], z=2, min_visits=1)
+    assert not separated([10, 10], [6, 5], [6, 5], z=2)
+    assert not separated([10, 2], [9, 0], [9, 0], z=2, min_visits=5)
+    assert not separated([10], [9], [9], z=2)
+
+
+def test_rollout_limit(env):
+    random.seed(0)
+    budget = Budget(max_rollouts=7)
+    tree = engine.grow(env, 5, engine.Strategy(), n_iters=None, seed=0, budget=budget,
+                       scalar=1, tree_horizon=1, rollout_horizon=2, n_rollouts=1)
+    assert budget.stopped == "rollouts"
+    assert budget.rollouts == 7
+    # Advancing a period runs no rollout, so it is not charged
+    assert tree.visits[0] == budget.iterations >= 7
+
+
+class AdvanceOnly(OneGoodAction):
+
+    def actions(self, env, t):
+        return [None]
+
+
+def test_iterations_without_rollouts_end(env):
+    budget = Budget(max_rollouts=5)
+    tree = engine.grow(env, 5, AdvanceOnly(), n_iters=None, seed=0, budget=budget,
+                       scalar=1, tree_horizon=1, rollout_horizon=2, n_rollouts=1)
+    assert budget.stopped == "iterations"
+    assert budget.rollouts == 0
+    assert tree.visits[0] == 50
+
+
+def test_time_limit(env):
+    random.seed(0)
+    budget = Budget(max_ms=50)
+    engine.grow(env, 5, engine.Strategy(), n_iters=None, seed=0, budget=budget,
+                scalar=1, tree_horizon=1, rollout_horizon=2, n_rollouts=1)
+    assert budget.stopped in ("time", "separated")
+
+
+def test_early_stopping(env):
+    random.seed(0)
+    strategy = OneGoodAction()
+    n_act = len(strategy.actions(env, 5))
+    budget = Budget(max_rollouts=1000, min_visits=1)
+    tree = engine.grow(env, 5, strategy, n_iters=None, seed=0, budget=budget,
+                       scalar=1, tree_horizon=1, rollout_horizon=2, n_rollouts=1)
+    assert budget.stopped == "separated"
+    assert tree.visits[0] < 1000
+    assert engine.choose(engine.root_stats(tree)) == strategy.actions(env, 5)[0]
+    assert n_act > 1
+
+
+def test_mcts_budget(env):
+    np.random.seed(0)
+    random.seed(0)
+    budget = Budget(max_rollouts=6)
+    a = mcts.mcts(env, 5, tree_horizon=1, rollout_horizon=2, budget=budget)
+    assert budget.stopped in ("rollouts", "separated")
+    assert budget.rollouts <= 6
+    assert budget.max_rollouts == 6
+    assert a in get_actions(env, 5)
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_engine_budget_outcome(env, n_workers):
+    random.seed(0)
+    budget = Budget(max_rollouts=8)
+    engine.mcts(env, 5, tree_horizon=1, rollout_horizon=2, seed=0, n_workers=n_workers,
+                budget=budget)
+    assert budget.stopped in ("rollouts", "separated")
+    assert 0 < budget.rollouts <= 8
+
+
+def test_mcts_root_parallel_budget_outcome(env):
+    np.random.seed(0)
+    random.seed(0)
+    budget = Budget(max_rollouts=8)
+    mcts.mcts(env, 5, tree_horizon=1, rollout_horizon=2, n_workers=2, parallel="root",
+              budget=budget)
+    assert budget.stopped in ("rollouts", "separated")
+    assert 0 < budget.rollouts <= 8
@@ -0,0 +1,83 @@
+from itertools import combinations
+
+import numpy as np
+from scipy import sparse
+
+from matching.bandits.combinatorial import CombinatorialBandit, exact_outer_product, \
+    get_arm_matrix, get_arm_vertices, get_cycle_combos, pseudo_loss
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.utils.env_utils import two_cycles
+
+
+def brute_force_combos(cycles, max_match):
+    combos = [[i] for i in range(len(cycles))]
+    nonempty = [i for i, c in enumerate(cycles) if c]
+    for k in range(2, max_match + 1):
+        for combo in combinations(nonempty, k):
+            vertices = [v for i in combo for v in cycles[i]]
+            if len(vertices) == len(set(vertices)):
+                combos.append(list(combo))
+    return combos
+
+
+def test_cycle_combos():
+    rng = np.random.RandomState(0)
+    cycles = sorted({tuple(sorted(rng.choice(14, 2, replace=False))) for _ in range(20)})
+    cycles += [(0, 3, 5), ()]
+    for max_match in (1, 3, 7):
+        assert get_cycle_combos(cycles, max_match) == brute_force_combos(cycles, max_match)
+
+
+def test_cycle_combos_cap():
+    cycles = [(2 * i, 2 * i + 1) for i in range(8)] + [()]
+    n_all = len(get_cycle_combos(cycles, 8))
+    assert n_all == 2 ** 8
+
+    capped = get_cycle_combos(cycles, 8, max_combos=10)
+    assert capped[:len(cycles)] == [[i] for i in range(len(cycles))]
+    assert len(capped) == len(cycles) + 10
+    assert all(len(c) == 2 for c in capped[len(cycles):])
+
+    sampled = get_cycle_combos(cycles, 8, max_combos=10, sample=True, seed=0)
+    assert len(sampled) == len(cycles) + 10
+    assert len(set(map(tuple, sampled))) == len(sampled)
+    assert max(len(c) for c in sampled) > 2
+
+    V = get_arm_matrix(cycles, 8, max_combos=10, sample=True, seed=0)
+    assert [V.indices[V.indptr[a]:V.indptr[a + 1]].tolist() for a in range(V.shape[0])] == sampled
+
+
+def test_outer_product_and_pseudo_loss():
+    cycles = [(0, 1), (2, 3), (1, 4), (5, 6), ()]
+    V = get_arm_matrix(cycles, 3)
+    assert V.nnz == sum(len(c) for c in get_cycle_combos(cycles, 3))
+    dense = V.toarray()
+    rng = np.random.RandomState(0)
+    p = rng.dirichlet(np.ones(len(dense)))
+    v = dense[3]
+
+    EVV = sum(p[i] * np.outer(dense[i], dense[i]) for i in range(len(dense)))
+    for arms in (V, dense):
+        assert np.allclose(exact_outer_product(arms, p), EVV)
+        assert np.allclose(pseudo_loss(arms, p, v, -.5), -.5 * np.linalg.inv(EVV) @ v)
+
+
+def test_arm_vertices():
+    cycles = [(0, 1), (2, 3), (1, 4), (5, 6, 7), ()]
+    combos = get_cycle_combos(cycles, 3)
+    vertices, offsets = get_arm_vertices(cycles, get_arm_matrix(cycles, 3))
+    for a, combo in enumerate(combos):
+        expected = [v for i in combo for v in cycles[i]]
+        assert vertices[offsets[a]:offsets[a + 1]].tolist() == expected
+
+
+def test_bandit_runs_on_sparse_arms():
+    env = ABOKidneyExchange(entry_rate=3, death_rate=.1, time_length=10, seed=1)
+    t = next(t for t in range(env.time_length) if len(two_cycles(env, t)) > 1)
+    np.random.seed(0)
+    algo = CombinatorialBandit(env, t, iters_per_arm=1, max_match=2)
+    assert sparse.isspmatrix_csr(algo.arms)
+    algo.simulate()
+    assert np.isclose(algo.q.sum(), 1)
+    best = algo.choose()
+    assert len(best) == len(set(best))
@@ -0,0 +1,49 @@
+import pytest
+import random
+import numpy as np
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.tree_search.compact_tree import CompactTree
+from matching.tree_search.engine import Strategy, run
+
+
+@pytest.fixture
+def env():
+    return ABOKidneyExchange(entry_rate=3, death_rate=.01, time_length=10, seed=1)
+
+
+@pytest.fixture
+def tree(env):
+    np.random.seed(0)
+    random.seed(0)
+    tree = CompactTree(env, 5, Strategy(), seed=0, cache_size=2)
+    for _ in range(40):
+        run(tree, scalar=1, tree_horizon=2, rollout_horizon=2, n_rollouts=1)
+    return tree
+
+
+def test_statistics(tree):
+    assert tree.visits[0] == 40
+    kids = tree.children(0)
+    assert tree.visits[kids].sum() == 40
+    assert np.all(tree.parent[kids] == 0)
+    assert tree.nbytes / len(tree.parent) < 64
+
+
+def test_envs_are_rebuilt_identically(tree):
+    deep = [v for v in range(len(tree)) if tree.t[v] == 6 and tree.visits[v] > 0]
+    assert deep
+    for v in deep:
+        env = tree.env(v)
+        tree.cache.clear()
+        again = tree.env(v)
+        assert sorted(env.nodes()) == sorted(again.nodes())
+        assert sorted(env.edges()) == sorted(again.edges())
+        assert env.removed(tree.t[v]) == again.removed(tree.t[v])
+
+
+def test_stay_removes_taken(tree):
+    for v in tree.children(0):
+        a = tree.get_action(v)
+        if a is not None:
+            assert set(a) <= tree.env(v).removed(5)
+
@@ -0,0 +1,118 @@
+import pytest
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.solver.kidney_solver2 import get_cycles, get_chains
+from matching.utils.env_utils import snapshot, two_cycles
+
+
+@pytest.fixture
+def env():
+    env = ABOKidneyExchange(entry_rate=5, death_rate=.1, time_length=30,
+                            fraction_ndd=.1, seed=12345, populate=False)
+    env.attach_cycle_index(max_cycle_length=3, max_chain_length=2)
+    env.populate(seed=12345)
+    return env
+
+
+def brute_force_cycles(env, nodes, max_cycle_length):
+    nodes = set(env.nodes() if nodes is None else nodes)
+    cycles = []
+    for u, v in env.subgraph(nodes).edges():
+        if u < v and env.has_edge(v, u):
+            cycles.append([u, v])
+        if max_cycle_length >= 3:
+            for w in env.successors(v):
+                if w in nodes and u < v and u < w and env.has_edge(w, u):
+                    cycles.append([u, v, w])
+    return cycles
+
+
+def enumerate_plain(env, nodes, max_cycle_length=3, max_chain_length=2):
+    index, env.cycle_index = env.cycle_index, None
+    cycles = brute_force_cycles(env, nodes, max_cycle_length)
+    _, chains = get_chains(env, nodes, max_chain_length)
+    env.cycle_index = index
+    return sorted(map(sorted, cycles)), sorted(map(sorted, chains))
+
+
+def enumerate_indexed(env, nodes, max_cycle_length=3, max_chain_length=2):
+    _, cycles = get_cycles(env, nodes, max_cycle_length)
+    _, chains = get_chains(env, nodes, max_chain_length)
+    return sorted(map(sorted, cycles)), sorted(map(sorted, chains))
+
+
+def test_populate_and_erase(env):
+    for t in [0, 10, 20]:
+        nodes = env.get_living(t)
+        assert enumerate_indexed(env, nodes) == enumerate_plain(env, nodes)
+
+    env.populate(t_begin=15, seed=1)
+    for t in [10, 20, 29]:
+        nodes = env.get_living(t)
+        assert enumerate_indexed(env, nodes) == enumerate_plain(env, nodes)
+    assert enumerate_indexed(env, None) == enumerate_plain(env, None)
+
+
+def test_removed_and_death(env):
+    t = 10
+    cycles = two_cycles(env, t)
+    env.removed_container[t].update(cycles[0])
+    for s in [t, t + 1]:
+        nodes = env.get_living(s)
+        assert enumerate_indexed(env, nodes) == enumerate_plain(env, nodes)
+        weights, members, _ = env.cycle_index.arrays(t=s)
+        for w, row in zip(weights, members):
+            assert set(row[:w]).issubset(nodes)
+
+
+def test_shorter_lengths(env):
+    nodes = env.get_living(5)
+    assert enumerate_indexed(env, nodes, 2, 0) == enumerate_plain(env, nodes, 2, 0)
+
+
+def test_snapshot(env):
+    t = 12
+    env.removed_container[t - 1].update(two_cycles(env, t - 1)[0])
+    snap = snapshot(env, t)
+    nodes = snap.get_living(t)
+    assert enumerate_indexed(snap, nodes) == enumerate_plain(snap, nodes)
+
+    snap.populate(t_begin=t + 1, seed=2)
+    for s in [t, t + 5]:
+        nodes = snap.get_living(s)
+        assert enumerate_indexed(snap, nodes) == enumerate_plain(snap, nodes)
+        plain = sorted(tuple(sorted(c)) for c in two_cycles(snap, None, nodes=sorted(nodes))
+                       if snap.cycle_index is not None)
+        index, snap.cycle_index = snap.cycle_index, None
+        assert plain == sorted(tuple(sorted(c)) for c in two_cycles(snap, None, nodes=sorted(nodes)))
+        snap.cycle_index = index
+
+
+def test_dead_entries_are_retired():
+    env = ABOKidneyExchange(entry_rate=5, death_rate=.2, time_length=200,
+                            fraction_ndd=.1, seed=1, populate=False)
+    index = env.attach_cycle_index(max_cycle_length=3, max_chain_length=2)
+    env.populate(seed=1)
+    total = len(index)
+
+    for t in range(0, 200, 10):
+        nodes = env.get_living(t)
+        assert enumerate_indexed(env, nodes) == enumerate_plain(env, nodes)
+    # Only entries that can still be alive remain in the arrays
+    assert index.size - index.n_inactive < total / 4
+    assert len(index) == total
+
+    # Going back in time restores what was retired
+    for t in [3, 150]:
+        nodes = env.get_living(t)
+        assert enumerate_indexed(env, nodes) == enumerate_plain(env, nodes)
+    assert enumerate_indexed(env, None) == enumerate_plain(env, None)
+
+
+def test_erase_drops_retired_entries(env):
+    nodes = env.get_living(25)
+    enumerate_indexed(env, nodes)
+    env.erase_from(5)
+    env.populate(t_begin=5, seed=3)
+    for t in [0, 10, 20]:
+        nodes = env.get_living(t)
+        assert enumerate_indexed(env, nodes) == enumerate_plain(env, nodes)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.utils.cycle_ranking import CycleRanking, cycle_index, cycle_scores, \
+    rank_cycles
+from matching.utils.data_utils import get_cycle_probabilities
+
+
+@pytest.fixture
+def env():
+    return ABOKidneyExchange(entry_rate=3, death_rate=.1, time_length=10, seed=1)
+
+
+def random_probs(net, env, t):
+    return np.random.RandomState(t).rand(len(env.get_living(t)))
+
+
+def test_scores_match_loop():
+    living = [4, 9, 2, 7, 11]
+    cycles = [(4, 9), (2, 7, 11), (9, 11)]
+    probs = np.array([.1, .5, .3, .9, .2])
+    expected = [np.mean([probs[living.index(v)] for v in c]) for c in cycles]
+    assert np.allclose(cycle_scores(probs, cycle_index(living, cycles)), expected)
+    assert np.allclose(get_cycle_probabilities(living, cycles, probs), expected)
+
+
+def test_unknown_pair():
+    with pytest.raises(ValueError):
+        cycle_index([1, 2], [(1, 5)])
+
+
+def test_top_and_select():
+    ranking = CycleRanking([0, 1, 2, 3], [(0, 1), (2, 3)], np.array([.2, .4, .9, .5]))
+    assert ranking.top() == [((2, 3), pytest.approx(.7)), ((0, 1), pytest.approx(.3))]
+    assert ranking.select(thres=.5) == [(2, 3)]
+    assert ranking.best(thres=.8) is None
+
+
+def test_rank_optimal_cycles(env):
+    for t in range(env.time_length):
+        ranking = rank_cycles(None, env, t, evaluate=random_probs)
+        probs = random_probs(None, env, t)
+        living = env.get_living(t)
+        scores = [s for _, s in ranking.top()]
+        assert scores == sorted(scores, reverse=True)
+        for c, s in ranking.top():
+            assert s == pytest.approx(np.mean([probs[living.index(v)] for v in c]))
+        taken = [v for c in ranking.select() for v in c]
+        assert len(taken) == len(set(taken))
@@ -0,0 +1,73 @@
+import pytest
+import random
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.tree_search import engine
+
+
+@pytest.fixture
+def env():
+    return ABOKidneyExchange(entry_rate=3, death_rate=.01, time_length=10, seed=1)
+
+
+@pytest.mark.parametrize("strategy", [engine.Strategy(),
+                                      engine.GreedyStrategy(),
+                                      engine.SuperGreedyStrategy()])
+def test_strategies(env, strategy):
+    random.seed(0)
+    actions = list(strategy.actions(env, 5))
+    a = engine.mcts(env, 5, strategy, tpa=2, tree_horizon=1, rollout_horizon=2, seed=0)
+    assert a in actions
+
+
+def test_seed_makes_search_reproducible(env):
+    def search():
+        random.seed(0)
+        tree = engine.grow(env, 5, engine.Strategy(), n_iters=20, seed=3, scalar=1,
+                           tree_horizon=2, rollout_horizon=2, n_rollouts=1)
+        return engine.root_stats(tree)
+    first, second = search(), search()
+    assert [(a, v) for a, v, _ in first] == [(a, v) for a, v, _ in second]
+
+
+def test_root_parallel_merges_visits(env):
+    random.seed(0)
+    actions = engine.Strategy().actions(env, 5)
+    n_act = len(actions)
+    kwargs = dict(scalar=1, tree_horizon=1, rollout_horizon=2, n_rollouts=1)
+    stats = engine.merge_stats([engine._grow_job((env, 5, engine.Strategy(), 6, s, None, 4,
+                                                  None, False, kwargs))[0]
+                                for s in range(2)])
+    assert sum(v for _, v, _ in stats) == 12
+    assert len(stats) <= n_act
+    assert engine.mcts(env, 5, tpa=2, tree_horizon=1, rollout_horizon=2,
+                       seed=0, n_workers=2) in actions
+
+
+def test_shared_futures(env):
+    random.seed(0)
+    tree = engine.grow(env, 5, engine.Strategy(), n_iters=10, seed=0, scalar=1,
+                       tree_horizon=1, rollout_horizon=2, n_rollouts=1, n_futures=3)
+    # Every child of the root was evaluated against the root's futures
+    assert list(tree.future_pools) == [0]
+    assert len(tree.future_pools[0]) == 3
+    with pytest.raises(ValueError):
+        engine.mcts(env, 5, engine.GreedyStrategy(), tpa=2, tree_horizon=1,
+                    rollout_horizon=2, n_futures=2, seed=0)
+
+
+class SerialPool:
+
+    def map(self, fn, jobs):
+        return list(map(fn, jobs))
+
+
+def test_leaf_batches(env):
+    random.seed(0)
+    tree = engine.grow(env, 5, engine.Strategy(), n_iters=10, seed=0, pool=SerialPool(),
+                       batch_size=4, scalar=1, tree_horizon=1, rollout_horizon=2,
+                       n_rollouts=1)
+    # Virtual losses are all taken back
+    assert tree.visits[0] == 10
+    assert tree.visits[tree.children(0)].sum() == 10
+    assert engine.mcts(env, 5, tpa=2, tree_horizon=1, rollout_horizon=2, seed=0,
+                       n_workers=2, parallel="leaf") in engine.Strategy().actions(env, 5)
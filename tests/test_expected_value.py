@@ -0,0 +1,62 @@
+import pytest
+import numpy as np
+from matching.environment.saidman_environment import SaidmanKidneyExchange
+from matching.solver.expected_value import cycle_values, chain_values, \
+    unordered_cycle_values, expected_value, edge_success_probs
+from matching.solver.kidney_solver2 import optimal, greedy
+from matching.trimble_solver import interface
+
+
+@pytest.fixture
+def env():
+    return SaidmanKidneyExchange(entry_rate=5, death_rate=.1, time_length=20,
+                                 fraction_ndd=.1, seed=12345, populate=True)
+
+
+def test_scalar_values(env):
+    assert cycle_values(env, [(0, 1), (0, 1, 2)], .5) == pytest.approx([.5, 3 / 8])
+    assert chain_values(env, [(0, 1), (0, 1, 2)], .5) == pytest.approx([1, 1.25])
+    assert expected_value(env, [(0, 1)], [(0, 1, 2)]) == 5
+
+
+def test_pra_values(env):
+    u, v, w = 0, 1, 2
+    pra = np.array([env.node[x]["pra"] for x in (u, v, w)])
+    probs = edge_success_probs(env, [u, v, w], [v, w, u], "pra")
+    assert probs == pytest.approx(1 - pra[[1, 2, 0]])
+    assert cycle_values(env, [(u, v, w)], "pra")[0] == pytest.approx(3 * np.prod(1 - pra))
+    assert chain_values(env, [(u, v, w)], "pra")[0] == \
+        pytest.approx(2 * (1 - pra[1]) + (1 - pra[1]) * (1 - pra[2]))
+
+
+def test_unordered_takes_best_orientation(env):
+    cycles = optimal(env, 0, 5, max_cycle_length=3)["matched_cycles"]
+    cycles = [c for cs in cycles.values() for c in cs]
+    values = unordered_cycle_values(env, cycles, "pra")
+    for c, value in zip(cycles, values):
+        assert 0 < value <= len(c)
+
+
+@pytest.mark.parametrize("edge_success_prob", [1, .7, "pra"])
+def test_kidney_solver2_obj_is_expected_value(env, edge_success_prob):
+    sol = optimal(env, 0, 5, max_cycle_length=3, edge_success_prob=edge_success_prob)
+    cycles = [c for cs in sol["matched_cycles"].values() for c in cs]
+    assert sol["obj"] == pytest.approx(unordered_cycle_values(env, cycles, edge_success_prob).sum())
+    if edge_success_prob == 1:
+        assert sol["obj"] == len(sol["matched_pairs"])
+
+    g = greedy(env, 0, 5, max_cycle_length=2, edge_success_prob=edge_success_prob)
+    assert g["obj"] <= sum(len(m) for m in g["matched"].values())
+
+
+@pytest.mark.parametrize("edge_success_prob", [.7, "pra"])
+@pytest.mark.parametrize("formulation", ["hpief_prime_full_red", "picef", "ccf", "picef_sparse"])
+def test_interface_obj_is_expected_value(env, edge_success_prob, formulation):
+    opt = interface.optimal(env, 3, 0, t_begin=0, t_end=5, formulation=formulation,
+                            edge_success_prob=edge_success_prob)
+    g_pairs, _ = interface.separate_ndds(env.subgraph(env.get_living(0, 5)))
+    cycles = [tuple(g_pairs[v.id] for v in c) for c in opt["opt"].cycles]
+    assert opt["obj"] == pytest.approx(cycle_values(env, cycles, edge_success_prob).sum())
+
+    # Failure-aware solutions cannot do better than the deterministic one
+    assert opt["obj"] <= interface.optimal(env, 3, 0, t_begin=0, t_end=5)["obj"]
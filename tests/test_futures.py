@@ -0,0 +1,54 @@
+import pytest
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.solver.kidney_solver2 import compare_optimal, same_rewards
+from matching.tree_search.engine import mcts
+from matching.utils.env_utils import two_cycles
+from matching.utils.futures import FuturePool, death_times
+
+
+@pytest.fixture
+def env():
+    return ABOKidneyExchange(entry_rate=3, death_rate=.01, time_length=10, seed=1)
+
+
+def test_futures_are_reproducible(env):
+    a = FuturePool(env, 5, 3, n_futures=2, seed=7)
+    b = FuturePool(env, 5, 3, n_futures=2, seed=7)
+    for k in range(2):
+        assert sorted(a.future(k).nodes()) == sorted(b.future(k).nodes())
+        assert sorted(a.future(k).edges()) == sorted(b.future(k).edges())
+
+
+def test_compare_matches_compare_optimal(env):
+    pool = FuturePool(env, 5, 3, n_futures=3, seed=7)
+    for k in range(3):
+        fut = pool.future(k)
+        for taken in two_cycles(fut, 6):
+            take, leave = pool.compare(k, taken)
+            take_obj, leave_obj = compare_optimal(fut, 6, 8, set(taken))
+            assert (take["obj"], leave["obj"]) == (take_obj, leave_obj)
+
+
+def test_same_rewards_matches_solver():
+    # Futures last until the present pairs die, so they must die quickly
+    env = ABOKidneyExchange(entry_rate=3, death_rate=.1, time_length=10, seed=1)
+    pool = FuturePool(env, 5, None, n_futures=2, seed=7)
+    for k in range(2):
+        fut = pool.future(k)
+        assert pool.end(k) == max(death_times(fut, fut.get_living(5))) + 1
+        for taken in two_cycles(fut, 5):
+            t_end = max(death_times(fut, taken)) + 1
+            assert pool.same_rewards(k, taken, t_end) == \
+                same_rewards(fut, 5, t_end, taken)
+
+
+def test_futures_end(env):
+    pool = FuturePool(env, 5, 3, n_futures=1, seed=7)
+    with pytest.raises(ValueError):
+        pool.cycles(0, t_end=9)
+
+
+def test_mcts_with_futures_is_reproducible(env):
+    actions = [mcts(env, 5, tpa=2, tree_horizon=2, rollout_horizon=2,
+                    n_futures=2, seed=3) for _ in range(2)]
+    assert actions[0] == actions[1]
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from multiprocessing import Pool
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.solver.kidney_solver2 import compare_optimal
+from matching.tree_search.budget import Budget
+from matching.tree_search import montecarlo
+from matching.tree_search.montecarlo import MonteCarlo
+from matching.utils.futures import FuturePool
+
+
+@pytest.fixture
+def env():
+    return ABOKidneyExchange(entry_rate=3, death_rate=.1, time_length=10, seed=1)
+
+
+def first_t_with_arms(env, n_arms=2):
+    for t in range(env.time_length):
+        sim = MonteCarlo(env, t, np.zeros(len(env.get_living(t))), 0)
+        if sim.n_arms >= n_arms:
+            return t
+    pytest.skip("No period with enough 2-cycles")
+
+
+def make(env, t, **kwargs):
+    np.random.seed(0)
+    return MonteCarlo(env, t, np.zeros(len(env.get_living(t))), 0,
+                      horizons=(1, 3), **kwargs)
+
+
+def test_compare_from_t(env):
+    t = first_t_with_arms(env, 1)
+    pool = FuturePool(env, t, 4, n_futures=1, seed=3)
+    fut = pool.future(0)
+    for arm in MonteCarlo(env, t, np.zeros(len(env.get_living(t))), 0).arms:
+        take, leave = pool.compare(0, arm, t_end=t + 4, t_begin=t)
+        assert (take["obj"], leave["obj"]) == compare_optimal(fut, t, t + 4, arm)
+
+
+def test_workers_match_sequential(env):
+    t = first_t_with_arms(env)
+    seq = make(env, t)
+    seq.simulate(n_iters=4)
+    with Pool(2) as pool:
+        par = make(env, t, pool=pool)
+        par.simulate(n_iters=4)
+    assert np.array_equal(seq.wins, par.wins)
+    assert np.array_equal(seq.trials, par.trials)
+
+
+def test_success_rates(env):
+    t = first_t_with_arms(env)
+    sim = make(env, t)
+    sim.simulate(n_iters=4)
+    rates = sim.success_rates()
+    assert len(rates) == sim.n_arms
+    assert (rates["trials"] == 4).all()
+    assert ((rates["lower"] <= rates["rate"]) & (rates["rate"] <= rates["upper"])).all()
+    assert ((rates["lower"] >= 0) & (rates["upper"] <= 1)).all()
+
+
+def test_time_budget(env):
+    t = first_t_with_arms(env)
+    sim = make(env, t)
+    sim.simulate(budget=Budget(max_ms=1))
+    assert sim.budget.stopped == "time"
+    assert sim.trials[0] == len(sim.horizons)
+
+
+def test_separated_arm_is_chosen_over_priors(env, monkeypatch):
+    t = first_t_with_arms(env)
+    sim = make(env, t)
+    # The priors favour the first arm, but only the last one ever wins
+    sim.successes[0] = 1e6
+    monkeypatch.setattr(montecarlo, "_future_job",
+                        lambda args: np.arange(len(args[4])) == len(args[4]) - 1)
+    budget = Budget(max_rollouts=100)
+    assert sim.simulate(budget=budget) == sim.arms[-1]
+    assert budget.stopped == "separated"
+    assert sim.trials[0] < 100
+
+
+def test_priors_break_ties(env, monkeypatch):
+    t = first_t_with_arms(env)
+    sim = make(env, t)
+    sim.successes[0] = 1e6
+    monkeypatch.setattr(montecarlo, "_future_job", lambda args: np.zeros(len(args[4]), bool))
+    assert sim.simulate(n_iters=4) == sim.arms[0]
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.tree_search.optimal_simulation import OptimalSimulation, optimal_matches, \
+    sprt_separated
+
+
+@pytest.fixture
+def env():
+    return ABOKidneyExchange(entry_rate=3, death_rate=.1, time_length=10, seed=1)
+
+
+def first_t_with_cycles(env):
+    return next(t for t in range(env.time_length) if OptimalSimulation(env, t).n_arms > 2)
+
+
+def test_sprt():
+    m = np.zeros((20, 3), dtype=bool)
+    assert not sprt_separated(m, .05, .05, .1)
+    m[:, 0] = True
+    assert sprt_separated(m, .05, .05, .1)
+    # Matched together, so never discordant
+    m[:, 1] = True
+    assert not sprt_separated(m, .05, .05, .1)
+
+
+def test_one_solve_serves_both_methods(env):
+    t = first_t_with_cycles(env)
+    np.random.seed(0)
+    optsim = OptimalSimulation(env, t)
+    counts = optsim.simulate_optimal(horizon=2, n_iters=6, alpha=1e-9)
+    assert len(optsim.samples) == 6 or optsim.stopped == "majority"
+    assert set(counts) == set(optsim.arms)
+
+    pairs = optsim.counts("pairs")
+    for cycle, n in counts.items():
+        if cycle is not None:
+            assert all(pairs[v] >= n for v in cycle)
+
+
+def test_workers_match_sequential(env):
+    t = first_t_with_cycles(env)
+    results = []
+    for n_workers in (1, 2):
+        np.random.seed(0)
+        optsim = OptimalSimulation(env, t)
+        results.append(optsim.simulate_optimal(horizon=2, n_iters=4, n_workers=n_workers,
+                                               batch_size=2))
+    assert results[0] == results[1]
+
+
+def test_window_solve(env):
+    t = first_t_with_cycles(env)
+    optsim = OptimalSimulation(env, t)
+    optsim.env.populate(t + 1, t + 3, seed=0)
+    cycles, pairs = optimal_matches(optsim.env, t, 2)
+    # Present pairs are matched at t, whatever period they arrived in
+    assert set(pairs) == {v for c in cycles for v in c}
+    assert set(pairs) <= set(optsim.env.get_living(t))
+    assert all(c in optsim.arms for c in cycles)
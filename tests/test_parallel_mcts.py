@@ -0,0 +1,98 @@
+import pytest
+import random
+import numpy as np
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.tree_search import engine
+from matching.tree_search.engine import merge_stats
+from matching.tree_search.mcts import mcts, evaluate_policies, evaluate_priors, \
+    priors_from_policy
+from matching.utils.env_utils import get_actions
+
+
+@pytest.fixture
+def env():
+    return ABOKidneyExchange(entry_rate=3, death_rate=.01, time_length=10, seed=1)
+
+
+def test_merge_stats_sums_visits():
+    stats = merge_stats([[((0, 1), 3, 2.5), (None, 1, 1.)],
+                         [((0, 1), 2, 1.5)]])
+    assert {a: (v, r) for a, v, r in stats} == {(0, 1): (5, 4.), None: (1, 1.)}
+
+
+@pytest.mark.parametrize("parallel", ["root", "leaf"])
+def test_parallel_mcts_returns_action(env, parallel):
+    np.random.seed(0)
+    random.seed(0)
+    t = 5
+    a = mcts(env, t, tpa=2, tree_horizon=2, rollout_horizon=2,
+             n_workers=2, parallel=parallel)
+    assert a in get_actions(env, t)
+
+
+class FakeGCN:
+    """Scores each node by its out-degree, counting forward passes."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def forward(self, A, X):
+        self.calls += 1
+        return FakeTensor(A.sum(2) / 100)
+
+
+class FakeTensor:
+
+    def __init__(self, array):
+        self.data = self
+        self.array = array
+
+    def numpy(self):
+        return self.array
+
+
+def test_batched_policies_match_single_evaluations(env):
+    net = FakeGCN()
+    ts = (3, 5, 7)
+    ps = evaluate_policies(net, [env] * len(ts), ts)
+    assert net.calls == 1
+    for t, p in zip(ts, ps):
+        actions = tuple(get_actions(env, t))
+        assert priors_from_policy(p, actions) == pytest.approx(
+            evaluate_priors(net, env, t, actions))
+
+
+def test_priors_are_computed_once_per_node(env):
+    net = FakeGCN()
+    np.random.seed(0)
+    random.seed(0)
+    mcts(env, 5, net=net, tpa=3, tree_horizon=2, rollout_horizon=2)
+    # At most one forward pass per iteration, plus the root
+    n_iters = 3 * len(get_actions(env, 5))
+    assert net.calls <= n_iters + 1
+
+
+class SerialPool:
+
+    def map(self, fn, jobs):
+        return list(map(fn, jobs))
+
+
+def test_leaf_batches_evaluate_priors_together(env):
+    net = FakeGCN()
+    random.seed(0)
+    n_iters, batch_size = 48, 8
+    tree = engine.grow(env, 5, engine.Strategy(net), n_iters=n_iters, seed=0,
+                       pool=SerialPool(), batch_size=batch_size, scalar=1, tree_horizon=3,
+                       rollout_horizon=2, n_rollouts=1)
+    expanded = np.sum(tree.n_children[:len(tree)] > 1)
+    # At most one forward pass per batch, for more expanded nodes
+    assert net.calls <= n_iters // batch_size
+    assert net.calls < expanded
+    assert not tree.unscored
+    # Same priors as evaluating each node on its own
+    for v in np.flatnonzero(tree.n_children[:len(tree)] > 1):
+        kids = tree.children(v)
+        actions = tuple(tree.get_action(c) for c in kids)
+        assert tree.prior[kids] == pytest.approx(
+            evaluate_priors(net, tree.env(v), tree.t[v], actions))
@@ -0,0 +1,68 @@
+import json
+import time
+import pytest
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.solver.kidney_solver2 import optimal
+from matching.tree_search import engine
+from matching.utils import profiling
+from matching.utils.profiling import Profiler, count, profiled, timer
+
+
+@profiled("outer")
+def outer():
+    with timer("inner"):
+        time.sleep(.01)
+    count("calls")
+
+
+def test_disabled():
+    assert profiling.active() is None
+    assert timer("inner") is timer("other")
+    outer()
+
+
+def test_nested_stacks():
+    with Profiler() as prof:
+        outer()
+        outer()
+    assert profiling.active() is None
+    assert prof.calls[("outer",)] == 2
+    assert prof.calls[("outer", "inner")] == 2
+    assert prof.counters["calls"] == 2
+    assert prof.seconds[("outer",)] >= prof.seconds[("outer", "inner")] >= .02
+    assert prof.self_seconds(("outer",)) == \
+        pytest.approx(prof.seconds[("outer",)] - prof.seconds[("outer", "inner")])
+
+
+def test_exports(tmp_path):
+    with Profiler() as prof:
+        outer()
+    prof.to_json(tmp_path / "profile.json")
+    report = json.load(open(tmp_path / "profile.json"))
+    assert set(report["names"]) == {"outer", "inner"}
+    assert report["counters"] == {"calls": 1}
+
+    prof.to_collapsed(tmp_path / "profile.folded")
+    lines = dict(l.rsplit(" ", 1) for l in open(tmp_path / "profile.folded").read().splitlines())
+    assert int(lines["outer;inner"]) >= 10000
+
+
+def test_environment_and_solver():
+    with Profiler() as prof:
+        env = ABOKidneyExchange(entry_rate=3, death_rate=.1, time_length=10, seed=1)
+        optimal(env, 0, 5)
+    names = prof.report()["names"]
+    for name in ["populate", "draw_edges", "get_living", "get_cycles",
+                 "solve.build", "solve.optimize", "parse_solution"]:
+        assert name in names
+    assert prof.counters["populate.nodes"] == env.number_of_nodes()
+
+
+def test_engine_stacks():
+    env = ABOKidneyExchange(entry_rate=3, death_rate=.1, time_length=10, seed=1)
+    with Profiler() as prof:
+        engine.mcts(env, 5, tpa=2, tree_horizon=1, rollout_horizon=2, seed=0)
+    stacks = [s["stack"] for s in prof.report()["stacks"]]
+    assert ["mcts", "mcts.grow", "mcts.run", "mcts.strategy_rollout", "mcts.rollout"] in stacks
+    # No timer is nested in one of the same name
+    assert all(len(set(s)) == len(s) for s in stacks)
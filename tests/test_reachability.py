@@ -0,0 +1,63 @@
+import pytest
+import networkx as nx
+import numpy as np
+from collections import deque
+from matching.trimble_solver.kidney_digraph import Digraph
+from matching.trimble_solver.kidney_reachability import BoundedReachability
+
+
+@pytest.fixture
+def g():
+    return nx.gnp_random_graph(60, 0.07, directed=True, seed=12345)
+
+
+def bfs(g, source, max_dist):
+    dists = {source: 0}
+    q = deque([source])
+    while q:
+        v = q.popleft()
+        if dists[v] >= max_dist:
+            break
+        for w in g.successors(v):
+            if w not in dists:
+                dists[w] = dists[v] + 1
+                q.append(w)
+    return dists
+
+
+def to_digraph(g, nodes):
+    idx = {v: i for i, v in enumerate(nodes)}
+    d = Digraph(len(nodes))
+    for v, w in g.subgraph(nodes).edges():
+        d.add_edge(1, d.vs[idx[v]], d.vs[idx[w]])
+    return d
+
+
+@pytest.mark.parametrize("max_dist", [1, 2, 3])
+def test_update_matches_bfs(g, max_dist):
+    rng = np.random.RandomState(0)
+    reach = BoundedReachability(max_dist)
+    for _ in range(20):
+        pool = set(rng.choice(60, size=rng.randint(5, 50), replace=False))
+        reach.update(g, pool)
+        subg = g.subgraph(pool)
+        assert set(reach.dist_from) == pool
+        for u in pool:
+            assert reach.dist_from[u] == bfs(subg, u, max_dist)
+            for v, d in reach.dist_from[u].items():
+                assert reach.dist_to[v][u] == d
+
+
+@pytest.mark.parametrize("max_cycle", [2, 3, 4])
+def test_cached_cycles_are_the_same(g, max_cycle):
+    rng = np.random.RandomState(1)
+    reach = BoundedReachability(max_cycle - 1)
+    for _ in range(5):
+        nodes = sorted(rng.choice(60, size=40, replace=False))
+        reach.update(g, nodes)
+        plain = to_digraph(g, nodes)
+        cached = to_digraph(g, nodes)
+        cached.attach_reachability(reach, nodes)
+        c1 = sorted(tuple(v.id for v in c) for c in plain.find_cycles(max_cycle))
+        c2 = sorted(tuple(v.id for v in c) for c in cached.find_cycles(max_cycle))
+        assert c1 == c2
@@ -0,0 +1,81 @@
+import os
+import pytest
+from multiprocessing import Pool
+from time import sleep, time
+from matching.utils.runner import current_job, param_grid, ResultStore, run_experiment
+
+
+def job(x, y):
+    if x < 0:
+        raise ValueError("negative")
+    if y == "slow":
+        sleep(30)
+    return [{"t": t, "value": x * t} for t in range(3)]
+
+
+def own_params(x):
+    return {"seen": current_job()}
+
+
+def pool_job(path):
+    with Pool(2) as pool:
+        pids = [p.pid for p in pool._pool]
+        with open(path, "w") as f:
+            f.write(" ".join(map(str, pids)))
+        # Busy workers, which would not notice the job is gone
+        pool.map(sleep, [30, 30], chunksize=1)
+
+
+def alive(pid):
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.fixture
+def store(tmpdir):
+    return ResultStore(str(tmpdir.join("results.db")))
+
+
+def test_param_grid():
+    grid = param_grid(a=[1, 2], b=["x", "y", "z"])
+    assert len(grid) == 6
+    assert {"a": 2, "b": "z"} in grid
+
+
+def test_statuses_and_resume(store):
+    grid = param_grid(x=[-1, 1, 2], y=["fast"]) + [{"x": 3, "y": "slow"}]
+    counts = run_experiment("test", job, grid, store, n_jobs=2, timeout=2, verbose=False)
+    assert counts == {"ok": 2, "error": 1, "timeout": 1, "skipped": 0}
+
+    df = store.to_frame("test")
+    assert len(df) == 6
+    assert sorted(df[df.t == 2].value) == [2, 4]
+
+    # Nothing left to do, unless failed jobs are retried
+    counts = run_experiment("test", job, grid, store, verbose=False)
+    assert counts["skipped"] == 4
+    counts = run_experiment("test", job, grid[:3], store, retry_failed=True, verbose=False)
+    assert counts == {"ok": 0, "error": 1, "timeout": 0, "skipped": 2}
+
+
+def test_current_job(store):
+    run_experiment("params", own_params, param_grid(x=[1, 2]), store, verbose=False)
+    df = store.to_frame("params")
+    assert all(df.seen == [{"x": x} for x in df.x])
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc")
+def test_timeout_stops_job_pools(store, tmpdir):
+    path = str(tmpdir.join("pids"))
+    counts = run_experiment("pools", pool_job, [{"path": path}], store, timeout=2, verbose=False)
+    assert counts["timeout"] == 1
+
+    pids = [int(p) for p in open(path).read().split()]
+    assert len(pids) == 2
+    deadline = time() + 5
+    while any(alive(p) for p in pids) and time() < deadline:
+        sleep(.1)
+    assert not any(alive(p) for p in pids)
@@ -0,0 +1,56 @@
+import pytest
+import numpy as np
+import matching.trimble_solver.kidney_ip as k_ip
+import matching.trimble_solver.kidney_ip_sparse as k_ip_sparse
+from matching.trimble_solver.kidney_digraph import Digraph
+from matching.trimble_solver.kidney_ndds import Ndd, NddEdge
+
+
+def random_instance(seed, n=20, n_ndds=3, p=.12, per_edge=False):
+    rng = np.random.RandomState(seed)
+    d = Digraph(n)
+    for i in range(n):
+        for j in range(n):
+            if i != j and rng.rand() < p:
+                d.add_edge(1, d.vs[i], d.vs[j],
+                           success_prob=rng.uniform(.3, 1) if per_edge else 1)
+    ndds = [Ndd() for _ in range(n_ndds)]
+    for ndd in ndds:
+        for j in rng.choice(n, size=3, replace=False):
+            ndd.add_edge(NddEdge(d.vs[j], 1))
+    return d, ndds
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("max_cycle,max_chain", [(2, 0), (3, 2), (3, 3)])
+@pytest.mark.parametrize("loop_fn,sparse_fn", [
+    (k_ip.optimise_picef, k_ip_sparse.optimise_picef_sparse),
+    (k_ip.optimise_hpief_prime, k_ip_sparse.optimise_hpief_prime_sparse),
+    (k_ip.optimise_hpief_prime_full_red, k_ip_sparse.optimise_hpief_prime_full_red_sparse),
+    (k_ip.optimise_hpief_2prime, k_ip_sparse.optimise_hpief_2prime_sparse)])
+def test_same_objective(seed, max_cycle, max_chain, loop_fn, sparse_fn):
+    d, ndds = random_instance(seed)
+    loop = loop_fn(k_ip.OptConfig(d, ndds, max_cycle, max_chain))
+    d, ndds = random_instance(seed)
+    sparse = sparse_fn(k_ip.OptConfig(d, ndds, max_cycle, max_chain))
+    assert sparse.ip_model.ObjVal == pytest.approx(loop.ip_model.ObjVal)
+    assert sparse.total_score == pytest.approx(sparse.ip_model.ObjVal)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_picef_per_edge_probabilities(seed):
+    d, ndds = random_instance(seed, per_edge=True)
+    loop = k_ip.optimise_picef(k_ip.OptConfig(d, ndds, 3, 0))
+    d, ndds = random_instance(seed, per_edge=True)
+    sparse = k_ip_sparse.optimise_picef_sparse(k_ip.OptConfig(d, ndds, 3, 0))
+    assert sparse.ip_model.ObjVal == pytest.approx(loop.ip_model.ObjVal)
+
+
+def test_matrix_file(tmpdir):
+    d, ndds = random_instance(0)
+    filename = str(tmpdir.join("picef.npz"))
+    opt = k_ip_sparse.optimise_picef_sparse(k_ip.OptConfig(d, ndds, 3, 2, matrix_file=filename))
+    c, A, sense, rhs = k_ip_sparse.load_matrices(filename)
+    assert A.shape == (len(rhs), len(c))
+    assert len(c) == opt.ip_model.NumVars
+    assert A.shape[0] == opt.ip_model.NumConstrs
@@ -0,0 +1,108 @@
+import pytest
+import random
+import numpy as np
+from itertools import combinations
+from matching.environment.abo_environment import ABOKidneyExchange
+from matching.tree_search import engine, mcts, mcts_greedy
+from matching.tree_search.compact_tree import CompactTree
+from matching.tree_search.transpositions import state_key
+
+
+@pytest.fixture
+def env():
+    return ABOKidneyExchange(entry_rate=3, death_rate=.01, time_length=10, seed=1)
+
+
+def make_tree(env, t):
+    random.seed(0)
+    return CompactTree(env, t, engine.Strategy(), seed=0, transpositions=True)
+
+
+def child(tree, node, action):
+    if tree.n_children[node] < 0:
+        tree.allocate_children(node)
+    return next(c for c in tree.children(node) if tree.get_action(c) == action)
+
+
+def key(tree, node):
+    return state_key(tree.env(node), tree.t[node])
+
+
+def test_orders_of_the_same_actions_share_stats(env):
+    tree = make_tree(env, 5)
+    cycles = [x for x in tree.root_actions if x is not None]
+    a, b = next((a, b) for a, b in combinations(cycles, 2) if not set(a) & set(b))
+    ab = child(tree, child(tree, 0, a), b)
+    ba = child(tree, child(tree, 0, b), a)
+    assert key(tree, ab) == key(tree, ba)
+    tree.share(ab)
+    tree.share(ba)
+    assert tree.rows(ab) == tree.rows(ba)
+    tree.backup(ab, 1.)
+    assert tree.stats([ba])[0][0] == 1
+
+
+def test_different_pools_at_the_same_t(env):
+    tree = make_tree(env, 5)
+    a = next(x for x in tree.root_actions if x is not None)
+    after_take = child(tree, child(tree, 0, a), None)
+    after_leave = child(tree, 0, None)
+    assert tree.t[after_take] == tree.t[after_leave]
+    assert set(a) <= set(tree.env(after_leave).get_living(tree.t[after_leave]))
+    assert not set(a) & set(tree.env(after_take).get_living(tree.t[after_take]))
+    assert key(tree, after_take) != key(tree, after_leave)
+    tree.share(after_take)
+    tree.share(after_leave)
+    assert tree.rows(after_take) != tree.rows(after_leave)
+
+
+def test_transposed_nodes_skip_rollouts(env, monkeypatch):
+    random.seed(0)
+    calls = []
+    rollout = engine.Strategy.rollout
+    monkeypatch.setattr(engine.Strategy, "rollout",
+                        lambda *args: calls.append(1) or rollout(*args))
+    n_iters = 60
+    tree = engine.grow(env, 5, engine.Strategy(), n_iters=n_iters, seed=0,
+                       transpositions=True, scalar=1, tree_horizon=1,
+                       rollout_horizon=2, n_rollouts=1)
+    assert tree.hits > 0
+    assert len(calls) < n_iters
+    assert tree.visits[0] == n_iters
+    # Nodes sharing a row are in the same state
+    shared = np.flatnonzero(tree.stat[:len(tree)] != np.arange(len(tree)))
+    assert len(shared) > 0
+    for v in shared:
+        assert key(tree, v) == key(tree, tree.stat[v])
+
+
+def test_shared_visits_sum_over_paths(env):
+    tree = make_tree(env, 5)
+    cycles = [x for x in tree.root_actions if x is not None]
+    a, b = next((a, b) for a, b in combinations(cycles, 2) if not set(a) & set(b))
+    ab = child(tree, child(tree, 0, a), b)
+    ba = child(tree, child(tree, 0, b), a)
+    assert not tree.share(ab)
+    # Shared before either path was visited
+    assert not tree.share(ba)
+    assert tree.rows(ba) == ab
+    tree.backup(ab, 1.)
+    tree.backup(ab, 1.)
+    tree.backup(ba, 2.)
+    visits, reward, _ = tree.stats([ab, ba])
+    assert list(visits) == [3, 3] and list(reward) == [4., 4.]
+    # Each path's own ancestors only count the visits made through it
+    assert tree.stats([tree.parent[ab], tree.parent[ba]])[0].tolist() == [2, 1]
+    assert tree.visits[0] == 3
+
+
+@pytest.mark.parametrize("module, strategy", [(mcts, engine.Strategy),
+                                              (mcts_greedy, engine.GreedyStrategy)])
+def test_mcts_with_transpositions(env, module, strategy):
+    np.random.seed(0)
+    random.seed(0)
+    actions = strategy().actions(env, 5)
+    choices = [module.mcts(env, 5, tpa=2, tree_horizon=2, rollout_horizon=2,
+                           transpositions=True, seed=0) for _ in range(2)]
+    assert choices[0] == choices[1]
+    assert choices[0] in actions